@@ -0,0 +1,74 @@
+"""
+Sidebar activity feed.
+
+The recent votes, locations, awards and replies are rendered into a single cached fragment,
+rebuilt by the refresh_feed timer every FEED_CACHE_SECS. Pages only read the fragment. When
+the timer is late, or moderation marks the feed stale, the first request renders it again
+while the others are served the previous copy for up to FEED_STALE_SECS.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.template import loader
+
+from biostar.accounts.models import Profile
+from biostar.forum import caching
+from biostar.forum.models import Post, Vote, Award
+
+logger = logging.getLogger('engine')
+
+FEED_KEY = caching.fragment_key(caching.FEED, "default")
+
+
+def max_age():
+    # Oldest feed a page may show, in seconds.
+    return settings.FEED_CACHE_SECS + settings.FEED_STALE_SECS
+
+
+def feed_context():
+    """
+    Recent activity shown in the feed.
+    """
+    recent_votes = Vote.objects.filter(post__status=Post.OPEN,
+                                       post__root__status=Post.OPEN).prefetch_related("post")
+    recent_votes = recent_votes.order_by("-pk")[:settings.VOTE_FEED_COUNT]
+
+    # Get valid users that have a location set in profile.
+    recent_locations = Profile.objects.valid_users().exclude(location="").prefetch_related("user")
+    recent_locations = recent_locations.order_by('-last_login')[:settings.LOCATION_FEED_COUNT]
+
+    # Get valid results
+    recent_awards = Award.objects.valid_awards().select_related("badge", "user", "user__profile")
+    recent_awards = recent_awards.order_by("-pk")[:settings.AWARDS_FEED_COUNT]
+
+    # Get valid posts
+    recent_replies = Post.objects.valid_posts(is_toplevel=False).select_related("author__profile", "author")
+    recent_replies = recent_replies.order_by("-pk")[:settings.REPLIES_FEED_COUNT]
+
+    return dict(recent_votes=recent_votes, recent_awards=recent_awards, users=[],
+                recent_locations=recent_locations, recent_replies=recent_replies)
+
+
+def render_feed():
+    """
+    Renders the feed, returns the html and the time it was built.
+    """
+    html = loader.render_to_string('widgets/feed_default.html', context=feed_context())
+    return dict(html=html, built=time.time())
+
+
+def refresh():
+    """
+    Renders the feed and caches it for the pages.
+    """
+    caching.store(FEED_KEY, render_feed(), group=caching.FEED, ttl=settings.FEED_CACHE_SECS,
+                  stale=settings.FEED_STALE_SECS)
+
+
+def get_feed():
+    """
+    Returns the cached feed, rendering it when missing or stale.
+    """
+    return caching.get_or_build(FEED_KEY, render_feed, group=caching.FEED, ttl=settings.FEED_CACHE_SECS,
+                                stale=settings.FEED_STALE_SECS)
@@ -8,7 +8,6 @@ from urllib.parse import urlencode
 from datetime import datetime, timedelta
 from urllib.parse import quote
 
-from django.core.cache import cache
 from django.conf import settings
 from django.db.models import Q, Count
 from django.shortcuts import reverse, redirect
@@ -18,7 +17,7 @@ from django.http import JsonResponse
 from whoosh.searching import Results
 
 from biostar.accounts.models import Profile, User
-from . import auth, util, forms, tasks, search, views, const
+from . import auth, util, forms, tasks, views, const, similar, caching
 from .models import Post, Vote, Subscription
 
 
@@ -183,6 +182,7 @@ def drag_and_drop(request):
         post_type = Post.ANSWER
 
     Post.objects.filter(uid=post.uid).update(type=post_type, parent=parent)
+    caching.expire_threads(post.root_id)
 
     post.update_parent_counts()
     redir = post.get_absolute_url()
@@ -274,6 +274,8 @@ def release_suspect(request, uid):
         post.author.profile.bump_over_threshold()
 
     Post.objects.filter(uid=uid).update(spam=Post.NOT_SPAM)
+    caching.bump_version(caching.POST_LIST)
+    caching.expire_threads(post.root_id)
 
     return ajax_success(msg="Released from the quarantine.")
 
@@ -552,17 +554,10 @@ def similar_posts(request, uid):
 
     post = Post.objects.filter(uid=uid).first()
     if not post:
-        ajax_error(msg='Post does not exist.')
-
-    cache_key = f"{const.SIMILAR_CACHE_KEY}-{post.uid}"
-    results = cache.get(cache_key)
+        return ajax_error(msg='Post does not exist.')
 
-    if results is None:
-        logger.info("Setting similar posts cache.")
-        results = search.preform_search(query=post.uid, fields=['uid'], sortedby=["lastedit_date"],
-                                        more_like_this=True)
-        # Set the results cache for 1 hour
-        cache.set(cache_key, results, 3600)
+    # Neighbours are precomputed offline by the similar command.
+    results = similar.similar_posts(post=post)
 
     template_name = 'widgets/similar_posts.html'
 
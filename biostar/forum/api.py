@@ -10,7 +10,8 @@ from datetime import datetime, timedelta
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from biostar.accounts.models import Profile, User
-from . import util
+from biostar.utils import decorators
+from . import util, counters
 from .models import Post, Vote, Subscription, PostView
 
 
@@ -177,17 +178,21 @@ def daily_stats_on_date(request, year, month, day):
 @json_response
 def traffic(request):
     """
-    Traffic as post views in the last 60 min.
+    Traffic as post views in the last 60 min and the state of the buffered view counter:
+    lag of the last flush in seconds, views written and views dropped. The task pool of the
+    process reports its queue depth and the wait and run times of its tasks in seconds.
     """
     now = datetime.now()
     start = now - timedelta(minutes=60)
 
-    post_views = PostView.objects.filter(date__gt=start).exclude(date__gt=now).distinct('ip').count()
+    post_views = PostView.objects.filter(date__gt=start).exclude(date__gt=now).values('ip').distinct().count()
 
     data = {
         'date': util.datetime_to_iso(now),
         'timestamp': util.datetime_to_unix(now),
         'post_views_last_60_min': post_views,
+        'post_views_buffer': counters.stats(),
+        'task_pool': decorators.task_stats(),
     }
     return data
 
@@ -2,6 +2,7 @@ import datetime
 import logging
 import json
 import hashlib
+import re
 
 import urllib.parse as urlparse
 from urllib import request
@@ -12,14 +13,16 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import F, Q
+from django.utils.safestring import mark_safe
 from django.utils.timezone import utc
 from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.shortcuts import reverse
 from biostar.accounts.models import Profile, Logger
-from . import util
+from biostar.utils import decorators
+from . import caching, counters
 from .const import *
-from .models import Post, Vote, PostView, Subscription
+from .models import Post, Vote, Subscription
 
 User = get_user_model()
 
@@ -278,6 +281,108 @@ def is_suspended(user):
     return False
 
 
+# Markers of the user dependent parts of a cached thread.
+OVERLAY_BLOCK = re.compile(r"<!--overlay:(!?\w+):(\d+)-->(.*?)<!--/overlay:\1:\2-->", re.DOTALL)
+OVERLAY_VALUE = re.compile(r"<!--overlay:(\w+):(\d+)/-->")
+
+
+def get_follow_label(user, post):
+    not_following = "not following"
+
+    label_map = {
+        Subscription.LOCAL_MESSAGE: "following with messages",
+        Subscription.EMAIL_MESSAGE: "following via email",
+        Subscription.NO_MESSAGES: not_following,
+    }
+
+    if user.is_anonymous:
+        return not_following
+
+    # Get the current subscription
+    sub = Subscription.objects.filter(post=post.root, user=user).first()
+    sub = sub or Subscription(post=post, user=user, type=Subscription.NO_MESSAGES)
+
+    label = label_map.get(sub.type, not_following)
+
+    return label
+
+
+class ThreadUser(object):
+    """
+    Votes and permissions of a user in a thread.
+    Applied to the posts of the thread or to a thread rendered for every user.
+    """
+
+    def __init__(self, user, root):
+        self.user = user
+        self.root = root
+        self.authenticated = user.is_authenticated
+        self.moderator = self.authenticated and user.profile.is_moderator
+
+        # Gather votes by the current user.
+        votes = get_votes(user=user, root=root)
+        self.bookmarks, self.upvotes = votes[Vote.BOOKMARK], votes[Vote.UP]
+
+    def flags(self, post=None, pk=None, author_id=None):
+        pk = post.id if post else pk
+        author_id = post.author_id if post else author_id
+        user_id = self.user.id if self.authenticated else None
+        is_toplevel = pk == self.root.id
+
+        return dict(has_bookmark=int(pk in self.bookmarks),
+                    has_upvote=int(pk in self.upvotes),
+                    can_accept=self.authenticated and not is_toplevel and
+                               (user_id == self.root.author_id or self.moderator),
+                    can_moderate=self.moderator,
+                    is_editable=self.authenticated and (user_id == author_id or self.moderator),
+                    is_authenticated=self.authenticated)
+
+    def overlay(self, html, authors):
+        """
+        Fills the user dependent parts of a cached thread, authors maps the posts to their authors.
+        """
+        flags = {pk: self.flags(pk=pk, author_id=author_id) for pk, author_id in authors.items()}
+        flags[self.root.id].update(follow_label=get_follow_label(user=self.user, post=self.root))
+
+        def block(match):
+            name, pk, content = match.groups()
+            value = flags[int(pk)][name.lstrip("!")]
+            show = not value if name.startswith("!") else value
+            return OVERLAY_BLOCK.sub(block, content) if show else ""
+
+        def value(match):
+            name, pk = match.groups()
+            return str(flags[int(pk)][name])
+
+        return OVERLAY_VALUE.sub(value, OVERLAY_BLOCK.sub(block, html))
+
+
+def render_thread(request, root):
+    """
+    Returns the html of a thread for the user of the request.
+
+    The thread is rendered once per version with markers in place of the votes and permissions
+    of the user, moderators see a rendering of their own with the quarantined posts.
+    The markers are filled in for every request.
+    """
+    user = request.user
+    viewer = ThreadUser(user=user, root=root)
+    group = caching.thread_group(root.id)
+    key = caching.fragment_key(group, "moderator" if viewer.moderator else "public")
+
+    def build():
+        post, tree, answers, thread = post_tree(user=user, root=root)
+        context = dict(post=post, tree=tree, answers=answers, overlay=True)
+        html = loader.render_to_string("widgets/post_thread.html", context=context, request=request)
+        authors = {post.id: post.author_id for post in thread}
+        authors[root.id] = root.author_id
+        return html, authors
+
+    html, authors = caching.get_or_build(key, build=build, group=group)
+
+    return mark_safe(viewer.overlay(html, authors))
+
+
 def post_tree(user, root):
     """
     Populates a tree that contains all posts in the thread.
@@ -296,11 +401,8 @@ def post_tree(user, root):
     # Apply the sort order to all posts in thread.
     thread = query.order_by("type", "-accept_count", "-vote_count", "creation_date")
 
-    # Gather votes by the current user.
-    votes = get_votes(user=user, root=root)
-
-    # Shortcuts to each storage.
-    bookmarks, upvotes = votes[Vote.BOOKMARK], votes[Vote.UP]
+    # Votes and permissions of the current user.
+    viewer = ThreadUser(user=user, root=root)
 
     # Build comments tree.
     comment_tree = dict()
@@ -309,16 +411,8 @@ def post_tree(user, root):
         # Mutates the elements! Not worth creating copies.
         if post.is_comment:
             comment_tree.setdefault(post.parent_id, []).append(post)
-        post.has_bookmark = int(post.id in bookmarks)
-        post.has_upvote = int(post.id in upvotes)
-        if user.is_authenticated:
-            post.can_accept = not post.is_toplevel and (user == post.root.author or user.profile.is_moderator)
-            post.can_moderate = user.profile.is_moderator
-            post.is_editable = (user == post.author or user.profile.is_moderator)
-        else:
-            post.can_accept = False
-            post.is_editable = False
-            post.can_moderate = False
+        for name, value in viewer.flags(post).items():
+            setattr(post, name, value)
 
         return post
 
@@ -345,14 +439,13 @@ def update_post_views(post, request, minutes=settings.POST_VIEW_MINUTES):
     ip2 = '' if ip2.lower() == 'localhost' else ip2
     ip = ip1 or ip2 or '0.0.0.0'
 
-    now = util.now()
-    since = now - datetime.timedelta(minutes=minutes)
+    # Views are buffered and written in bulk.
+    counters.record(ip=ip, post_id=post.pk, minutes=minutes)
+
+    # Write the views of the past intervals when the flush timer is not running.
+    if not decorators.timers_running() and counters.pending():
+        counters.flush()
 
-    # One view per time interval from each IP address.
-    if not PostView.objects.filter(ip=ip, post=post, date__gt=since).exists():
-        # Update the last time
-        PostView.objects.create(ip=ip, post=post, date=now)
-        Post.objects.filter(pk=post.pk).update(view_count=F('view_count') + 1)
     return post
 
 
@@ -369,6 +462,9 @@ def apply_vote(post, user, vote_type):
         vote = Vote.objects.create(author=user, post=post, type=vote_type)
         msg = f"{vote.get_type_display()} added"
 
+    # The vote counts and states shown in the thread change.
+    caching.expire_threads(post.root_id)
+
     if post.author == user:
         # Author making the change
         change = 0
@@ -483,6 +579,10 @@ class Moderate(object):
         if action in action_map:
             mod_func = action_map[action]
             mod_func()
+            # Most actions update the posts without sending signals.
+            caching.bump_version(caching.POST_LIST)
+            caching.bump_version(caching.FEED)
+            caching.expire_threads(post.root_id)
         else:
             logger.error("Unknown moderation action given.")
 
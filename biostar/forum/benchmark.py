@@ -0,0 +1,475 @@
+"""
+Search, indexing and rendering benchmarks on a synthetic corpus.
+
+The corpus is written with uids starting with BENCH_PREFIX so that it can be removed
+afterwards. The benchmark refuses to run on the database of a site, where the corpus
+would show in the listings: point DATABASE_NAME at a separate database. The posts are
+stored as indexed and are indexed into a directory of the benchmark, the indexing
+service of a site never picks them up.
+"""
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from biostar.accounts.models import User
+from biostar.forum.models import Post
+from biostar.forum import search, indexer, util
+
+logger = logging.getLogger('engine')
+
+# Uid and username prefix of the generated objects.
+BENCH_PREFIX = "bench"
+
+# Email domain of the generated users, reserved so that it never belongs to a real user.
+BENCH_DOMAIN = "benchmark.invalid"
+
+# Vocabulary of the generated posts, sampled with Zipf weights so that early words are frequent.
+WORDS = """
+    the data file read sequence gene genome alignment reads sample error how use run output
+    tool analysis expression reference count table version install python script command
+    bam fastq vcf fasta bed gtf variant quality mapping coverage pipeline package library
+    differential normalization cluster matrix plot annotation assembly contig scaffold transcript
+    isoform exon intron promoter motif peak chip atac methylation single cell barcode umi
+    sra ncbi ensembl ucsc biomart bioconductor deseq2 edger limma samtools bedtools bwa bowtie2
+    star hisat2 salmon kallisto featurecounts htseq gatk freebayes bcftools picard trimmomatic
+    fastqc multiqc snakemake nextflow conda docker cluster slurm memory thread parallel speed
+    phylogenetic tree blast database protein domain structure pdb uniprot kegg pathway enrichment
+    go term ontology heatmap pca umap tsne batch effect replicate paired end strand adapter
+    duplicate filter threshold pvalue fdr fold change log2 median mean variance distribution
+    chromosome position coordinate interval overlap merge sort index header column row missing
+    format convert parse regex awk sed grep perl bash loop function argument error message
+    segmentation fault killed timeout permission denied path environment variable dependency
+""".split()
+
+# Tags of the generated posts, also sampled with Zipf weights.
+TAGS = """
+    rna-seq r python alignment sequencing assembly chip-seq genome snp ngs bam vcf gene
+    blast deseq2 bioconductor annotation samtools bedtools single-cell galaxy perl linux
+    variant-calling gatk fastq scrna-seq phylogenetics protein mapping coverage methylation
+""".split()
+
+# Types of the generated threads and how often they occur.
+THREAD_TYPES = [(Post.QUESTION, 70), (Post.FORUM, 10), (Post.TUTORIAL, 5), (Post.TOOL, 5), (Post.NEWS, 4),
+                (Post.BLOG, 4), (Post.JOB, 2)]
+
+
+def zipf_weights(size):
+    return [1 / (rank + 1) for rank in range(size)]
+
+
+WORD_WEIGHTS = zipf_weights(len(WORDS))
+TAG_WEIGHTS = zipf_weights(len(TAGS))
+
+
+def make_words(rng, count):
+    return rng.choices(WORDS, weights=WORD_WEIGHTS, k=count)
+
+
+def make_title(rng):
+    words = make_words(rng, rng.randint(4, 10))
+    return " ".join(words).capitalize()
+
+
+def make_content(rng, paragraphs=None):
+    """
+    Returns a markdown body made of paragraphs, with the occasional list, code block or link.
+    """
+    parts = []
+    for step in range(paragraphs or rng.randint(1, 4)):
+        words = make_words(rng, rng.randint(15, 60))
+        parts.append(" ".join(words).capitalize() + ".")
+
+        chance = rng.random()
+        if chance < 0.2:
+            parts.append("\n".join(f"- {' '.join(make_words(rng, 5))}" for item in range(rng.randint(2, 5))))
+        elif chance < 0.35:
+            command = " ".join(make_words(rng, rng.randint(3, 8)))
+            parts.append(f"```\n$ {command}\n```")
+        elif chance < 0.45:
+            word = make_words(rng, 1)[0]
+            parts.append(f"See [{word}](https://www.example.org/{word}) for details.")
+
+    return "\n\n".join(parts)
+
+
+def make_tags(rng):
+    tags = set(rng.choices(TAGS, weights=TAG_WEIGHTS, k=rng.randint(1, 4)))
+    return ",".join(sorted(tags))
+
+
+def replies(rng, mean):
+    """
+    Number of replies to a post, most posts get few replies and some get many.
+    """
+    return int(rng.expovariate(1 / mean)) if mean else 0
+
+
+def bench_posts():
+    return Post.objects.filter(uid__startswith=f"{BENCH_PREFIX}-")
+
+
+def bench_user(step):
+    name = f"{BENCH_PREFIX}-{step}"
+    user, created = User.objects.get_or_create(username=name, email=f"{name}@{BENCH_DOMAIN}")
+    return user
+
+
+def bench_users():
+    return User.objects.filter(username__startswith=f"{BENCH_PREFIX}-", email__endswith=f"@{BENCH_DOMAIN}")
+
+
+def check_database():
+    """
+    Raises an error when the database holds posts other than the benchmark corpus.
+    """
+    if Post.objects.exclude(uid__startswith=f"{BENCH_PREFIX}-").exists():
+        raise ImproperlyConfigured(f"Database {settings.DATABASE_NAME} holds the posts of a site, "
+                                   f"set DATABASE_NAME to a separate database to run the benchmark.")
+
+
+def remove_corpus():
+    """
+    Deletes the generated posts and users.
+    """
+    count, details = bench_posts().delete()
+    bench_users().delete()
+    logger.info(f"Removed {count} benchmark objects")
+
+
+def create_corpus(threads=1000, answers=3, comments=2, users=50, years=5, seed=1):
+    """
+    Generates threads with answers and comments, spread over the given number of years.
+    Posts are inserted in bulk, the html is the raw markdown. Returns the number of posts.
+    """
+    rng = random.Random(seed)
+    start = time.time()
+
+    authors = [bench_user(step) for step in range(users)]
+
+    now = util.now()
+    span = years * 365 * 24 * 3600
+    counter = iter(range(10 ** 9))
+
+    def post(ptype, title, date, **kwargs):
+        author = rng.choice(authors)
+        content = make_content(rng)
+        uid = f"{BENCH_PREFIX}-{next(counter)}"
+        return Post(uid=uid, type=ptype, title=title, content=content, html=content, author=author,
+                    lastedit_user=author, last_contributor=author, creation_date=date, lastedit_date=date,
+                    rank=date.timestamp(), is_toplevel=ptype in Post.TOP_LEVEL, indexed=True, **kwargs)
+
+    # Threads first, they are their own root and parent.
+    types, weights = zip(*THREAD_TYPES)
+    roots = []
+    for step in range(threads):
+        date = now - timedelta(seconds=rng.randint(0, span))
+        ptype = rng.choices(types, weights=weights)[0]
+        roots.append(post(ptype, make_title(rng), date, tag_val=make_tags(rng)))
+
+    Post.objects.bulk_create(roots, batch_size=1000)
+    bench_posts().filter(is_toplevel=True).update(root_id=F("id"), parent_id=F("id"))
+    ids = dict(bench_posts().values_list("uid", "id"))
+
+    # Answers to the threads, comments to the threads and the answers.
+    replies_list = []
+    for root in roots:
+        root_id = ids[root.uid]
+        date = root.creation_date
+        parents = [root_id]
+        for step in range(replies(rng, answers)):
+            date = min(date + timedelta(seconds=rng.randint(60, 3 * 24 * 3600)), now)
+            answer = post(Post.ANSWER, f"Answer: {root.title}", date, root_id=root_id, parent_id=root_id,
+                          tag_val=root.tag_val)
+            replies_list.append(answer)
+            parents.append(answer)
+
+        for parent in parents:
+            for step in range(replies(rng, comments)):
+                date = min(date + timedelta(seconds=rng.randint(60, 24 * 3600)), now)
+                parent_id = parent if isinstance(parent, int) else None
+                comment = post(Post.COMMENT, f"Comment: {root.title}", date, root_id=root_id,
+                               parent_id=parent_id, tag_val=root.tag_val)
+                # Comments on answers get their parent once the answers are inserted.
+                comment.parent_answer = None if parent_id else parent
+                replies_list.append(comment)
+
+    answers_list = [p for p in replies_list if p.type == Post.ANSWER]
+    Post.objects.bulk_create(answers_list, batch_size=1000)
+    ids.update(bench_posts().filter(type=Post.ANSWER).values_list("uid", "id"))
+
+    comments_list = [p for p in replies_list if p.type == Post.COMMENT]
+    for comment in comments_list:
+        if comment.parent_answer:
+            comment.parent_id = ids[comment.parent_answer.uid]
+    Post.objects.bulk_create(comments_list, batch_size=1000)
+
+    total = len(roots) + len(replies_list)
+    logger.info(f"Created {total} posts in {len(roots)} threads in {time.time() - start:.1f} seconds")
+
+    return total
+
+
+def percentiles(values):
+    """
+    Returns the latency percentiles of a list of seconds, in milliseconds.
+    """
+    if not values:
+        return dict(count=0)
+    values = sorted(values)
+
+    def rank(pct):
+        index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+        return round(values[index] * 1000, 3)
+
+    mean = sum(values) / len(values)
+    return dict(count=len(values), mean=round(mean * 1000, 3), p50=rank(50), p90=rank(90), p99=rank(99),
+                max=round(values[-1] * 1000, 3))
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def comment_tree(shape, size, author):
+    """
+    Returns an unsaved thread and its tree of comments. The comments form a single chain
+    when the shape is "deep" and all reply to the thread when it is "wide".
+    """
+    now = util.now()
+
+    def make(pk, ptype, parent=None):
+        return Post(id=pk, uid=f"{BENCH_PREFIX}-{pk}", type=ptype, title="Comment tree", content="Comment",
+                    html="<p>Comment</p>", author=author, lastedit_user=author, last_contributor=author,
+                    creation_date=now, lastedit_date=now, parent=parent)
+
+    root = make(1, Post.QUESTION)
+    root.root = root
+
+    tree = dict()
+    parent = root
+    for pk in range(2, size + 2):
+        comment = make(pk, Post.COMMENT, parent=parent)
+        comment.root = root
+        tree.setdefault(parent.id, []).append(comment)
+        parent = comment if shape == "deep" else root
+
+    return root, tree
+
+
+def bench_render(sizes=(10, 100, 1000), shapes=("deep", "wide"), repeat=5):
+    """
+    Times the rendering of comment trees of each shape and size.
+    """
+    from biostar.forum.templatetags.forum_tags import traverse_comments
+
+    author = bench_user(0)
+    request = RequestFactory().get("/")
+    request.user = AnonymousUser()
+
+    result = dict()
+    for shape in shapes:
+        for size in sizes:
+            root, tree = comment_tree(shape=shape, size=size, author=author)
+            times = [timed(traverse_comments, request=request, post=root, tree=tree,
+                           template_name="widgets/comment_body.html") for step in range(repeat)]
+            result[f"{shape}-{size}"] = percentiles(times)
+            logger.info(f"Rendered {shape} tree of {size} comments in {result[f'{shape}-{size}']['p50']} ms")
+
+    return result
+
+
+def query_mixes(rng, count):
+    """
+    Queries grouped by kind: frequent words, rare words, several words and tags.
+    """
+    head, tail = WORDS[:20], WORDS[-60:]
+    mixes = dict(
+        common=[rng.choice(head) for step in range(count)],
+        rare=[rng.choice(tail) for step in range(count)],
+        multi=[" ".join(make_words(rng, rng.randint(2, 4))) for step in range(count)],
+        tags=[rng.choice(TAGS) for step in range(count)],
+    )
+    return mixes
+
+
+def is_postgres():
+    return settings.SEARCH_BACKEND == "postgres"
+
+
+def run_search(query):
+    if is_postgres():
+        from biostar.forum import pgsearch
+        pgsearch.search_posts(query, sortedby=["lastedit_date"])
+        return
+
+    results = search.preform_whoosh_search(query=query, sortedby=["lastedit_date"])
+    # Load the stored fields, as a caller would.
+    [hit.fields() for hit in results]
+    results.searcher.close()
+
+
+def run_page(query, page):
+    if is_postgres():
+        from biostar.forum import pgsearch
+        pgsearch.search_posts(query, page=page, sortedby=["lastedit_date"])
+        return
+
+    with search.open_searcher() as searcher:
+        results = search.preform_whoosh_search(query=query, page=page, sortedby=["lastedit_date"],
+                                               searcher=searcher)
+        [search.compact_hit(hit, fields) for hit, fields in search.hit_fields(results)]
+
+
+def bench_queries(mixes, uids, rng, pages=3):
+    """
+    Times each search function over every query mix.
+    """
+    report = dict()
+    for name, queries in mixes.items():
+        times = dict(search=[], page=[], preform_search=[])
+        for query in queries:
+            times['search'].append(timed(run_search, query))
+            times['page'].append(timed(run_page, query, rng.randint(1, pages)))
+            times['preform_search'].append(timed(search.preform_search, query=query))
+        report[name] = {key: percentiles(values) for key, values in times.items()}
+
+    # Similar posts of random threads.
+    times = [timed(search.preform_search, query=uid, fields=['uid'], more_like_this=True) for uid in uids]
+    report['more_like_this'] = dict(preform_search=percentiles(times))
+
+    return report
+
+
+def bench_commits(ix, rounds, batch, rng):
+    """
+    Times incremental commits of edited posts through the indexing service.
+    With the postgres backend the trigger updates the vectors within the edit itself.
+    """
+    ids = list(bench_posts().values_list("id", flat=True))
+    times = []
+    for step in range(rounds):
+        edited = rng.sample(ids, min(batch, len(ids)))
+        start = time.time()
+        Post.objects.filter(id__in=edited).update(title=make_title(rng), lastedit_date=util.now())
+        if not is_postgres():
+            # The service is handed the edited posts, the indexed flags are left alone.
+            service = indexer.IndexService(ix=ix, batch=batch, ids=edited)
+            start = time.time()
+            service.collect()
+            service.commit()
+        times.append(time.time() - start)
+    return percentiles(times)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=settings.BASE_DIR, timeout=10)
+        return out.stdout.strip()
+    except Exception as exc:
+        return ''
+
+
+def reindex(ix, posts, chunk, workers):
+    """
+    Rebuilds the search index of the corpus. Returns the number of documents and the rate.
+    """
+    if is_postgres():
+        from biostar.forum import pgsearch
+        start = time.time()
+        total = pgsearch.reindex(ids=posts.values_list("id", flat=True))
+        return total, total / max(time.time() - start, 1e-6)
+
+    return search.bulk_index(posts=posts, ix=ix, overwrite=True, chunk=chunk, workers=workers)
+
+
+def run(threads=1000, answers=3, comments=2, users=50, queries=50, rounds=10, batch=100, workers=0,
+        chunk=1000, seed=1, reuse=False, keep=False, dirname=None, backend=None):
+    """
+    Runs the benchmark and returns the results.
+    """
+    backend = backend or settings.SEARCH_BACKEND
+    rng = random.Random(seed)
+    dirname = dirname or os.path.join(settings.INDEX_DIR, "..", "benchmark")
+    dirname = os.path.abspath(dirname)
+
+    check_database()
+    if not (reuse and bench_posts().exists()):
+        remove_corpus()
+        create_corpus(threads=threads, answers=answers, comments=comments, users=users, seed=seed)
+
+    shutil.rmtree(dirname, ignore_errors=True)
+    search.MANAGERS.clear()
+
+    result = dict(commit=git_commit(), date=util.now().isoformat(),
+                  settings=dict(backend=backend, compact=settings.INDEX_COMPACT, shards=settings.INDEX_SHARDS,
+                                shard_workers=settings.INDEX_SHARD_WORKERS, database=settings.DATABASE_NAME),
+                  corpus=dict(threads=threads, answers=answers, comments=comments, posts=bench_posts().count(),
+                              seed=seed))
+    try:
+        with override_settings(INDEX_DIR=dirname, SEARCH_BACKEND=backend):
+            ix = search.init_index()
+            posts = bench_posts()
+
+            total, rate = reindex(ix=ix, posts=posts, chunk=chunk, workers=workers)
+            size = sum(search.index_size(root) for root, dirs, files in os.walk(dirname))
+            result['reindex'] = dict(docs=total, docs_per_sec=round(rate, 1), workers=workers,
+                                     size_mb=round(size / 1024 ** 2, 2))
+
+            result['commits'] = bench_commits(ix=ix, rounds=rounds, batch=batch, rng=rng)
+            result['commits']['batch'] = batch
+
+            uids = list(posts.filter(is_toplevel=True).values_list("uid", flat=True))
+            uids = rng.sample(uids, min(queries, len(uids)))
+            result['queries'] = bench_queries(query_mixes(rng, queries), uids=uids, rng=rng)
+    finally:
+        search.MANAGERS.clear()
+        shutil.rmtree(dirname, ignore_errors=True)
+        if not keep:
+            remove_corpus()
+
+    return result
+
+
+def save(result, fname):
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    with open(fname, "w") as stream:
+        json.dump(result, stream, indent=2)
+    logger.info(f"Benchmark results saved to {fname}")
+
+
+def compare(first, second):
+    """
+    Yields the latencies of two benchmark results side by side.
+    """
+    for mix, ops in second.get('queries', {}).items():
+        for op, stats in ops.items():
+            before = first.get('queries', {}).get(mix, {}).get(op, {})
+            for key in ('p50', 'p90', 'p99'):
+                old, new = before.get(key), stats.get(key)
+                ratio = new / old if old and new is not None else None
+                yield f"{mix}.{op}.{key}", old, new, ratio
+
+    old, new = first.get('reindex', {}).get('docs_per_sec'), second.get('reindex', {}).get('docs_per_sec')
+    yield "reindex.docs_per_sec", old, new, (new / old if old and new is not None else None)
+
+    old, new = first.get('commits', {}).get('p50'), second.get('commits', {}).get('p50')
+    yield "commits.p50", old, new, (new / old if old and new is not None else None)
+
+    for tree, stats in second.get('render', {}).items():
+        old, new = first.get('render', {}).get(tree, {}).get('p50'), stats.get('p50')
+        yield f"render.{tree}.p50", old, new, (new / old if old and new is not None else None)
@@ -0,0 +1,106 @@
+"""
+Cache of rendered page fragments.
+
+Fragments are stored with the version of their group. Bumping the version, when a post
+is saved or moderated, marks every fragment of the group as stale. A stale or expired
+fragment is rebuilt by the one worker that takes the rebuild lock while the others keep
+serving the stale copy, so a popular page is never rebuilt by every worker at once.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('engine')
+
+# Fragment groups, each with its own version.
+POST_LIST = "post_list"
+FEED = "feed"
+
+
+def thread_group(root_id):
+    # Every thread has its own version.
+    return f"thread-{root_id}"
+
+
+def version_key(group):
+    return f"VERSION-{group}"
+
+
+def get_version(group):
+    return cache.get(version_key(group), 0)
+
+
+def bump_version(group):
+    """
+    Marks the fragments of a group as stale. Returns the new version.
+    """
+    key = version_key(group)
+
+    # Versions do not expire, an evicted version starts again and still differs from the stored ones.
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def expire_threads(*root_ids):
+    """
+    Marks the cached renderings of the threads as stale.
+    """
+    for root_id in set(root_ids):
+        if root_id:
+            bump_version(thread_group(root_id))
+
+
+def fragment_key(group, *parts):
+    """
+    Returns a cache key for the parts of a request, valid with any cache backend.
+    """
+    digest = hashlib.md5("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return f"FRAGMENT-{group}-{digest}"
+
+
+def store(key, value, group, version=None, ttl=None, stale=None):
+    """
+    Caches a fragment built for a version of its group, the current version by default.
+    """
+    ttl = ttl or settings.FRAGMENT_CACHE_SECS
+    stale = settings.FRAGMENT_STALE_SECS if stale is None else stale
+    version = get_version(group) if version is None else version
+    cache.set(key, (value, version, time.time() + ttl), timeout=ttl + stale)
+
+
+def get_or_build(key, build, group, ttl=None, stale=None):
+    """
+    Returns the fragment cached under key, calling build to render it when missing or stale.
+    Fragments stay fresh for ttl seconds and may be served stale for another stale seconds.
+    """
+    ttl = ttl or settings.FRAGMENT_CACHE_SECS
+    stale = settings.FRAGMENT_STALE_SECS if stale is None else stale
+    version = get_version(group)
+    lock = f"{key}-LOCK"
+
+    entry = cache.get(key)
+    if entry:
+        value, built, expires = entry
+        if built == version and expires > time.time():
+            return value
+
+        # Another worker is rebuilding the fragment.
+        if not cache.add(lock, 1, timeout=settings.FRAGMENT_LOCK_SECS):
+            return value
+
+    # With no fragment to serve every worker renders its own.
+    try:
+        value = build()
+        store(key, value, group=group, version=version, ttl=ttl, stale=stale)
+    finally:
+        if entry:
+            cache.delete(lock)
+
+    return value
@@ -0,0 +1,167 @@
+"""
+Hashed bag of words spam classifier.
+
+The words and word pairs of a post are hashed into a fixed number of features
+and a logistic regression is trained on the labelled spam and ham posts.
+The weights are kept in a compact NumPy file that is loaded once per process
+and reloaded when a training run replaces the file.
+"""
+import logging
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from biostar.forum import util
+
+logger = logging.getLogger('engine')
+
+# Models loaded by this process with the modification time of their file.
+MODELS = dict()
+
+MODELS_LOCK = threading.Lock()
+
+
+def get_tokens(text):
+    words = re.findall(r"\w+", (text or "").lower())
+    pairs = [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return words + pairs
+
+
+def hash_features(text, size):
+    """
+    Returns the feature columns of a text and their values, scaled to unit length.
+    """
+    tokens = get_tokens(text)
+    if not tokens:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # crc32 is stable between processes, unlike the builtin hash.
+    hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype=np.int64, count=len(tokens))
+    cols, counts = np.unique(hashes % size, return_counts=True)
+    values = np.log1p(counts)
+    values /= np.linalg.norm(values)
+
+    return cols, values
+
+
+def vectorize(texts, size):
+    """
+    Returns the rows, columns and values of the sparse feature matrix of the texts.
+    """
+    rows, cols, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for row, text in enumerate(texts):
+        col, value = hash_features(text, size=size)
+        rows.append(np.full(len(col), row, dtype=np.int64))
+        cols.append(col)
+        values.append(value)
+
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+class Model(object):
+    """
+    Weights of a trained classifier.
+    """
+
+    def __init__(self, weights, bias, spam=0, ham=0, date=''):
+        self.weights = weights
+        self.bias = bias
+
+        # Size of the training set and time of training.
+        self.spam = spam
+        self.ham = ham
+        self.date = date
+
+    @property
+    def size(self):
+        return len(self.weights)
+
+    def margins(self, rows, cols, values, count):
+        return np.bincount(rows, weights=values * self.weights[cols], minlength=count) + self.bias
+
+    def predict(self, texts):
+        """
+        Returns the spam probability of each text.
+        """
+        rows, cols, values = vectorize(texts, size=self.size)
+        return sigmoid(self.margins(rows, cols, values, count=len(texts)))
+
+    def score(self, text):
+        return float(self.predict([text])[0])
+
+    def save(self, fname):
+        """
+        Writes the model to a temporary file then replaces the old one, readers never see a partial file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+        tmp = f"{fname}.tmp"
+        with open(tmp, "wb") as stream:
+            np.savez_compressed(stream, weights=self.weights.astype(np.float32), bias=self.bias,
+                                spam=self.spam, ham=self.ham, date=self.date)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(weights=data['weights'], bias=float(data['bias']), spam=int(data['spam']),
+                       ham=int(data['ham']), date=str(data['date']))
+
+
+def train(texts, labels, size=None, epochs=100, rate=0.5, alpha=1e-5):
+    """
+    Fits a logistic regression with AdaGrad steps over the whole training set.
+    Labels are 1 for spam and 0 for ham, both classes are weighted to count equally.
+    """
+    size = size or settings.SPAM_MODEL_FEATURES
+    labels = np.asarray(labels, dtype=np.float64)
+    count = len(labels)
+    rows, cols, values = vectorize(texts, size=size)
+
+    nspam = int(labels.sum())
+    nham = count - nspam
+    balance = np.where(labels == 1, count / (2 * max(nspam, 1)), count / (2 * max(nham, 1)))
+
+    model = Model(weights=np.zeros(size), bias=0.0, spam=nspam, ham=nham, date=util.now().isoformat())
+    squares, bias_squares = np.zeros(size), 0.0
+
+    for epoch in range(epochs):
+        error = (sigmoid(model.margins(rows, cols, values, count=count)) - labels) * balance / max(count, 1)
+        grad = np.bincount(cols, weights=values * error[rows], minlength=size) + alpha * model.weights
+        squares += grad ** 2
+        model.weights -= rate * grad / (np.sqrt(squares) + 1e-8)
+
+        bias_grad = error.sum()
+        bias_squares += bias_grad ** 2
+        model.bias -= rate * bias_grad / (np.sqrt(bias_squares) + 1e-8)
+
+    model.weights = model.weights.astype(np.float32)
+    return model
+
+
+def get_model(fname=None):
+    """
+    Returns the classifier of this process, None when no model was trained.
+    The model is loaded again when its file changes.
+    """
+    fname = fname or settings.SPAM_MODEL_FILE
+    try:
+        mtime = os.stat(fname).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with MODELS_LOCK:
+        loaded, model = MODELS.get(fname, (None, None))
+        if loaded != mtime:
+            model = Model.load(fname)
+            MODELS[fname] = (mtime, model)
+            logger.info(f"Loaded spam model {fname}: spam={model.spam} ham={model.ham} trained={model.date}")
+
+    return model
@@ -31,6 +31,11 @@ LATEST_CACHE_KEY = "LATEST"
 TAGS_CACHE_KEY = "TAGS"
 
 SIMILAR_CACHE_KEY = "SIMILAR"
+
+# Search result pages and their hit/miss counters.
+SEARCH_CACHE_KEY = "SEARCH"
+SEARCH_CACHE_HITS = "SEARCH_HITS"
+SEARCH_CACHE_MISSES = "SEARCH_MISSES"
 USERS_CACHE_KEY = "MENTIONED_USERS"
 
 USERS_LIST_KEY = "USERS_LIST"
@@ -0,0 +1,187 @@
+"""
+Buffered post view counter.
+
+A view is counted once per IP address and post within POST_VIEW_MINUTES, the check is
+a cache key rather than a database query. Counted views are appended to a buffer in the
+cache, one buffer per POST_VIEW_FLUSH_SECS interval. Once an interval is over its views
+are added to Post.view_count and stored as PostView rows with bulk statements, by the
+flush timer or by the first view that finds the interval pending.
+"""
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Case, When, Value, IntegerField
+
+from biostar.forum.models import Post, PostView
+
+logger = logging.getLogger('engine')
+
+# Seconds a view being buffered at the end of an interval has to complete.
+GRACE = 2
+
+# Posts updated by one statement, keeps the query within the database parameter limits.
+BATCH = 300
+
+# Cache keys of the counter.
+FLUSHED = "VIEWS-FLUSHED"
+STATS = "VIEWS-STATS"
+LOCK = "VIEWS-LOCK"
+
+
+def interval(now=None):
+    return int((now or time.time()) // settings.POST_VIEW_FLUSH_SECS)
+
+
+def size_key(number):
+    return f"VIEWS-{number}-SIZE"
+
+
+def view_key(number, index):
+    return f"VIEWS-{number}-{index}"
+
+
+def keep_secs():
+    # Buffers outlive a few missed flushes.
+    return settings.POST_VIEW_FLUSH_SECS * 10
+
+
+def record(ip, post_id, minutes=None, now=None):
+    """
+    Buffers a view of a post from an IP address. Returns True when the view is counted.
+    """
+    now = now or time.time()
+    minutes = minutes or settings.POST_VIEW_MINUTES
+
+    # One view per time interval from each IP address.
+    if not cache.add(f"VIEW-{ip}-{post_id}", 1, timeout=minutes * 60):
+        return False
+
+    number = interval(now)
+    key = size_key(number)
+    cache.add(key, 0, timeout=keep_secs())
+    try:
+        index = cache.incr(key)
+    except ValueError:
+        index = settings.POST_VIEW_BUFFER_SIZE + 1
+
+    # A full buffer drops the view.
+    if index > settings.POST_VIEW_BUFFER_SIZE:
+        count_dropped()
+        return False
+
+    cache.set(view_key(number, index), (ip, post_id, now), timeout=keep_secs())
+    return True
+
+
+def count_dropped(value=1):
+    key = f"{STATS}-DROPPED"
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        cache.set(key, value, timeout=None)
+
+
+def pending(now=None):
+    """
+    Returns the numbers of the intervals that are over and not yet written.
+    """
+    now = now or time.time()
+    last = interval(now - GRACE) - 1
+    flushed = cache.get(FLUSHED)
+
+    # Buffers older than the cache keeps them are gone.
+    first = interval(now) - 10
+    if flushed is not None:
+        first = max(first, flushed + 1)
+
+    return range(first, last + 1)
+
+
+@transaction.atomic
+def apply(views):
+    """
+    Writes the views, a list of (ip, post_id, unix time), to the database.
+    Returns the number of posts updated. The counts and the rows are written together,
+    a failed flush adds nothing and is retried whole.
+    """
+    counts = Counter(post_id for ip, post_id, when in views)
+    ids = list(Post.objects.filter(pk__in=counts).values_list("pk", flat=True))
+    if not ids:
+        return 0
+
+    # A single statement adds the views of a batch of posts.
+    for start in range(0, len(ids), BATCH):
+        batch = ids[start:start + BATCH]
+        delta = Case(*[When(pk=pk, then=Value(counts[pk])) for pk in batch], default=Value(0),
+                     output_field=IntegerField())
+        Post.objects.filter(pk__in=batch).update(view_count=F('view_count') + delta)
+
+    known = set(ids)
+    rows = [PostView(ip=ip, post_id=post_id, date=datetime.fromtimestamp(when, tz=timezone.utc))
+            for ip, post_id, when in views if post_id in known]
+    PostView.objects.bulk_create(rows, batch_size=500)
+
+    return len(ids)
+
+
+def flush(now=None):
+    """
+    Writes the views of the intervals that are over. Returns the number of views written.
+    """
+    now = now or time.time()
+    numbers = pending(now)
+    if not numbers:
+        return 0
+
+    # A single worker flushes at a time.
+    if not cache.add(LOCK, 1, timeout=settings.POST_VIEW_FLUSH_SECS):
+        return 0
+
+    try:
+        views, missing = [], 0
+        for number in numbers:
+            size = min(cache.get(size_key(number), 0), settings.POST_VIEW_BUFFER_SIZE)
+            keys = [view_key(number, index) for index in range(1, size + 1)]
+            found = cache.get_many(keys)
+            views.extend(found[key] for key in keys if key in found)
+
+            # Views evicted from the cache are lost.
+            missing += size - len(found)
+
+        posts = apply(views)
+
+        cache.set(FLUSHED, numbers[-1], timeout=None)
+        for number in numbers:
+            size = cache.get(size_key(number), 0)
+            cache.delete_many([size_key(number)] + [view_key(number, index) for index in range(1, size + 1)])
+    finally:
+        cache.delete(LOCK)
+
+    if missing:
+        count_dropped(missing)
+
+    # Seconds the oldest view waited to be written.
+    lag = now - min(when for ip, post_id, when in views) if views else 0
+    stats = dict(flushed=now, lag=round(lag, 1), views=len(views), posts=posts)
+    cache.set(STATS, stats, timeout=None)
+
+    if views or missing:
+        logger.info(f"flushed {len(views)} views of {posts} posts, lag {lag:.1f}s, dropped {missing}")
+    return len(views)
+
+
+def stats():
+    """
+    Returns the time and lag in seconds of the last flush, the views it wrote
+    and the total number of views dropped.
+    """
+    result = dict(flushed=None, lag=None, views=0, posts=0)
+    result.update(cache.get(STATS) or {})
+    result.update(dropped=cache.get(f"{STATS}-DROPPED", 0), pending=len(pending()))
+    return result
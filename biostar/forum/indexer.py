@@ -0,0 +1,216 @@
+"""
+Long running indexing service.
+
+A single process owns the writer of the search index. Post changes are
+flagged with indexed=False in the database (see signals.finalize_post);
+the service drains these flags, batches the documents and commits
+on a schedule. Request workers never take the index lock.
+"""
+import logging
+import signal
+import time
+
+from django.conf import settings
+
+from biostar.forum.models import Post
+from biostar.forum import search, util, maintenance
+
+logger = logging.getLogger('engine')
+
+
+def pending_posts(limit):
+    """
+    Returns the ids of posts waiting to be indexed, oldest changes first.
+    """
+    query = Post.objects.filter(indexed=False).exclude(root=None).order_by("lastedit_date")
+    ids = list(query.values_list("id", flat=True)[:limit])
+    return ids
+
+
+class IndexService(object):
+    """
+    Holds the only writer to the search index.
+    Changed posts are batched and committed when the batch is full
+    or when the oldest change has waited longer than the commit interval.
+    """
+
+    def __init__(self, ix=None, batch=None, interval=None, poll=None, ids=None):
+        self.ix = ix or search.init_index()
+
+        # Post ids indexed in turn without reading or setting the indexed flags,
+        # the flagged posts are indexed when not set.
+        self.ids = None if ids is None else list(ids)
+
+        # Maximum number of documents in one commit.
+        self.batch = batch or settings.BATCH_INDEXING_SIZE
+
+        # Seconds between two commits.
+        self.interval = interval or settings.INDEX_SECS_INTERVAL
+
+        # Seconds between two checks for changed posts.
+        self.poll = poll or settings.INDEX_POLL_SECS
+
+        self.writer = None
+
+        # Post ids in the current writer and the oldest edit date among them.
+        self.pending = set()
+        self.oldest = None
+        self.opened = time.time()
+
+        # Statistics reported on every commit.
+        self.commits = 0
+        self.total = 0
+        self.lag = 0
+        self.running = False
+
+        # Time of the last index maintenance check.
+        self.maintained = time.time()
+
+    def get_writer(self):
+        # Open the writer lazily, the lock is only held while a batch is pending.
+        if self.writer is None:
+            self.writer = self.ix.writer()
+            self.opened = time.time()
+        return self.writer
+
+    def collect(self):
+        """
+        Moves changed posts into the current writer. Returns the number of posts collected.
+        """
+        limit = self.batch - len(self.pending)
+        if limit <= 0:
+            return 0
+
+        ids = self.claim(limit)
+        if not ids:
+            return 0
+
+        posts = Post.objects.filter(id__in=ids).select_related("root", "author__profile", "lastedit_user__profile")
+        valid = set(Post.objects.valid_posts(id__in=ids).exclude(spam=Post.SPAM).values_list("id", flat=True))
+
+        writer = self.get_writer()
+        for post in posts:
+            if post.id in valid:
+                search.add_index(post=post, writer=writer)
+            else:
+                # Closed, deleted or spam posts are dropped from the index.
+                writer.delete_by_term('uid', post.uid)
+
+            self.oldest = min(self.oldest or post.lastedit_date, post.lastedit_date)
+
+        self.pending.update(ids)
+
+        return len(ids)
+
+    def claim(self, limit):
+        """
+        Returns the ids of the next posts to index.
+        """
+        if self.ids is not None:
+            ids, self.ids = self.ids[:limit], self.ids[limit:]
+            return ids
+
+        ids = pending_posts(limit=limit)
+
+        # Claim the posts before reading them; an edit made after this point
+        # sets the flag again and the post is picked up by a later batch.
+        Post.objects.filter(id__in=ids).update(indexed=True)
+        return ids
+
+    def release(self, ids):
+        """
+        Puts the posts of a failed commit back into the queue.
+        """
+        if self.ids is not None:
+            self.ids.extend(ids)
+        else:
+            Post.objects.filter(id__in=ids).update(indexed=False)
+
+    def is_due(self):
+        """
+        The current batch is due when full or when it has been open longer than the interval.
+        """
+        if not self.pending:
+            return False
+        full = len(self.pending) >= self.batch
+        late = (time.time() - self.opened) >= self.interval
+        return full or late
+
+    def commit(self):
+        """
+        Commits the current batch to the index.
+        """
+        if self.writer is None:
+            return
+
+        ids = list(self.pending)
+        try:
+            self.writer.commit()
+        except Exception as exc:
+            logger.error(f"Error committing index: {exc}")
+            self.release(ids)
+            self.writer.cancel()
+        else:
+            self.commits += 1
+            self.total += len(ids)
+            # How long the oldest change in this batch waited to become searchable.
+            self.lag = (util.now() - self.oldest).total_seconds() if self.oldest else 0
+            logger.info(self.report())
+        finally:
+            self.writer = None
+            self.pending = set()
+            self.oldest = None
+
+    def backlog(self):
+        if self.ids is not None:
+            return len(self.ids)
+        return Post.objects.filter(indexed=False).exclude(root=None).count()
+
+    def report(self):
+        return f"indexed={len(self.pending)} total={self.total} commits={self.commits} " \
+               f"lag={self.lag:.1f}s backlog={self.backlog()}"
+
+    def step(self):
+        """
+        Runs one cycle of the service. Returns the number of posts collected.
+        """
+        collected = self.collect()
+        if self.is_due():
+            self.commit()
+        return collected
+
+    def maintain(self):
+        """
+        Checks the health of the indexes while no batch is pending.
+        """
+        if self.pending or (time.time() - self.maintained) < settings.INDEX_MAINTAIN_SECS:
+            return
+        self.maintained = time.time()
+        try:
+            maintenance.maintain(ix=self.ix)
+        except Exception as exc:
+            logger.error(f"Error in index maintenance: {exc}")
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        """
+        Runs until interrupted, committing any pending batch on exit.
+        """
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+
+        logger.info(f"Index service started: batch={self.batch} interval={self.interval}s poll={self.poll}s")
+        try:
+            while self.running:
+                collected = self.step()
+                # Keep draining while the backlog fills whole batches.
+                if collected < self.batch:
+                    self.maintain()
+                    time.sleep(self.poll)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.commit()
+            logger.info("Index service stopped.")
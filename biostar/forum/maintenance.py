@@ -0,0 +1,193 @@
+"""
+Maintenance of the search indexes.
+
+Every commit may leave a new segment behind and deleted documents stay on disk
+until their segment is rewritten. Searches slow down as both pile up.
+Maintenance merges segments of similar size once enough of them accumulate,
+rewrites segments with many deleted documents and optimizes the indexes
+into a single segment during the quiet hours.
+"""
+import logging
+import math
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+from whoosh.index import LockError
+from whoosh.reading import SegmentReader
+
+from biostar.forum import search
+
+logger = logging.getLogger('engine')
+
+MERGE, OPTIMIZE = "merge", "optimize"
+
+
+def targets(ix=None):
+    """
+    Returns the name and index of every maintained index, each shard on its own.
+    """
+    from biostar.forum import spam
+
+    ix = ix or search.init_index()
+    if isinstance(ix, search.ShardedIndex):
+        items = [(f"forum shard {key}", shard) for key, shard in ix.shards()]
+    else:
+        items = [("forum", ix)]
+
+    if search.index_exists(dirname=settings.SPAM_INDEX_DIR, indexname=settings.SPAM_INDEX_NAME):
+        items.append(("spam", spam.init_spam_index()))
+
+    return items
+
+
+def health(ix):
+    """
+    Returns the segment count, document counts, size on disk and last optimize time of an index.
+    """
+    segments = ix._segments()
+    docs = ix.doc_count()
+    total = ix.doc_count_all()
+    deleted = total - docs
+
+    # Files of the live segments and the table of contents.
+    prefixes = tuple(seg.segment_id() for seg in segments) + (f"_{ix.indexname}_",)
+    folder = ix.storage.folder
+    size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder)
+               if name.startswith(prefixes))
+
+    return dict(segments=len(segments), docs=docs, deleted=deleted,
+                deleted_ratio=deleted / total if total else 0, size=size,
+                last_optimized=search.last_optimized(ix))
+
+
+def is_quiet(now=None):
+    """
+    True during the quiet hours, the window may wrap around midnight.
+    """
+    start, end = settings.INDEX_QUIET_HOURS
+    hour = timezone.localtime(now).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def plan(stats, quiet=False):
+    """
+    Returns the maintenance an index needs, None when it is healthy.
+    """
+    fragmented = stats['segments'] > 1 or stats['deleted']
+    if quiet and fragmented:
+        return OPTIMIZE
+
+    if stats['segments'] > settings.INDEX_MAX_SEGMENTS or stats['deleted_ratio'] > settings.INDEX_MAX_DELETED:
+        return MERGE
+
+    return None
+
+
+def tiered_merge(writer, segments):
+    """
+    Merge policy of the maintenance commits.
+
+    Segments are grouped into tiers by the logarithm of their size. A tier is merged once
+    it holds INDEX_MERGE_FACTOR segments. Segments with too many deleted documents are rewritten.
+    """
+    factor = max(settings.INDEX_MERGE_FACTOR, 2)
+    tiers = defaultdict(list)
+    merge = []
+
+    for seg in segments:
+        total = seg.doc_count_all()
+        if total and seg.deleted_count() / total > settings.INDEX_MAX_DELETED:
+            merge.append(seg)
+        else:
+            tiers[int(math.log(max(total, 1), factor))].append(seg)
+
+    keep = []
+    for tier, segs in tiers.items():
+        if len(segs) >= factor:
+            merge.extend(segs)
+        else:
+            keep.extend(segs)
+
+    for seg in merge:
+        reader = SegmentReader(writer.storage, writer.schema, seg)
+        writer.add_reader(reader)
+        reader.close()
+
+    return keep
+
+
+def apply(ix, action):
+    """
+    Runs a maintenance action. Returns False when another writer holds the index.
+    """
+    if action == OPTIMIZE:
+        try:
+            search.optimize_index(ix)
+        except LockError:
+            return False
+        return True
+
+    try:
+        writer = ix.writer(timeout=settings.INDEX_LOCK_SECS)
+    except LockError:
+        return False
+    writer.commit(mergetype=tiered_merge)
+    return True
+
+
+def compact_spam(ix):
+    """
+    Evicts the spam index samples over the cap. Returns False when another writer holds the index.
+    """
+    from biostar.forum import spam
+
+    try:
+        spam.compact_spam_index(ix)
+    except LockError:
+        return False
+    return True
+
+
+def maintain(ix=None, action=None, now=None):
+    """
+    Checks every index and applies the maintenance it needs.
+    Returns the name, action and outcome of each maintained index.
+    """
+    quiet = is_quiet(now)
+    done = []
+
+    for name, target in targets(ix=ix):
+        if name == "spam":
+            compact_spam(target)
+
+        stats = health(target)
+        todo = action or plan(stats, quiet=quiet)
+        if not todo:
+            continue
+
+        ok = apply(target, todo)
+        after = health(target)
+        outcome = "done" if ok else "busy"
+        logger.info(f"Index maintenance {name}: {todo} {outcome}, "
+                    f"segments {stats['segments']} -> {after['segments']}, "
+                    f"deleted {stats['deleted']} -> {after['deleted']}")
+        done.append((name, todo, outcome))
+
+    return done
+
+
+def report(ix=None):
+    """
+    Prints the health of every index.
+    """
+    print(f"{'index':<20}{'segments':>10}{'docs':>10}{'deleted':>10}{'size (MB)':>12}  last optimized")
+    for name, target in targets(ix=ix):
+        stats = health(target)
+        last = stats['last_optimized']
+        last = timezone.localtime(last).strftime("%Y-%m-%d %H:%M") if last else "unknown"
+        print(f"{name:<20}{stats['segments']:>10}{stats['docs']:>10}{stats['deleted']:>10}"
+              f"{stats['size'] / 1024 ** 2:>12.2f}  {last}")
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from biostar.forum import benchmark, util
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks indexing, searching and rendering on a synthetic corpus.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1000, help="Number of threads in the corpus.")
+        parser.add_argument('--answers', type=float, default=3, help="Average number of answers per thread.")
+        parser.add_argument('--comments', type=float, default=2, help="Average number of comments per post.")
+        parser.add_argument('--users', type=int, default=50, help="Number of authors.")
+        parser.add_argument('--queries', type=int, default=50, help="Queries timed in each query mix.")
+        parser.add_argument('--rounds', type=int, default=10, help="Number of incremental commits timed.")
+        parser.add_argument('--batch', type=int, default=100, help="Posts edited in each incremental commit.")
+        parser.add_argument('--workers', type=int, default=0, help="Worker processes used by the reindex.")
+        parser.add_argument('--backend', default='', choices=['', 'whoosh', 'postgres'],
+                            help="Search backend to time, the SEARCH_BACKEND setting by default.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed of the corpus and queries.")
+        parser.add_argument('--reuse', action='store_true', default=False,
+                            help="Reuse the corpus left by a previous run.")
+        parser.add_argument('--keep', action='store_true', default=False, help="Keep the corpus after the run.")
+        parser.add_argument('--remove', action='store_true', default=False, help="Remove the corpus and exit.")
+        parser.add_argument('--output', default='', help="JSON file with the results.")
+        parser.add_argument('--render', action='store_true', default=False,
+                            help="Time the rendering of deep and wide comment trees instead.")
+        parser.add_argument('--sizes', type=int, nargs='*', default=[10, 100, 1000],
+                            help="Number of comments in the rendered trees.")
+        parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                            help="Compare two JSON result files.")
+
+    def handle(self, *args, **options):
+
+        if options['compare']:
+            first, second = [json.load(open(fname)) for fname in options['compare']]
+            print(f"{'metric':<40}{'before':>12}{'after':>12}{'ratio':>8}")
+            for name, old, new, ratio in benchmark.compare(first, second):
+                ratio = f"{ratio:.2f}" if ratio is not None else '-'
+                print(f"{name:<40}{str(old):>12}{str(new):>12}{ratio:>8}")
+            return
+
+        if options['remove']:
+            benchmark.remove_corpus()
+            return
+
+        # The corpus would show on the site.
+        try:
+            benchmark.check_database()
+        except ImproperlyConfigured as exc:
+            logger.error(exc)
+            return
+
+        if options['render']:
+            result = dict(commit=benchmark.git_commit(), date=util.now().isoformat(),
+                          render=benchmark.bench_render(sizes=options['sizes']))
+            benchmark.remove_corpus()
+            stamp = util.now().strftime("%Y%m%d-%H%M%S")
+            fname = options['output'] or os.path.join(settings.BASE_DIR, 'export', 'bench', f"render-{stamp}.json")
+            benchmark.save(result, fname)
+            print(json.dumps(result, indent=2))
+            return
+
+        result = benchmark.run(threads=options['threads'], answers=options['answers'],
+                               comments=options['comments'], users=options['users'], queries=options['queries'],
+                               rounds=options['rounds'], batch=options['batch'], workers=options['workers'],
+                               seed=options['seed'], reuse=options['reuse'], keep=options['keep'],
+                               backend=options['backend'])
+
+        stamp = util.now().strftime("%Y%m%d-%H%M%S")
+        fname = options['output'] or os.path.join(settings.BASE_DIR, 'export', 'bench', f"search-{stamp}.json")
+        benchmark.save(result, fname)
+
+        print(json.dumps(result, indent=2))
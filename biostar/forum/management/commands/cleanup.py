@@ -5,7 +5,8 @@ from django.db.models import Count
 from django.core.management.base import BaseCommand
 from biostar.accounts.models import Message, User
 from biostar.forum.util import now
-from biostar.forum.models import PostView, Post
+from biostar.forum.models import Post
+from biostar.forum import retention
 
 logger = logging.getLogger('engine')
 
@@ -13,17 +14,15 @@ logger = logging.getLogger('engine')
 MAX_MSG = 100
 
 
-def prune_data(weeks=10, days=1):
+def prune_data(weeks=10, days=None):
 
     # Delete spam
     spam_posts = Post.objects.filter(spam=Post.SPAM)
     logger.info(f"Deleting {spam_posts.count()} spam posts")
     spam_posts.delete()
 
-    past_days = now() - timedelta(days=days)
-    post_views = PostView.objects.filter(date__lt=past_days)
-    logger.info(f"Deleting {post_views.count()} post views")
-    post_views.delete()
+    # Roll up the post views past the retention window.
+    retention.rollup(days=days)
 
     # Reduce overall messages.
     weeks_since = now() - timedelta(weeks=weeks)
@@ -44,9 +43,22 @@ class Command(BaseCommand):
     help = """Delete the following: 
               - posts marked as spam
               - messages older then 10 weeks
-              - PostView objects within the last day 
+              - PostView objects past the retention window, rolled up into daily views
               - too many messages in a users inbox
            """
 
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Days post views are kept (default: settings.POST_VIEW_KEEP_DAYS).")
+        parser.add_argument('--views', action='store_true', default=False,
+                            help="Only roll up the post views and report the rows pruned.")
+
     def handle(self, *args, **options):
-        prune_data()
\ No newline at end of file
+        days = options['days']
+
+        if options['views']:
+            pruned, secs = retention.rollup(days=days)
+            print(f"Pruned {pruned} post views in {secs:.1f} seconds")
+            return
+
+        prune_data(days=days)
\ No newline at end of file
@@ -5,7 +5,7 @@ from typing import Any
 from django.core.management.base import BaseCommand
 from biostar.forum.models import Post
 from django.conf import settings
-from biostar.forum import search, spam
+from biostar.forum import search, spam, indexer, maintenance
 
 logger = logging.getLogger('engine')
 
@@ -19,6 +19,22 @@ class Command(BaseCommand):
         parser.add_argument('--remove', action='store_true', default=False, help="Removes the existing index.")
         parser.add_argument('--report', action='store_true', default=False, help="Reports on the content of the index.")
         parser.add_argument('--index', type=int, default=0, help="How many posts to index")
+        parser.add_argument('--bulk', action='store_true', default=False,
+                            help="Reindex all posts in chunks, building documents in parallel.")
+        parser.add_argument('--vectors', action='store_true', default=False,
+                            help="Rebuild the search vectors of all posts for the postgres backend.")
+        parser.add_argument('--workers', type=int, default=0, help="Worker processes used by the bulk reindex.")
+        parser.add_argument('--chunk', type=int, default=1000, help="Posts loaded per query by the bulk reindex.")
+        parser.add_argument('--compare', action='store_true', default=False,
+                            help="Compare the size and latency of the full and compact schemas.")
+        parser.add_argument('--optimize', action='store_true', default=False,
+                            help="Merge the index into one segment, only the frozen shards of a sharded index.")
+        parser.add_argument('--maintain', action='store_true', default=False,
+                            help="Merge or optimize the forum and spam indexes as needed.")
+        parser.add_argument('--serve', action='store_true', default=False,
+                            help="Run the indexing service, the single writer of the index.")
+        parser.add_argument('--batch', type=int, default=0, help="Maximum number of posts per commit.")
+        parser.add_argument('--interval', type=int, default=0, help="Seconds between two commits.")
 
     def handle(self, *args, **options):
 
@@ -28,6 +44,16 @@ class Command(BaseCommand):
         remove = options['remove']
         report = options['report']
         index = options['index']
+        serve = options['serve']
+        bulk = options['bulk']
+        workers = options['workers']
+        chunk = options['chunk']
+        batch = options['batch']
+        interval = options['interval']
+        compare = options['compare']
+        optimize = options['optimize']
+        maintain = options['maintain']
+        vectors = options['vectors']
 
         # Sets the un-indexed flags to false on all posts.
         if reset:
@@ -58,7 +84,47 @@ class Command(BaseCommand):
             count = Post.objects.valid_posts(indexed=False).exclude(root=None).count()
             logger.info(f"Finished with {count} unindexed posts remaining")
 
+        # Reindex every valid post.
+        if bulk:
+            search.bulk_index(overwrite=remove, chunk=chunk, workers=workers)
+
+        # The trigger keeps the vectors current, a rebuild follows a change of the configuration.
+        if vectors:
+            from biostar.forum import pgsearch
+            count = pgsearch.reindex()
+            logger.info(f"Rebuilt the search vectors of {count} posts")
+
+        # Old shards receive few changes and are kept fully merged.
+        if optimize:
+            ix = search.init_index()
+            if isinstance(ix, search.ShardedIndex):
+                keys = ix.optimize_frozen()
+                logger.info(f"Optimized frozen shards: {', '.join(keys) or 'none'}")
+            else:
+                search.optimize_index(ix)
+                logger.info("Optimized the index")
+
+        # Apply the maintenance the indexes need.
+        if maintain:
+            maintenance.maintain()
+
         # Report the contents of the index
         if report:
             search.print_info()
+            stats = search.cache_stats()
+            print(f"{stats['hits']} cache hits, {stats['misses']} cache misses, {stats['ratio']:.1%} hit ratio")
+            maintenance.report()
+
+        # Build both schemas side by side and print the differences.
+        if compare:
+            rows = search.compare_schemas(chunk=chunk)
+            print(f"{'schema':<10}{'docs':>8}{'size (MB)':>12}{'index (s)':>12}{'open (ms)':>12}{'page (ms)':>12}")
+            for row in rows:
+                print(f"{row['schema']:<10}{row['docs']:>8}{row['size'] / 1024 ** 2:>12.2f}{row['index_secs']:>12.2f}"
+                      f"{row['open_ms']:>12.2f}{row['page_ms']:>12.2f}")
+
+        # Keep the index up to date until stopped.
+        if serve:
+            service = indexer.IndexService(batch=batch, interval=interval)
+            service.run()
 
@@ -0,0 +1,34 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from biostar.forum.models import Similar
+from biostar.forum import similar
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Precomputes the similar posts of each thread.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=0, help="Number of similar posts kept per thread.")
+        parser.add_argument('--chunk', type=int, default=1000, help="Threads loaded per query.")
+        parser.add_argument('--limit', type=int, default=0, help="Stop after updating this many threads.")
+        parser.add_argument('--force', action='store_true', default=False,
+                            help="Recompute all threads, even when unchanged.")
+        parser.add_argument('--reset', action='store_true', default=False, help="Removes all similar posts.")
+
+    def handle(self, *args, **options):
+        top = options['top']
+        chunk = options['chunk']
+        limit = options['limit']
+        force = options['force']
+        reset = options['reset']
+
+        if reset:
+            Similar.objects.all().delete()
+            logger.info("Removed all similar posts.")
+            return
+
+        count = similar.update_similar(top=top, chunk=chunk, limit=limit, force=force)
+        logger.info(f"Updated similar posts of {count} threads.")
@@ -17,12 +17,27 @@ class Command(BaseCommand):
         parser.add_argument('--reset', action='store_true', default=False, help="Resets the indexed flags.")
         parser.add_argument('--remove', action='store_true', default=False, help="Removes the existing index.")
         parser.add_argument('--test', action='store_true', default=False,
-                            help="Run specificity/sensitivity test against content in database.")
-        parser.add_argument('--niter', type=int, default=100, help="Number of iterations to test.")
-        parser.add_argument('--nsize', type=int, default=1500, help="Size of index per iteration.")
-        parser.add_argument('--limitmb', type=int, default=1024, help="Limit the size of the index buffer when testing")
+                            help="Cross validate the spam scores against content in database.")
+        parser.add_argument('--folds', type=int, default=5, help="Number of cross validation folds.")
+        parser.add_argument('--nsize', type=int, default=1500, help="Number of spam and of ham posts used.")
+        parser.add_argument('--engine', default='', choices=['', 'index', 'model', 'both'],
+                            help="Spam engine to test, the SPAM_ENGINE setting by default.")
+        parser.add_argument('--thresholds', type=float, nargs='*',
+                            help="Thresholds to report, the current one and the score deciles by default.")
         parser.add_argument('--index', action='store_true', default=False, help="How many posts to index")
-        parser.add_argument('--verb', type=int, default=0, help="Set the verbosity")
+        parser.add_argument('--train', action='store_true', default=False,
+                            help="Train the spam classifier on nsize spam and ham posts.")
+        parser.add_argument('--rescore', action='store_true', default=False,
+                            help="Score quarantined and recent low reputation posts again.")
+        parser.add_argument('--days', type=int, default=30, help="Age in days of the recent posts to rescore.")
+        parser.add_argument('--chunk', type=int, default=500, help="Posts scored per chunk.")
+        parser.add_argument('--workers', type=int, default=0, help="Worker processes used to rescore or test.")
+        parser.add_argument('--compact', action='store_true', default=False,
+                            help="Evict the spam index samples over the cap of each class.")
+        parser.add_argument('--report', action='store_true', default=False,
+                            help="Print the class balance and size of the spam index.")
+        parser.add_argument('--dry', action='store_true', default=False,
+                            help="Report the posts that would change state without saving.")
 
     def handle(self, *args, **options):
 
@@ -32,10 +47,9 @@ class Command(BaseCommand):
         remove = options['remove']
         index = options['index']
         test = options['test']
-        verbosity = options['verb']
-        niter = options['niter']
         nsize = options['nsize']
-        limitmb = options['limitmb']
+        train = options['train']
+        rescore = options['rescore']
 
         # Sets the un-indexed flags to false on all posts.
         if reset:
@@ -46,6 +60,24 @@ class Command(BaseCommand):
         if index:
             spam.build_spam_index(overwrite=remove, add_ham=True, limit=nsize)
 
+        # Train the classifier, running processes reload it on their next score.
+        if train:
+            spam.train_model(limit=nsize)
+
+        # Apply a new threshold, index or model to the existing posts.
+        if rescore:
+            spam.rescore(days=options['days'], chunk=options['chunk'], workers=options['workers'],
+                         dry=options['dry'])
+
+        # Keep the spam index within its cap.
+        if options['compact']:
+            spam.compact_spam_index()
+
+        if options['report']:
+            spam.index_report()
+
         # Run specificity and sensitivity tests on posts.
         if test:
-            spam.test_classify(niter=niter, size=nsize, limitmb=limitmb, verbosity=verbosity)
+            rows = spam.cross_validate(folds=options['folds'], size=nsize, engine=options['engine'],
+                                       thresholds=options['thresholds'], workers=options['workers'])
+            spam.report(rows)
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_vote_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='indexed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_indexed_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Similar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uids', models.TextField(default='')),
+                ('digest', models.CharField(default='', max_length=32)),
+                ('date', models.DateTimeField(auto_now=True)),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='similar', to='forum.post')),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# The search vector of a post: title, tags and content, weighted in that order.
+VECTOR = """
+    setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+    setweight(to_tsvector('english', replace(coalesce(NEW.tag_val, ''), ',', ' ')), 'B') ||
+    setweight(to_tsvector('english', coalesce(NEW.content, '')), 'C')
+"""
+
+FORWARD = f"""
+ALTER TABLE forum_post ADD COLUMN search_vector tsvector;
+
+CREATE FUNCTION forum_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {VECTOR};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER forum_post_search_vector BEFORE INSERT OR UPDATE OF title, tag_val, content
+    ON forum_post FOR EACH ROW EXECUTE PROCEDURE forum_post_search_vector();
+
+UPDATE forum_post SET search_vector = {VECTOR.replace('NEW.', '')};
+
+CREATE INDEX forum_post_search_vector_gin ON forum_post USING gin(search_vector);
+"""
+
+BACKWARD = """
+DROP TRIGGER IF EXISTS forum_post_search_vector ON forum_post;
+DROP FUNCTION IF EXISTS forum_post_search_vector();
+ALTER TABLE forum_post DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+def forwards(apps, schema_editor):
+    # Full text search columns exist on PostgreSQL only.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(FORWARD)
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_similar'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
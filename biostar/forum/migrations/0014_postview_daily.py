@@ -0,0 +1,39 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('views', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postview',
+            index=models.Index(fields=['ip', 'post', 'date'], name='forum_postv_ip_c04565_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postview',
+            index=models.Index(fields=['date'], name='forum_postv_date_15571a_idx'),
+        ),
+        migrations.AddField(
+            model_name='postviewdaily',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='forum.post'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='postviewdaily',
+            unique_together={('post', 'date')},
+        ),
+    ]
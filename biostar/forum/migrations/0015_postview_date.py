@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:23
+
+import biostar.forum.util
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0014_postview_daily'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='postview',
+            name='date',
+            field=models.DateTimeField(default=biostar.forum.util.now),
+        ),
+    ]
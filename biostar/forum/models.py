@@ -129,7 +129,7 @@ class Post(models.Model):
     rank = models.FloatField(default=0, blank=True, db_index=True)
 
     # This post has been indexed by the search engine.
-    indexed = models.BooleanField(default=False)
+    indexed = models.BooleanField(default=False, db_index=True)
 
     # Used for efficiency
     #is_public_toplevel = models.BooleanField(default=False)
@@ -419,9 +419,47 @@ class PostView(models.Model):
     """
     Keeps track of post views based on IP address.
     """
+
+    class Meta:
+        # Finding the recent views of an address and the views past the retention window.
+        indexes = [models.Index(fields=["ip", "post", "date"]), models.Index(fields=["date"])]
+
     ip = models.GenericIPAddressField(default='', null=True, blank=True)
     post = models.ForeignKey(Post, related_name="post_views", on_delete=models.CASCADE)
-    date = models.DateTimeField(auto_now_add=True)
+
+    # Buffered views are written after the fact and keep the time they were recorded.
+    date = models.DateTimeField(default=util.now)
+
+
+class PostViewDaily(models.Model):
+    """
+    Number of views of a post on a day, rolled up from the PostView rows past the retention window.
+    """
+
+    class Meta:
+        unique_together = (("post", "date"))
+
+    post = models.ForeignKey(Post, related_name="daily_views", on_delete=models.CASCADE)
+    date = models.DateField(db_index=True)
+    views = models.IntegerField(default=0)
+
+
+class Similar(models.Model):
+    """
+    Top level posts most similar to a thread, computed offline by the similar command.
+    """
+    post = models.OneToOneField(Post, related_name="similar", on_delete=models.CASCADE)
+
+    # Uids of the similar posts separated by commas, most similar first.
+    uids = models.TextField(default='')
+
+    # Digest of the title, tags and content the neighbours were computed from.
+    digest = models.CharField(max_length=32, default='')
+
+    date = models.DateTimeField(auto_now=True)
+
+    def get_uids(self):
+        return [uid for uid in self.uids.split(",") if uid]
 
 
 class Subscription(models.Model):
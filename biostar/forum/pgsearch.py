@@ -0,0 +1,218 @@
+"""
+PostgreSQL full text search backend, used when settings.SEARCH_BACKEND is "postgres".
+
+Posts carry a search_vector tsvector column built from the title, tags and content.
+A trigger keeps it current in the same transaction as the post and a GIN index
+covers it (see migration 0013_search_vector). Results are returned as the same
+SearchResult objects as the whoosh backend.
+
+The backend needs psycopg2, an optional requirement installed along with PostgreSQL.
+"""
+import logging
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+
+from biostar.forum.models import Post
+from biostar.forum import search
+
+logger = logging.getLogger('engine')
+
+try:
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchHeadline, SearchVectorField
+
+    # The search vector column is maintained by the database and is not a model field.
+    VECTOR = RawSQL('"forum_post"."search_vector"', [], output_field=SearchVectorField())
+except ImportError as exc:
+    # Without psycopg2 the helpers still load, searching raises an error.
+    VECTOR = None
+    logger.debug(f"postgres search backend unavailable: {exc}")
+
+# Text search configuration of the search vector.
+CONFIG = "english"
+
+# Weight of each searchable field in the search vector.
+WEIGHTS = dict(title="A", tags="B", content="C")
+
+# Number of key terms used to find similar posts.
+SIMILAR_TERMS = 5
+
+# Matches in the headline are marked like whoosh highlights.
+HEADLINE = dict(start_sel='<b class="match">', stop_sel='</b>', max_fragments=3)
+
+
+def get_words(text):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in search.STOP]
+
+
+def check_backend():
+    if VECTOR is None:
+        raise ImproperlyConfigured('SEARCH_BACKEND = "postgres" needs psycopg2 and a PostgreSQL database.')
+
+
+def raw_query(text, fields):
+    """
+    Returns the tsquery matching any of the words in the vector fields, None if there is nothing to match.
+    """
+    labels = "".join(sorted(WEIGHTS[field] for field in fields if field in WEIGHTS))
+    words = get_words(text)
+    if not (labels and words):
+        return None
+
+    # Words hold only word characters, safe to use in a raw query.
+    return " | ".join(f"{word}:{labels}" for word in words)
+
+
+def make_query(text, fields):
+    """
+    Returns a query matching any of the words in the vector fields, None if there is nothing to match.
+    """
+    check_backend()
+    raw = raw_query(text, fields)
+    return SearchQuery(raw, config=CONFIG, search_type="raw") if raw else None
+
+
+def match(text, fields):
+    """
+    Returns the valid posts matching a query in the given fields and the full text query used.
+    """
+    query = make_query(text, fields)
+    words = text.split()
+
+    cond = Q(pk__in=[])
+    if query:
+        cond |= Q(vector=query)
+    if "uid" in fields:
+        cond |= Q(uid__in=words)
+    if "author_uid" in fields:
+        cond |= Q(author__profile__uid__in=words)
+    if "author_handle" in fields:
+        cond |= Q(author__username__in=words)
+    if "author" in fields:
+        cond |= Q(author__profile__name__iexact=text.strip())
+
+    posts = Post.objects.valid_posts().exclude(spam=Post.SPAM).annotate(vector=VECTOR).filter(cond)
+    return posts, query
+
+
+def with_details(posts, query):
+    """
+    Adds the headline and the related rows needed to render the results.
+    The database computes headlines only for the rows returned.
+    """
+    if query:
+        posts = posts.annotate(highlight=SearchHeadline("content", query, config=CONFIG, **HEADLINE))
+    return posts.select_related("root", "author__profile", "lastedit_user__profile")
+
+
+def to_results(posts):
+    """
+    Turns posts annotated with their rank into search results.
+    """
+    results = []
+    for post in posts:
+        doc = search.post_document(post)
+        doc['content'] = doc['content'][:search.HIT_CONTENT_CHARS]
+        highlight = getattr(post, "highlight", "")
+        results.append(search.SearchResult(score=post.score, highlight=highlight, **doc))
+
+    return results
+
+
+def search_posts(text, fields=None, page=None, per_page=None, sortedby=[], reverse=True, limit=None):
+    """
+    Searches posts, returning a page of results when a page is given.
+    Results are ordered by the sort fields then by rank.
+    """
+    check_backend()
+    fields = fields or ['tags', 'title', 'author', 'author_uid', 'content', 'author_handle']
+    per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
+
+    posts, query = match(text, fields)
+    rank = SearchRank(VECTOR, query) if query else Value(0, output_field=FloatField())
+    posts = posts.annotate(score=rank)
+
+    prefix = "-" if reverse else ""
+    order = [f"{prefix}{name}" for name in sortedby] + ["-score", "-pk"]
+    posts = posts.order_by(*order)
+
+    total = posts.count()
+    posts = with_details(posts, query)
+    if page:
+        start = (page - 1) * per_page
+        rows = posts[start:start + per_page]
+        pagecount = max(math.ceil(total / per_page), 1)
+    else:
+        rows = posts[:limit or settings.SEARCH_LIMIT]
+        page, pagecount = 1, 1
+
+    results = to_results(rows)
+    return search.SearchPage(results, total=total, pagenum=page, pagecount=pagecount)
+
+
+def key_terms(text, numterms=SIMILAR_TERMS):
+    """
+    Returns the most frequent words of a text that are not stop words.
+    """
+    counts = Counter(word for word in get_words(text) if len(word) > 2 and not word.isdigit())
+    return [word for word, count in counts.most_common(numterms)]
+
+
+def find_similar(post, top=None):
+    """
+    Returns the top level posts sharing the key terms of a post, best matches first.
+    """
+    check_backend()
+    top = top or settings.SIMILAR_FEED_COUNT
+    terms = key_terms(f"{post.title} {post.content}")
+    query = make_query(" ".join(terms), fields=WEIGHTS.keys())
+    if not query:
+        return []
+
+    posts = Post.objects.valid_posts(is_toplevel=True).exclude(spam=Post.SPAM).exclude(pk=post.pk)
+    posts = posts.annotate(vector=VECTOR).filter(vector=query)
+    posts = posts.annotate(score=SearchRank(VECTOR, query)).order_by("-score", "-pk")
+    posts = with_details(posts, query)[:top]
+
+    return to_results(posts)
+
+
+def preform_search(query, fields=None, top=0, sortedby=[], more_like_this=False):
+    """
+    Same results as search.preform_search, answered by the database.
+    """
+    fields = fields or ['tags', 'title', 'author', 'author_uid', 'author_handle']
+    results = search_posts(query, fields=fields, sortedby=sortedby)
+
+    if more_like_this:
+        post = Post.objects.filter(uid=results[0].uid).first() if results else None
+        return find_similar(post, top=top) if post else []
+
+    return list(results)
+
+
+def reindex(ids=None):
+    """
+    Rebuilds the search vectors of posts, of all posts when no ids are given.
+    Returns the number of posts updated.
+    """
+    sql = """
+        UPDATE forum_post SET search_vector =
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', replace(coalesce(tag_val, ''), ',', ' ')), 'B') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'C')
+    """
+    params = []
+    if ids is not None:
+        sql += " WHERE id = ANY(%s)"
+        params = [list(ids)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
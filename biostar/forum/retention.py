@@ -0,0 +1,78 @@
+"""
+Retention of the post views.
+
+PostView rows older than POST_VIEW_KEEP_DAYS are added to the daily views of their post
+and deleted, POST_VIEW_ROLLUP_BATCH rows at a time. Each batch is rolled up and deleted
+in one transaction so that an interrupted run counts every view once. The views and the
+daily rows are locked, the cleanup command and the rollup timer may run at the same time.
+"""
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from biostar.forum import util
+from biostar.forum.models import PostView, PostViewDaily
+
+logger = logging.getLogger('engine')
+
+
+def add_daily(counts):
+    """
+    Adds the views in counts, keyed by (post_id, date), to the daily views.
+    Runs within the transaction of the rollup.
+    """
+    # Missing rows are created empty, the rows created meanwhile by another rollup are kept.
+    # Writing first also takes the database write lock on SQLite, which has no row locks.
+    empty = [PostViewDaily(post_id=post_id, date=day, views=0) for post_id, day in counts]
+    PostViewDaily.objects.bulk_create(empty, batch_size=500, ignore_conflicts=True)
+
+    # Locked rows are added to by one rollup after the other.
+    daily = PostViewDaily.objects.select_for_update().filter(post_id__in={post_id for post_id, day in counts},
+                                                             date__in={day for post_id, day in counts})
+    changed = []
+    for row in daily:
+        views = counts.get((row.post_id, row.date))
+        if views:
+            row.views += views
+            changed.append(row)
+
+    PostViewDaily.objects.bulk_update(changed, ["views"], batch_size=500)
+
+
+def rollup(days=None, batch=None, limit=None):
+    """
+    Rolls up and deletes the post views older than days, batch rows at a time,
+    stopping after limit batches when given. Returns the rows pruned and the seconds taken.
+    """
+    days = settings.POST_VIEW_KEEP_DAYS if days is None else days
+    batch = batch or settings.POST_VIEW_ROLLUP_BATCH
+    since = util.now() - timedelta(days=days)
+
+    # Concurrent rollups take different rows where the database can skip locked rows, wait otherwise.
+    skip_locked = connection.features.has_select_for_update_skip_locked
+
+    start = time.time()
+    pruned = steps = 0
+    while limit is None or steps < limit:
+        with transaction.atomic():
+            views = PostView.objects.select_for_update(skip_locked=skip_locked).filter(date__lt=since)
+            rows = list(views.order_by("id").values_list("id", "post_id", "date")[:batch])
+            if not rows:
+                break
+
+            # Views fall on the day of the site time zone.
+            counts = Counter((post_id, timezone.localtime(date).date()) for pk, post_id, date in rows)
+            add_daily(counts)
+            PostView.objects.filter(id__in=[pk for pk, post_id, date in rows]).delete()
+
+        pruned += len(rows)
+        steps += 1
+
+    secs = time.time() - start
+    logger.info(f"pruned {pruned} post views older than {days} days in {secs:.1f} seconds")
+    return pruned, secs
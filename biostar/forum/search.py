@@ -1,16 +1,26 @@
+import hashlib
+import heapq
 import logging
+import math
 import os
+import re
+import shutil
+import threading
 import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from itertools import count, islice
 from collections import defaultdict
 
 # Postgres specific queries should go into separate module.
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
 from whoosh import writing, classify
 from whoosh.analysis import StemmingAnalyzer
 from whoosh.writing import AsyncWriter
-from whoosh.searching import Results
+from whoosh.searching import Results, Searcher
+from whoosh.reading import MultiReader, EmptyReader
 
 from whoosh.qparser import MultifieldParser, OrGroup
 from whoosh.analysis import STOP_WORDS
@@ -18,6 +28,7 @@ from whoosh.index import create_in, open_dir, exists_in
 from whoosh.fields import ID, TEXT, KEYWORD, Schema, BOOLEAN, NUMERIC, DATETIME
 
 from biostar.forum.models import Post
+from biostar.forum import util, const
 
 logger = logging.getLogger('biostar')
 
@@ -84,9 +95,31 @@ class SearchResult(object):
         return self.total
 
 
-def normalize_result(result):
+class SearchPage(list):
+    """
+    One page of search results that can be cached.
+    """
+
+    def __init__(self, results=(), total=0, pagenum=1, pagecount=1, exact=True):
+        super(SearchPage, self).__init__(results)
+        self.total = total
+        self.pagenum = pagenum
+        self.pagecount = pagecount
+        # The total is a lower bound when older shards were not searched.
+        self.exact = exact
+
+    def is_last_page(self):
+        return self.pagenum >= self.pagecount
+
+
+def normalize_result(result, fields=None):
     "Return a bunch object for result."
 
+    # Stored fields of the result, loaded from the database for a compact index.
+    fields = result if fields is None else fields
+    score = result.score
+    result = fields
+
     # Result is a database object.
     bunched = SearchResult(title=result.get('title'), content=result.get('content'), url=result.get('url'),
                            type_display=result.get('type_display'), content_length=result.get('content_length'),
@@ -94,7 +127,7 @@ def normalize_result(result):
                            is_spam=result.get("is_spam", False), is_toplevel=result.get('is_toplevel'),
                            rank=result.get('rank'), uid=result.get('uid'),
                            author_handle=result.get('author_handle'), author=result.get('author'),
-                           author_score=result.get('author_score'), score=result.score,
+                           author_score=result.get('author_score'), score=score,
                            thread_votecount=result.get('thread_votecount'), vote_count=result.get('vote_count'),
                            author_uid=result.get('author_uid'), author_url=result.get('author_url'))
 
@@ -105,41 +138,78 @@ def index_exists(dirname=settings.INDEX_DIR, indexname=settings.INDEX_NAME):
     return exists_in(dirname=dirname, indexname=indexname)
 
 
+def post_document(post):
+    """
+    Returns the index fields of a post.
+    The author, editor and root of the post should be preloaded.
+    """
+    author, editor, root = post.author, post.lastedit_user, post.root
+
+    doc = dict(title=post.title, url=post.get_absolute_url(),
+               type_display=post.get_type_display(),
+               content_length=len(post.content),
+               type=post.type,
+               creation_date=post.creation_date,
+               lastedit_date=post.lastedit_date,
+               lastedit_user=editor.profile.name,
+               lastedit_user_email=author.email,
+               lastedit_user_score=author.profile.score,
+               lastedit_user_uid=author.profile.uid,
+               lastedit_user_url=editor.profile.get_absolute_url(),
+               content=post.content,
+               tags=post.tag_val,
+               is_toplevel=post.is_toplevel,
+               rank=post.rank, uid=post.uid,
+               vote_count=post.vote_count,
+               reply_count=post.reply_count,
+               view_count=post.view_count,
+               author_handle=author.username,
+               author=author.profile.name,
+               answer_count=root.answer_count,
+               root_has_accepted=root.has_accepted,
+               author_email=author.email,
+               author_score=author.profile.score,
+               thread_votecount=post.thread_votecount,
+               author_uid=author.profile.uid,
+               author_url=author.profile.get_absolute_url(),
+               author_is_moderator=author.profile.is_moderator,
+               author_is_suspended=author.profile.is_suspended,
+               lastedit_user_is_suspended=editor.profile.is_suspended,
+               lastedit_user_is_moderator=editor.profile.is_moderator)
+    return doc
+
+
+def schema_document(doc, schema):
+    """
+    Drops the fields of a document that are not in the schema.
+    """
+    return {key: value for key, value in doc.items() if key in schema}
+
+
 def add_index(post, writer):
-    writer.update_document(title=post.title, url=post.get_absolute_url(),
-                           type_display=post.get_type_display(),
-                           content_length=len(post.content),
-                           type=post.type,
-                           creation_date=post.creation_date,
-                           lastedit_date=post.lastedit_date,
-                           lastedit_user=post.lastedit_user.profile.name,
-                           lastedit_user_email=post.author.email,
-                           lastedit_user_score=post.author.profile.score,
-                           lastedit_user_uid=post.author.profile.uid,
-                           lastedit_user_url=post.lastedit_user.profile.get_absolute_url(),
-                           content=post.content,
-                           tags=post.tag_val,
-                           is_toplevel=post.is_toplevel,
-                           rank=post.rank, uid=post.uid,
-                           vote_count=post.vote_count,
-                           reply_count=post.reply_count,
-                           view_count=post.view_count,
-                           author_handle=post.author.username,
-                           author=post.author.profile.name,
-                           answer_count=post.root.answer_count,
-                           root_has_accepted=post.root.has_accepted,
-                           author_email=post.author.email,
-                           author_score=post.author.profile.score,
-                           thread_votecount=post.thread_votecount,
-                           author_uid=post.author.profile.uid,
-                           author_url=post.author.profile.get_absolute_url(),
-                           author_is_moderator=post.author.profile.is_moderator,
-                           author_is_suspended=post.author.profile.is_suspended,
-                           lastedit_user_is_suspended=post.lastedit_user.profile.is_suspended,
-                           lastedit_user_is_moderator=post.lastedit_user.profile.is_moderator)
-
-
-def get_schema():
+    doc = schema_document(post_document(post), schema=writer.schema)
+    writer.update_document(**doc)
+
+
+def build_documents(ids):
+    """
+    Builds the index documents for a chunk of post ids with a single query.
+    Runs inside the worker processes of bulk_index.
+    """
+    posts = Post.objects.filter(id__in=ids).select_related("root", "author__profile", "lastedit_user__profile")
+    docs = [post_document(post) for post in posts]
+    return docs
+
+
+def get_schema(compact=None):
+    """
+    Returns the schema of the search index.
+    The compact schema is used when requested or when settings.INDEX_COMPACT is set.
+    """
+    compact = settings.INDEX_COMPACT if compact is None else compact
+    if compact:
+        return get_compact_schema()
+
     analyzer = StemmingAnalyzer(stoplist=STOP)
     schema = Schema(title=TEXT(stored=True, analyzer=analyzer, sortable=True),
                     url=ID(stored=True),
@@ -171,19 +241,81 @@ def get_schema():
                     reply_count=NUMERIC(stored=True, sortable=True),
                     view_count=NUMERIC(stored=True, sortable=True),
                     answer_count=NUMERIC(stored=True, sortable=True),
-                    uid=ID(stored=True),
+                    uid=ID(stored=True, unique=True),
                     type=NUMERIC(stored=True, sortable=True),
                     type_display=TEXT(stored=True))
     return schema
 
 
-def init_index(dirname=None, indexname=None, schema=None):
+def get_compact_schema():
+    """
+    Stores only the uid, results are loaded from the database.
+    Keeps the fields used for searching, sorting and filtering,
+    and term vectors of the content for highlights and more like this.
+    """
+    analyzer = StemmingAnalyzer(stoplist=STOP)
+    schema = Schema(uid=ID(stored=True, unique=True),
+                    title=TEXT(analyzer=analyzer, sortable=True),
+                    content=TEXT(analyzer=analyzer, vector=True),
+                    tags=KEYWORD(commas=True),
+                    author=TEXT,
+                    author_handle=TEXT,
+                    author_uid=ID,
+                    is_toplevel=BOOLEAN(stored=True),
+                    type=NUMERIC(stored=True, sortable=True),
+                    lastedit_date=DATETIME(sortable=True),
+                    creation_date=DATETIME(sortable=True),
+                    rank=NUMERIC(sortable=True),
+                    content_length=NUMERIC(sortable=True),
+                    thread_votecount=NUMERIC(sortable=True),
+                    vote_count=NUMERIC(sortable=True),
+                    reply_count=NUMERIC(sortable=True),
+                    view_count=NUMERIC(sortable=True),
+                    answer_count=NUMERIC(sortable=True),
+                    author_score=NUMERIC(sortable=True),
+                    lastedit_user_score=NUMERIC(sortable=True))
+    return schema
+
+
+def is_compact(schema):
+    """
+    A compact index does not store the content of the posts.
+    """
+    return not schema['content'].stored
+
+
+def hit_fields(hits):
+    """
+    Returns the stored fields of each hit, with the hits they belong to.
+    Hits of a compact index are loaded from the database with one query.
+    """
+    hits = list(hits)
+    if not hits or not is_compact(hits[0].searcher.schema):
+        return [(hit, hit.fields()) for hit in hits]
+
+    uids = [hit['uid'] for hit in hits]
+    posts = Post.objects.filter(uid__in=uids).select_related("root", "author__profile", "lastedit_user__profile")
+    docs = {post.uid: post_document(post) for post in posts}
+
+    # Posts removed from the database since the last commit are skipped.
+    pairs = [(hit, docs[hit['uid']]) for hit in hits if hit['uid'] in docs]
+    return pairs
+
+
+def init_index(dirname=None, indexname=None, schema=None, shards=None):
     # Initialize a new index or return an already existing one.
 
     ix_scheme = schema or get_schema()
     dirname = dirname or settings.INDEX_DIR
     indexname = indexname or settings.INDEX_NAME
 
+    # The forum index is split into shards when configured.
+    if shards is None and (dirname, indexname) == (settings.INDEX_DIR, settings.INDEX_NAME):
+        shards = settings.INDEX_SHARDS
+
+    if shards:
+        return ShardedIndex(dirname=dirname, indexname=indexname, by=shards, schema=ix_scheme)
+
     if exists_in(dirname=dirname, indexname=indexname):
         ix = open_dir(dirname=dirname, indexname=indexname)
     else:
@@ -194,18 +326,347 @@ def init_index(dirname=None, indexname=None, schema=None):
     return ix
 
 
-def print_info(dirname=None, indexname=None,):
+def optimized_marker(ix):
+    return os.path.join(ix.storage.folder, f"{ix.indexname}.optimized")
+
+
+def optimize_index(ix):
     """
-    Prints information on the index.
+    Merges an index into a single segment and records the time of the merge.
+    """
+    ix.optimize()
+    with open(optimized_marker(ix), "w") as stream:
+        stream.write(util.now().isoformat())
+
+
+def last_optimized(ix):
+    """
+    Returns the time an index was last optimized, None when unknown.
+    """
+    path = optimized_marker(ix)
+    if not os.path.exists(path):
+        return None
+    return datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+
+
+class ShardedIndex(object):
+    """
+    Search index split into shards by post creation year or by post type.
+
+    Each shard is a separate index named {indexname}_{key} in the index directory,
+    created when the first post is routed to it. Offers the parts of the whoosh
+    index interface used by the forum: readers span every shard, writers route
+    each document to the shard that owns it.
+    """
+
+    def __init__(self, dirname, indexname, by, schema=None):
+        self.dirname = dirname
+        self.indexname = indexname
+        self.by = by
+        self.schema = schema or get_schema()
+        self.indexes = dict()
+        self.pattern = re.compile(rf"^_{re.escape(indexname)}_(\d+)_\d+\.toc$")
+
+    def shard_key(self, doc):
+        value = doc['creation_date'].year if self.by == "year" else doc['type']
+        return str(value)
+
+    def shard_name(self, key):
+        return f"{self.indexname}_{key}"
+
+    def keys(self):
+        """
+        Returns the keys of the existing shards, newest first.
+        """
+        if not os.path.isdir(self.dirname):
+            return []
+        keys = {m.group(1) for m in map(self.pattern.match, os.listdir(self.dirname)) if m}
+        return sorted(keys, key=int, reverse=True)
+
+    def shard(self, key):
+        if key not in self.indexes:
+            self.indexes[key] = init_index(dirname=self.dirname, indexname=self.shard_name(key),
+                                           schema=self.schema, shards='')
+        return self.indexes[key]
+
+    def shards(self):
+        return [(key, self.shard(key)) for key in self.keys()]
+
+    def latest_generation(self):
+        return tuple((key, ix.latest_generation()) for key, ix in self.shards())
+
+    def reader(self):
+        readers = [ix.reader() for key, ix in self.shards()]
+        if not readers:
+            return EmptyReader(self.schema)
+        return MultiReader(readers)
+
+    def searcher(self, **kwargs):
+        return Searcher(self.reader(), fromindex=self, **kwargs)
+
+    def writer(self, **kwargs):
+        return ShardedWriter(self, **kwargs)
+
+    def doc_count(self):
+        return sum(ix.doc_count() for key, ix in self.shards())
+
+    def doc_count_all(self):
+        return sum(ix.doc_count_all() for key, ix in self.shards())
+
+    def frozen(self):
+        """
+        Keys of the shards that no longer receive new posts: every year shard but the current one.
+        """
+        if self.by != "year":
+            return []
+        year = util.now().year
+        return [key for key in self.keys() if int(key) < year]
+
+    def optimize_frozen(self):
+        """
+        Merges each frozen shard into a single segment. Returns the keys of the optimized shards.
+        """
+        optimized = []
+        for key in self.frozen():
+            ix = self.shard(key)
+            with ix.reader() as reader:
+                segments = len(reader.leaf_readers())
+            # Edits to old posts add segments that are merged again.
+            if segments > 1 or ix.doc_count() != ix.doc_count_all():
+                optimize_index(ix)
+                optimized.append(key)
+        return optimized
+
+    def close(self):
+        for ix in self.indexes.values():
+            ix.close()
+
+
+class ShardedWriter(object):
+    """
+    Writes documents to the shards of a sharded index.
+    Only the shards that receive changes are locked.
+    """
+
+    def __init__(self, ix, **kwargs):
+        self.ix = ix
+        self.schema = ix.schema
+        self.kwargs = kwargs
+        self.writers = dict()
+        self.readers = None
+
+    def writer(self, key):
+        if key not in self.writers:
+            self.writers[key] = self.ix.shard(key).writer(**self.kwargs)
+        return self.writers[key]
+
+    def locate(self, uid):
+        """
+        Returns the keys of the shards holding a post.
+        """
+        if self.readers is None:
+            self.readers = {key: ix.reader() for key, ix in self.ix.shards()}
+        return [key for key, reader in self.readers.items() if ('uid', uid) in reader]
+
+    def close_readers(self):
+        for reader in (self.readers or {}).values():
+            reader.close()
+        self.readers = None
+
+    def add_document(self, **doc):
+        self.writer(self.ix.shard_key(doc)).add_document(**doc)
+
+    def update_document(self, **doc):
+        key = self.ix.shard_key(doc)
+
+        # A post with a new shard key is removed from its previous shard.
+        for other in self.locate(doc['uid']):
+            if other != key:
+                self.writer(other).delete_by_term('uid', doc['uid'])
+
+        self.writer(key).update_document(**doc)
+
+    def delete_by_term(self, fieldname, text):
+        keys = self.locate(text) if fieldname == 'uid' else self.ix.keys()
+        for key in keys:
+            self.writer(key).delete_by_term(fieldname, text)
+
+    def commit(self, mergetype=None, **kwargs):
+        # Clearing the index also clears the shards that received no documents.
+        if mergetype is writing.CLEAR:
+            for key in self.ix.keys():
+                self.writer(key)
+
+        self.close_readers()
+        for writer in self.writers.values():
+            writer.commit(mergetype=mergetype, **kwargs)
+        self.writers = dict()
+
+    def cancel(self):
+        self.close_readers()
+        for writer in self.writers.values():
+            writer.cancel()
+        self.writers = dict()
+
+
+class ManagedSearcher(Searcher):
+    """
+    Searcher kept open by a SearcherManager. Closing it hands it back to the manager.
+    """
+
+    def __init__(self, reader, manager=None, **kwargs):
+        # Sub-searchers are created without a manager and close normally.
+        self.manager = manager
+        self.refs = 0
+        self.retired = False
+        self.generation = None
+        super(ManagedSearcher, self).__init__(reader, **kwargs)
+
+    def close(self):
+        if self.manager:
+            self.manager.release(self)
+        else:
+            super(ManagedSearcher, self).close()
+
+    def close_reader(self):
+        super(ManagedSearcher, self).close()
+
+
+class SearcherManager(object):
+    """
+    Keeps an open searcher for each thread of the process.
+
+    The index is opened once. A searcher is replaced only when a commit changes
+    the index generation; the replaced searcher is closed once every
+    caller still holding it has closed it.
+    Searchers are not shared between threads since readers seek shared files.
+    """
+
+    def __init__(self, dirname, indexname):
+        self.dirname = dirname
+        self.indexname = indexname
+        self.ix = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        # Incremented when the index is rebuilt, the searchers opened before are replaced.
+        self.epoch = 0
+
+    def is_current(self, searcher):
+        if searcher.epoch != self.epoch:
+            return False
+        try:
+            return self.ix.latest_generation() == searcher.generation
+        except Exception as exc:
+            # The index directory was removed or replaced.
+            return False
+
+    def open(self):
+        with self.lock:
+            missing = self.ix is None or not (isinstance(self.ix, ShardedIndex) or
+                                              index_exists(dirname=self.dirname, indexname=self.indexname))
+            if missing:
+                self.ix = init_index(dirname=self.dirname, indexname=self.indexname)
+            ix, epoch = self.ix, self.epoch
+
+        # Read the generation first, a commit in between only causes an extra refresh.
+        generation = ix.latest_generation()
+        searcher = ManagedSearcher(ix.reader(), manager=self, fromindex=ix)
+        searcher.generation = generation
+        searcher.epoch = epoch
+
+        return searcher
+
+    def acquire(self):
+        """
+        Returns the searcher of the current thread, refreshed if the index has changed.
+        Close the searcher when done with it.
+        """
+        searcher = getattr(self.local, "searcher", None)
+
+        if searcher is None or not self.is_current(searcher):
+            if searcher is not None:
+                self.retire(searcher)
+            searcher = self.open()
+            self.local.searcher = searcher
+
+        with self.lock:
+            searcher.refs += 1
+
+        return searcher
+
+    def reset(self):
+        """
+        Reopens the index after it is rebuilt. The searchers opened before are retired
+        by their threads on the next acquire.
+        """
+        with self.lock:
+            self.ix = None
+            self.epoch += 1
+
+        searcher = getattr(self.local, "searcher", None)
+        if searcher is not None:
+            self.local.searcher = None
+            self.retire(searcher)
+
+    def retire(self, searcher):
+        with self.lock:
+            searcher.retired = True
+            done = searcher.refs <= 0
+        if done:
+            searcher.close_reader()
+
+    def release(self, searcher):
+        with self.lock:
+            searcher.refs = max(searcher.refs - 1, 0)
+            done = searcher.retired and searcher.refs == 0
+        if done:
+            searcher.close_reader()
+
+
+# Searcher managers for each index opened by this process.
+MANAGERS = dict()
+
+MANAGERS_LOCK = threading.Lock()
+
+
+def get_manager(dirname=None, indexname=None):
+    """
+    Returns the searcher manager for an index.
     """
     dirname = dirname or settings.INDEX_DIR
     indexname = indexname or settings.INDEX_NAME
-    ix = init_index(dirname=dirname, indexname=indexname)
+    key = (dirname, indexname)
+
+    with MANAGERS_LOCK:
+        if key not in MANAGERS:
+            MANAGERS[key] = SearcherManager(dirname=dirname, indexname=indexname)
+
+    return MANAGERS[key]
 
+
+@contextmanager
+def open_searcher(dirname=None, indexname=None):
+    """
+    Context manager over the long lived searcher of an index.
+    """
+    searcher = get_manager(dirname=dirname, indexname=indexname).acquire()
+    try:
+        yield searcher
+    finally:
+        searcher.close()
+
+
+def print_info(dirname=None, indexname=None,):
+    """
+    Prints information on the index.
+    """
     counter = defaultdict(int)
-    for index, fields in enumerate(ix.searcher().all_stored_fields()):
-        key = fields['type_display']
-        counter[key] += 1
+    with open_searcher(dirname=dirname, indexname=indexname) as searcher:
+        types = dict(Post.TYPE_CHOICES)
+        for fields in searcher.all_stored_fields():
+            key = fields.get('type_display') or types.get(fields.get('type'))
+            counter[key] += 1
 
     total = 0
     print('-' * 20)
@@ -215,6 +676,12 @@ def print_info(dirname=None, indexname=None,):
     print('-' * 20)
     print(f"{total} total posts")
 
+    ix = get_manager(dirname=dirname, indexname=indexname).ix
+    if isinstance(ix, ShardedIndex):
+        for key, shard in ix.shards():
+            print(f"{shard.doc_count()}\tshard {key}")
+        print('-' * 20)
+
 
 def index_posts(posts, ix=None, overwrite=False, add_func=add_index):
     """
@@ -244,6 +711,116 @@ def index_posts(posts, ix=None, overwrite=False, add_func=add_index):
     elapsed(f"Indexed posts={total}")
 
 
+def bulk_index(posts=None, ix=None, overwrite=False, chunk=1000, workers=0, limitmb=256):
+    """
+    Reindex posts in primary key chunks.
+
+    Each chunk is loaded with all related rows in one query and turned into
+    documents in a pool of worker processes. A single writer adds the documents.
+    Returns the number of documents and the documents indexed per second.
+    """
+    ix = ix or init_index()
+    posts = Post.objects.valid_posts().exclude(spam=Post.SPAM) if posts is None else posts
+
+    # Claim the posts first, edits made while indexing flag them again.
+    posts.update(indexed=True)
+
+    writer = ix.writer(limitmb=limitmb)
+
+    # Documents can be appended when the index is cleared.
+    add = writer.add_document if overwrite else writer.update_document
+    schema = ix.schema
+
+    start = time.time()
+    total = 0
+    try:
+        for docs in util.pool_map(build_documents, util.chunk_ids(posts, size=chunk), workers=workers):
+            for doc in docs:
+                add(**schema_document(doc, schema=schema))
+            total += len(docs)
+            logger.info(f"... {total} documents added")
+
+        if overwrite:
+            logger.info("Overwriting the old index")
+            writer.commit(mergetype=writing.CLEAR)
+        else:
+            writer.commit()
+    except Exception as exc:
+        logger.error(f"Error in bulk indexing: {exc}")
+        writer.cancel()
+        posts.update(indexed=False)
+        raise
+
+    secs = time.time() - start
+    rate = total / secs if secs else 0
+    logger.info(f"Indexed {total} posts in {secs:.1f} seconds, {rate:.0f} docs/sec ({workers} workers)")
+
+    return total, rate
+
+
+def index_size(dirname):
+    """
+    Returns the size of the files in an index directory in bytes.
+    """
+    paths = [os.path.join(dirname, name) for name in os.listdir(dirname)]
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+def compare_schemas(queries=None, dirname=None, chunk=1000, repeat=5):
+    """
+    Indexes the valid posts with the full and with the compact schema in temporary directories.
+    Returns the index time, size on disk, searcher open time and the time to render
+    a page of results for each schema. The search index in use is not modified.
+    """
+    dirname = dirname or os.path.join(settings.INDEX_DIR, "compare")
+    posts = Post.objects.valid_posts().exclude(spam=Post.SPAM)
+
+    # Search for the first words in the titles of recent threads.
+    if not queries:
+        titles = posts.filter(is_toplevel=True).order_by("-rank").values_list("title", flat=True)[:20]
+        queries = [" ".join(title.split()[:2]) for title in titles]
+        queries = [q for q in queries if q] or ["test"]
+
+    rows = []
+    try:
+        for name, compact in (("full", False), ("compact", True)):
+            path = os.path.join(dirname, name)
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            ix = create_in(dirname=path, schema=get_schema(compact=compact), indexname=settings.INDEX_NAME)
+
+            start = time.time()
+            writer = ix.writer()
+            for ids in util.chunk_ids(posts, size=chunk):
+                for doc in build_documents(ids):
+                    writer.add_document(**schema_document(doc, schema=ix.schema))
+            writer.commit()
+            index_secs = time.time() - start
+
+            start = time.time()
+            for step in range(repeat):
+                open_dir(dirname=path, indexname=settings.INDEX_NAME).searcher().close()
+            open_secs = (time.time() - start) / repeat
+
+            start = time.time()
+            with ix.searcher() as searcher:
+                for step in range(repeat):
+                    for query in queries:
+                        results = preform_whoosh_search(query=query, page=1, sortedby=["lastedit_date"],
+                                                        searcher=searcher)
+                        [compact_hit(hit, fields) for hit, fields in hit_fields(results)]
+            page_secs = (time.time() - start) / (repeat * len(queries))
+
+            row = dict(schema=name, docs=ix.doc_count(), size=index_size(path), index_secs=index_secs,
+                       open_ms=open_secs * 1000, page_ms=page_secs * 1000)
+            ix.close()
+            rows.append(row)
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
+
+    return rows
+
+
 def crawl(reindex=False, overwrite=False, limit=1000):
     """
     Crawl through posts in batches and add them to index.
@@ -270,22 +847,22 @@ def crawl(reindex=False, overwrite=False, limit=1000):
 
 
 def preform_whoosh_search(query, ix=None, fields=None, page=None, per_page=None, sortedby=[], reverse=True,
-                          **kwargs):
+                          searcher=None, limit=None, **kwargs):
     """
         Query the indexed, looking for a match in the specified fields.
-        Results a tuple of results and an open searcher object.
+        Results hold an open searcher, close it with results.searcher.close() when done.
+        The default index is searched with the long lived searcher of the thread.
         """
 
     per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
     fields = fields or ['tags', 'title', 'author', 'author_uid', 'content', 'author_handle']
-    ix = ix or init_index()
-    searcher = ix.searcher()
+    searcher = searcher or (ix.searcher() if ix else get_manager().acquire())
 
     # Splits the query into words and applies
     # and OR filter, eg. 'foo bar' == 'foo OR bar'
     orgroup = OrGroup
 
-    parser = MultifieldParser(fieldnames=fields, schema=ix.schema, group=orgroup).parse(query)
+    parser = MultifieldParser(fieldnames=fields, schema=searcher.schema, group=orgroup).parse(query)
     if page:
         # Return a pagenated version of the results.
         results = searcher.search_page(parser,
@@ -296,7 +873,7 @@ def preform_whoosh_search(query, ix=None, fields=None, page=None, per_page=None,
         # Show more context before and after
         results.results.fragmenter.surround = 100
     else:
-        results = searcher.search(parser, limit=settings.SEARCH_LIMIT, sortedby=sortedby, reverse=reverse,
+        results = searcher.search(parser, limit=limit or settings.SEARCH_LIMIT, sortedby=sortedby, reverse=reverse,
                                   terms=True)
         # Allow larger fragments
         results.fragmenter.maxchars = 100
@@ -314,22 +891,182 @@ def preform_search(query, fields=None, top=0, sortedby=[], more_like_this=False)
 
     if length < settings.SEARCH_CHAR_MIN:
         return []
+
+    if settings.SEARCH_BACKEND == "postgres":
+        from biostar.forum import pgsearch
+        return pgsearch.preform_search(query=query, fields=fields, top=top, sortedby=sortedby,
+                                       more_like_this=more_like_this)
     fields = fields or ['tags', 'title', 'author', 'author_uid', 'author_handle']
     whoosh_results = preform_whoosh_search(query=query, sortedby=sortedby, fields=fields)
 
-    if more_like_this and len(whoosh_results):
+    try:
+        if more_like_this and len(whoosh_results):
             results = whoosh_results[0].more_like_this("content", top=top)
             # Filter results for toplevel posts.
             results = list(filter(lambda p: p['is_toplevel'] is True, results))
-    else:
-        results = whoosh_results
-
-    # Ensure returned results types stay consistent.
-    final_results = list(map(normalize_result, results))
-    if not len(final_results):
-        return []
+        else:
+            results = whoosh_results
 
-    # Ensure searcher object gets closed.
-    whoosh_results.searcher.close()
+        # Ensure returned results types stay consistent.
+        final_results = [normalize_result(hit, fields) for hit, fields in hit_fields(results)]
+    finally:
+        # Ensure searcher object gets closed.
+        whoosh_results.searcher.close()
 
     return final_results
+
+
+# Stored fields kept for each cached hit, as used by the search result template.
+HIT_FIELDS = ['uid', 'title', 'type', 'type_display', 'is_toplevel', 'tags', 'creation_date', 'lastedit_date',
+              'author', 'author_uid', 'author_score', 'author_is_moderator', 'lastedit_user', 'lastedit_user_uid',
+              'lastedit_user_score', 'lastedit_user_is_moderator']
+
+# Characters of content kept for each cached hit.
+HIT_CONTENT_CHARS = 1000
+
+
+def compact_hit(hit, fields=None):
+    """
+    Returns the fields of a hit needed to render it.
+    """
+    fields = hit if fields is None else fields
+    content = fields.get('content') or ''
+    data = {field: fields.get(field) for field in HIT_FIELDS}
+    data['content'] = content[:HIT_CONTENT_CHARS]
+    data['score'] = hit.score
+    # Content that is not stored in the index is highlighted from the database text.
+    data['highlight'] = hit.highlights('content', text=content, top=3)
+    return data
+
+
+def page_key(query, page, sortedby, reverse, generation, per_page=None):
+    """
+    Cache key for a page of results of a given index generation.
+    """
+    # Only the whitespace is normalized, the operators of the query parser are case sensitive.
+    query = ' '.join(query.split())
+    sortedby = ','.join(sortedby)
+    per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
+    text = f"{query}|{page}|{per_page}|{sortedby}|{reverse}|{generation}|{settings.INDEX_DIR}|{settings.INDEX_NAME}"
+    digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+    return f"{const.SEARCH_CACHE_KEY}-{digest}"
+
+
+def count_cache(key):
+    # Counters are kept in the cache to add up across workers when the cache is shared.
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def cache_stats():
+    """
+    Returns the hits and misses of the search result cache.
+    """
+    hits = cache.get(const.SEARCH_CACHE_HITS, 0)
+    misses = cache.get(const.SEARCH_CACHE_MISSES, 0)
+    total = hits + misses
+    ratio = hits / total if total else 0
+    return dict(hits=hits, misses=misses, ratio=ratio)
+
+
+def search_shard(task):
+    """
+    Returns the number of matches in one shard and its top hits, each with the key the hits are merged on.
+    Runs in the fan out worker threads.
+    """
+    dirname, indexname, query, limit, sortedby, reverse = task
+
+    with open_searcher(dirname=dirname, indexname=indexname) as searcher:
+        results = preform_whoosh_search(query=query, limit=limit, sortedby=sortedby, reverse=reverse,
+                                        searcher=searcher)
+        hits = []
+        for hit, fields in hit_fields(results):
+            key = tuple(fields.get(name) for name in sortedby) if sortedby else hit.score
+            hits.append((key, compact_hit(hit, fields)))
+
+        return len(results), hits
+
+
+def fanout_page(ix, query, page=1, sortedby=[], reverse=True, per_page=None, workers=None):
+    """
+    Searches the shards of an index and merges their top hits into one page.
+
+    Shards are searched in a thread pool, newest first. When sorting by creation date
+    on year shards the search stops once the newer shards have filled the page,
+    the total is then a lower bound. Relevance scores are computed per shard.
+    """
+    per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
+    workers = settings.INDEX_SHARD_WORKERS if workers is None else workers
+    sortedby = list(sortedby)
+    limit = page * per_page
+
+    tasks = [(ix.dirname, ix.shard_name(key), query, limit, sortedby, reverse) for key in ix.keys()]
+
+    # Older year shards only hold older posts.
+    early = ix.by == "year" and sortedby[:1] == ["creation_date"] and reverse
+    step = max(workers, 1) if early else max(len(tasks), 1)
+    func = util.get_pool(workers).map if workers else lambda f, items: list(map(f, items))
+
+    total, found, lists, searched = 0, 0, [], 0
+    for start in range(0, len(tasks), step):
+        for count, hits in func(search_shard, tasks[start:start + step]):
+            total += count
+            found += len(hits)
+            lists.append(hits)
+        searched = start + step
+        if early and found >= limit:
+            break
+
+    # Relevance sorted hits come back with the best score first unless reversed.
+    descending = reverse if sortedby else not reverse
+    merged = heapq.merge(*lists, key=lambda item: item[0], reverse=descending)
+    hits = [data for key, data in islice(merged, limit - per_page, limit)]
+
+    exact = searched >= len(tasks)
+    pagecount = max(math.ceil(total / per_page), 1)
+    if not exact:
+        pagecount = max(pagecount, page + 1)
+
+    return dict(hits=hits, total=total, pagenum=page, pagecount=pagecount, exact=exact)
+
+
+def search_page(query, page=1, sortedby=[], reverse=True, per_page=None):
+    """
+    Returns a page of results for a query.
+    Pages are cached until a commit changes the index generation.
+    """
+    # The database answers with current results, no caching needed.
+    if settings.SEARCH_BACKEND == "postgres":
+        from biostar.forum import pgsearch
+        return pgsearch.search_posts(query, page=page, per_page=per_page, sortedby=sortedby, reverse=reverse)
+
+    searcher = get_manager().acquire()
+    try:
+        key = page_key(query=query, page=page, sortedby=sortedby, reverse=reverse, generation=searcher.generation,
+                       per_page=per_page)
+        data = cache.get(key)
+
+        if data is not None:
+            count_cache(const.SEARCH_CACHE_HITS)
+        else:
+            count_cache(const.SEARCH_CACHE_MISSES)
+            if isinstance(searcher.manager.ix, ShardedIndex):
+                data = fanout_page(ix=searcher.manager.ix, query=query, page=page, sortedby=sortedby,
+                                   reverse=reverse, per_page=per_page)
+            else:
+                results = preform_whoosh_search(query=query, page=page, per_page=per_page, sortedby=sortedby,
+                                                reverse=reverse, searcher=searcher)
+                hits = [compact_hit(hit, fields) for hit, fields in hit_fields(results)]
+                data = dict(hits=hits, total=results.total, pagenum=results.pagenum, pagecount=results.pagecount)
+            cache.set(key, data, settings.SEARCH_CACHE_SECS)
+    finally:
+        searcher.close()
+
+    hits = [SearchResult(**hit) for hit in data['hits']]
+    results = SearchPage(hits, total=data['total'], pagenum=data['pagenum'], pagecount=data['pagecount'],
+                         exact=data.get('exact', True))
+
+    return results
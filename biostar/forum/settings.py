@@ -16,6 +16,9 @@ USERS_PER_PAGE = 100
 MESSAGES_PER_PAGE = 100
 TAGS_PER_PAGE = 50
 
+# Listing pages reached by page number, deeper pages are reached by cursor links.
+NUMBERED_PAGES = 10
+
 STATS_DIR = os.path.join(BASE_DIR, "export", "stats")
 
 REQUIRED_TAGS = ""
@@ -58,6 +61,13 @@ SPAM_INDEX_NAME = os.getenv("SPAM_INDEX_NAME", "spam")
 
 SPAM_INDEX_DIR = 'spammers'
 
+# Largest number of spam and of ham samples kept in the spam index.
+SPAM_INDEX_CAP = 5000
+
+# Samples evicted over the cap: "newest" keeps the most recent ones,
+# "reservoir" keeps a uniform random sample of all samples ever added.
+SPAM_INDEX_EVICTION = "newest"
+
 # Ensure posts only have ascii characters.
 ENFORCE_ASCII = True
 
@@ -67,6 +77,22 @@ SPAM_INDEX_DIR = os.path.abspath(os.path.join(MEDIA_ROOT, '..', SPAM_INDEX_DIR))
 # Classify posts and assign a spam score on creation.
 CLASSIFY_SPAM = True
 
+# Spam scoring engine: "index" for similarity to the spam index,
+# "model" for the trained classifier or "both" for their weighted mean.
+SPAM_ENGINE = "index"
+
+# Trained spam classifier, written by: python manage.py spam --train
+SPAM_MODEL_FILE = os.path.join(os.path.dirname(SPAM_INDEX_DIR), 'spam_model.npz')
+
+# Number of hashed features of the spam classifier.
+SPAM_MODEL_FEATURES = 2 ** 18
+
+# Spam probability of the classifier that corresponds to SPAM_THRESHOLD.
+SPAM_MODEL_THRESHOLD = 0.5
+
+# Weight of the classifier when both engines are used.
+SPAM_MODEL_WEIGHT = 0.5
+
 ENABLE_DIGESTS = False
 
 # Disable all asynchronous tasks
@@ -78,6 +104,9 @@ TIME_REQUESTS = True
 # Indexing interval in seconds.
 INDEX_SECS_INTERVAL = 10
 
+# Seconds between two checks for changed posts in the index service.
+INDEX_POLL_SECS = 2
+
 # Number of results to display in total.
 SEARCH_LIMIT = 20
 
@@ -89,8 +118,50 @@ SEARCH_CHAR_MIN = 1
 # Number of results to display per page.
 SEARCH_RESULTS_PER_PAGE = 50
 
+# Seconds a page of search results is cached, pages also expire when the index changes.
+SEARCH_CACHE_SECS = 3600
+
 BATCH_INDEXING_SIZE = 1000
 
+# Seconds a rendered post listing shown to anonymous users stays fresh.
+FRAGMENT_CACHE_SECS = 300
+
+# Seconds a stale listing may be served while one worker renders it again.
+FRAGMENT_STALE_SECS = 600
+
+# Seconds after which a worker that died while rendering is replaced.
+FRAGMENT_LOCK_SECS = 30
+
+# Search backend, "whoosh" or "postgres" for the database full text search (needs psycopg2).
+SEARCH_BACKEND = "whoosh"
+
+# New search indexes store only the post uid, results are loaded from the database.
+INDEX_COMPACT = False
+
+# Split the search index into shards by post creation "year" or by post "type", empty for a single index.
+INDEX_SHARDS = ''
+
+# Worker threads searching the shards in parallel, zero searches them in turn.
+INDEX_SHARD_WORKERS = 0
+
+# Merge segments when an index has more segments than this.
+INDEX_MAX_SEGMENTS = 8
+
+# Number of segments of similar size that are merged together.
+INDEX_MERGE_FACTOR = 4
+
+# Merge segments when this fraction of their documents is deleted.
+INDEX_MAX_DELETED = 0.2
+
+# Local hours (start, end) in which the indexes are optimized into a single segment.
+INDEX_QUIET_HOURS = (2, 5)
+
+# Seconds between two maintenance checks by the index service.
+INDEX_MAINTAIN_SECS = 600
+
+# Seconds maintenance waits for the lock of an index held by another writer.
+INDEX_LOCK_SECS = 5
+
 # Add another context processor to first template.
 TEMPLATES[0]['OPTIONS']['context_processors'] += [
     'biostar.forum.context.forum'
@@ -101,6 +172,12 @@ LOCATION_FEED_COUNT = 5
 AWARDS_FEED_COUNT = 10
 REPLIES_FEED_COUNT = 15
 
+# Seconds between two renderings of the activity feed by the refresh timer.
+FEED_CACHE_SECS = 60
+
+# Seconds a stale activity feed may be served while one worker renders it again.
+FEED_STALE_SECS = 240
+
 SIMILAR_FEED_COUNT = 30
 
 SESSION_UPDATE_SECONDS = 40
@@ -163,6 +240,18 @@ WSGI_APPLICATION = 'biostar.wsgi.application'
 # Time between two accesses from the same IP to qualify as a different view.
 POST_VIEW_MINUTES = 7
 
+# Seconds views are buffered in the cache before being written to the database.
+POST_VIEW_FLUSH_SECS = 60
+
+# Views buffered per interval, the views past it are dropped.
+POST_VIEW_BUFFER_SIZE = 50000
+
+# Days post views are kept, older views are rolled up into daily views per post.
+POST_VIEW_KEEP_DAYS = 1
+
+# Post views rolled up and deleted in one transaction.
+POST_VIEW_ROLLUP_BATCH = 5000
+
 COUNT_INTERVAL_WEEKS = 10000
 
 # This flag is used flag situation where a data migration is in progress.
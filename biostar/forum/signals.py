@@ -1,15 +1,20 @@
 import logging
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from taggit.models import Tag
 from django.db.models import F, Q
 from biostar.accounts.models import Profile, Message, User
 from biostar.forum.models import Post, Award, Subscription
-from biostar.forum import tasks, auth, util, spam
+from biostar.forum import tasks, auth, util, spam, caching
 
 
 logger = logging.getLogger("biostar")
 
+# Fields of a post shown in the listings, either on the post or on its thread.
+LISTING_FIELDS = ("status", "type", "title", "tag_val", "rank", "spam", "reply_count", "answer_count",
+                  "vote_count", "thread_votecount", "subs_count", "lastedit_date", "lastedit_user_id",
+                  "last_contributor_id")
+
 
 @receiver(post_save, sender=Award)
 def send_award_message(sender, instance, created, **kwargs):
@@ -54,6 +59,33 @@ def ban_user(sender, instance, created, **kwargs):
     # Label all posts by a spammer as 'spam'
     if instance.is_spammer:
         Post.objects.filter(author=instance.user).update(spam=Post.SPAM)
+        caching.bump_version(caching.POST_LIST)
+        caching.bump_version(caching.FEED)
+        caching.expire_threads(*Post.objects.filter(author=instance.user).values_list("root_id", flat=True))
+
+
+@receiver(pre_save, sender=Post)
+def load_listing_fields(sender, instance, **kwargs):
+    # The stored values of the listing fields, compared once the post is saved.
+    query = Post.objects.filter(pk=instance.pk).values_list(*LISTING_FIELDS)
+    instance.listed_values = query.first() if instance.pk else None
+
+
+@receiver(post_save, sender=Post)
+def expire_listings(sender, instance, created, **kwargs):
+    # The cached post listings are stale once a post is created or a field they show changes.
+    stored = getattr(instance, "listed_values", None)
+    if created or stored != tuple(getattr(instance, name) for name in LISTING_FIELDS):
+        caching.bump_version(caching.POST_LIST)
+
+    # The cached thread is stale on any change.
+    caching.expire_threads(instance.root_id or instance.id)
+
+
+@receiver(post_delete, sender=Post)
+def expire_deleted(sender, instance, **kwargs):
+    caching.bump_version(caching.POST_LIST)
+    caching.expire_threads(instance.root_id or instance.id)
 
 
 @receiver(post_save, sender=Post)
@@ -122,8 +154,8 @@ def finalize_post(sender, instance, created, **kwargs):
         # Notify users who are watching tags in this post
         tasks.notify_watched_tags.spool(post=instance, extra_context=extra_context)
 
-        # Give it a spam score.
-        tasks.spam_scoring.spool(post=instance)
+        # Give it a spam score, with a slight delay to give spammers the illusion of success.
+        tasks.spam_scoring.spool(post=instance, delay=1)
 
         mailing_list = User.objects.filter(profile__digest_prefs=Profile.ALL_MESSAGES)
 
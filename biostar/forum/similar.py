@@ -0,0 +1,127 @@
+"""
+Precomputed similar posts.
+
+The neighbours of each thread are found offline with a more like this query
+against the search index and stored in the Similar table. A thread is only
+recomputed when its title, tags or content change.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from whoosh import query
+
+from biostar.forum.models import Post, Similar
+from biostar.forum import search, util
+
+logger = logging.getLogger('engine')
+
+# Neighbours are restricted to top level posts.
+TOPLEVEL = query.Term("is_toplevel", True)
+
+
+def get_digest(title, tags, content):
+    """
+    Fingerprint of the fields that similarity is computed from.
+    """
+    text = "\n".join([title or '', tags or '', content or ''])
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def find_similar(searcher, uid, content, top):
+    """
+    Returns the uids of the top level posts most similar to a post, None when the post is not yet indexed.
+    """
+    docnum = searcher.document_number(uid=uid)
+    if docnum is None:
+        return None
+
+    # Key terms come from the current content in the database, the post itself is masked.
+    hits = searcher.more_like(docnum, "content", text=content, top=top, filter=TOPLEVEL)
+    uids = [hit['uid'] for hit in hits]
+    return uids
+
+
+def find_similar_db(uid, top):
+    """
+    Returns the uids of the top level posts most similar to a post, found by the database full text search.
+    """
+    from biostar.forum import pgsearch
+
+    post = Post.objects.filter(uid=uid).first()
+    uids = [item.uid for item in pgsearch.find_similar(post, top=top)]
+    return uids
+
+
+def update_similar(top=None, chunk=1000, limit=0, force=False):
+    """
+    Recomputes the neighbours of threads that are new or have changed since the last run.
+    Returns the number of threads updated.
+    """
+    top = top or settings.SIMILAR_FEED_COUNT
+    start = time.time()
+    total = updated = 0
+
+    threads = Post.objects.valid_posts(is_toplevel=True).exclude(spam=Post.SPAM)
+
+    with search.open_searcher() as searcher:
+        for ids in util.chunk_ids(threads, size=chunk):
+            rows = Post.objects.filter(id__in=ids).values_list("id", "uid", "title", "tag_val", "content")
+            known = {pk: (sid, digest) for sid, pk, digest in
+                     Similar.objects.filter(post_id__in=ids).values_list("id", "post_id", "digest")}
+
+            create, update = [], []
+            for pk, uid, title, tags, content in rows:
+                total += 1
+                digest = get_digest(title=title, tags=tags, content=content)
+
+                # Skip threads whose neighbours were computed from the same content.
+                sid, last = known.get(pk, (None, None))
+                if not force and last == digest:
+                    continue
+
+                if settings.SEARCH_BACKEND == "postgres":
+                    uids = find_similar_db(uid=uid, top=top)
+                else:
+                    uids = find_similar(searcher=searcher, uid=uid, content=content, top=top)
+
+                # Not in the index yet, picked up on a later run.
+                if uids is None:
+                    continue
+
+                item = Similar(id=sid, post_id=pk, uids=",".join(uids), digest=digest, date=util.now())
+                if sid:
+                    update.append(item)
+                else:
+                    create.append(item)
+
+            Similar.objects.bulk_create(create)
+            Similar.objects.bulk_update(update, ["uids", "digest", "date"])
+
+            updated += len(create) + len(update)
+            if limit and updated >= limit:
+                break
+
+    elapsed = time.time() - start
+    logger.info(f"Similar posts: updated={updated} checked={total} in {elapsed:.1f}s")
+
+    return updated
+
+
+def similar_posts(post):
+    """
+    Returns the precomputed similar posts of a thread, most similar first.
+    """
+    similar = Similar.objects.filter(post=post).first()
+    if not similar:
+        return []
+
+    uids = similar.get_uids()
+    posts = Post.objects.valid_posts(uid__in=uids).exclude(spam=Post.SPAM)
+    posts = posts.select_related("root", "author__profile", "lastedit_user__profile")
+    posts = {p.uid: p for p in posts}
+
+    # Keep the order of similarity.
+    results = [posts[uid] for uid in uids if uid in posts]
+    return results
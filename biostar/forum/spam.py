@@ -1,27 +1,27 @@
 import logging
-import os
-import shutil
 import random
 import time
 from math import log, exp
+from datetime import timedelta
 from itertools import groupby, islice, count, chain
+from collections import defaultdict
 from django.conf import settings
 from django.db.models import Q
+from whoosh import writing
 from whoosh.writing import AsyncWriter, BufferedWriter
 from whoosh import classify
+from whoosh.filedb.filestore import RamStorage
+from whoosh.reading import MultiReader
+from whoosh.searching import Searcher
 from whoosh.analysis import StemmingAnalyzer
 from whoosh.fields import ID, TEXT, KEYWORD, Schema, NUMERIC, BOOLEAN
 from biostar.forum.models import Post
-from biostar.forum import search, auth, util
+from biostar.forum import search, auth, util, classifier, caching
 
 logger = logging.getLogger("engine")
 
 HAM_LIMIT = 5000
 
-dirname = os.path.dirname(settings.SPAM_INDEX_DIR)
-basename = f"train_{os.path.basename(settings.SPAM_INDEX_DIR)}"
-TRAIN_DIR = os.path.join(dirname, basename)
-
 STARTER_UID = 'placeholder'
 
 
@@ -31,7 +31,9 @@ def spam_schema():
                     content=TEXT(stored=True, analyzer=analyzer, sortable=True),
                     content_length=NUMERIC(stored=True, sortable=True),
                     uid=ID(stored=True),
-                    is_spam=BOOLEAN(stored=True))
+                    is_spam=BOOLEAN(stored=True),
+                    added=NUMERIC(stored=True, sortable=True),
+                    priority=NUMERIC(numtype=float, stored=True))
     return schema
 
 
@@ -62,11 +64,18 @@ def bootstrap_index(dirname=None, indexname=None):
 
 
 def index_writer(writer, **kwargs):
-    writer.add_document(title=kwargs.get("title"),
-                        content_length=kwargs.get("content_length"),
-                        content=kwargs.get("content"),
-                        uid=kwargs.get("uid"),
-                        is_spam=kwargs.get("is_spam", False))
+    # The time of addition and a random priority decide which samples are evicted.
+    doc = dict(title=kwargs.get("title"),
+               content_length=kwargs.get("content_length"),
+               content=kwargs.get("content"),
+               uid=kwargs.get("uid"),
+               is_spam=kwargs.get("is_spam", False),
+               added=kwargs.get("added", int(time.time())),
+               priority=kwargs.get("priority", random.random()))
+
+    # Indexes created before a field was added to the schema do not store it.
+    schema = getattr(writer, "schema", None) or writer.index.schema
+    writer.add_document(**search.schema_document(doc, schema=schema))
 
 
 def add_post_to_index(post, writer, is_spam=None):
@@ -84,6 +93,8 @@ def add_spam(post):
 
     ix = init_spam_index()
     writer = AsyncWriter(ix)
+    # A post labelled again replaces its earlier sample.
+    writer.delete_by_term('uid', post.uid)
     add_post_to_index(post=post, writer=writer)
     writer.commit()
     logger.info("Added spam to index.")
@@ -91,13 +102,124 @@ def add_spam(post):
     return
 
 
-def build_spam_index(overwrite=False, add_ham=False, limit=500):
-    # Get all un-indexed spam posts.
+def upgrade_spam_index(ix):
+    """
+    Rebuilds an index created with an older schema, its samples count as the oldest ones.
+    The documents are read and written again under the writer lock, so concurrent writers
+    wait and the generation of the index keeps increasing.
+    """
+    writer = ix.writer(timeout=settings.INDEX_LOCK_SECS)
+    try:
+        docs = [fields for docnum, fields in writer.reader().iter_docs()]
+
+        # The fields missing from the old schema are added to the index.
+        for name, field in spam_schema().items():
+            if name not in writer.schema:
+                writer.add_field(name, field)
+
+        for doc in docs:
+            doc.update(added=0)
+            index_writer(writer=writer, **doc)
+    except Exception:
+        writer.cancel()
+        raise
+
+    # The new segment replaces every old one.
+    writer.commit(mergetype=writing.CLEAR)
+
+    # Searchers opened on the old schema are replaced.
+    search.get_manager(dirname=ix.storage.folder, indexname=ix.indexname).reset()
+
+    logger.info(f"Upgraded the spam index schema, {len(docs)} documents")
+    return ix
+
+
+def evictions(reader, cap, policy):
+    """
+    Returns the documents over the cap of each class.
+    The "newest" policy keeps the most recent samples, "reservoir" a uniform random sample
+    of every post ever added by keeping the highest random priorities.
+    """
+    key = "added" if policy == "newest" else "priority"
+    classes = defaultdict(list)
+    for docnum, fields in reader.iter_docs():
+        if fields.get('uid') == STARTER_UID:
+            continue
+        classes[bool(fields.get('is_spam'))].append((fields.get(key) or 0, docnum))
+
+    evict = []
+    for docs in classes.values():
+        docs.sort(reverse=True)
+        evict.extend(docnum for value, docnum in docs[cap:])
+
+    return evict
+
+
+def compact_spam_index(ix=None, cap=None, policy=None):
+    """
+    Keeps at most cap spam and cap ham samples in the spam index.
+    Returns the number of documents evicted.
+    """
+    ix = ix or init_spam_index()
+    cap = settings.SPAM_INDEX_CAP if cap is None else cap
+    policy = policy or settings.SPAM_INDEX_EVICTION
+
+    if "added" not in ix.schema:
+        ix = upgrade_spam_index(ix)
+
+    # Neither class can be over the cap.
+    if ix.doc_count() <= cap:
+        return 0
+
+    # Document numbers stay valid while the writer holds the lock.
+    writer = ix.writer(timeout=settings.INDEX_LOCK_SECS)
+    evict = evictions(writer.reader(), cap=cap, policy=policy)
+    if not evict:
+        writer.cancel()
+        return 0
+
+    for docnum in evict:
+        writer.delete_document(docnum)
+    writer.commit(optimize=True)
+
+    logger.info(f"Evicted {len(evict)} samples from the spam index, cap={cap} policy={policy}")
+    return len(evict)
 
-    spam = Post.objects.filter(spam=Post.SPAM).exclude(spam=Post.SUSPECT)
+
+def index_report(ix=None):
+    """
+    Prints the class balance and size of the spam index.
+    """
+    from biostar.forum import maintenance
+
+    ix = ix or init_spam_index()
+    counts = defaultdict(int)
+    with ix.reader() as reader:
+        for docnum, fields in reader.iter_docs():
+            if fields.get('uid') != STARTER_UID:
+                counts[bool(fields.get('is_spam'))] += 1
+
+    stats = maintenance.health(ix)
+    print(f"... \t{counts[True]}\tSPAM samples")
+    print(f"... \t{counts[False]}\tHAM samples")
+    print(f"... \t{settings.SPAM_INDEX_CAP}\tCap per class ({settings.SPAM_INDEX_EVICTION})")
+    print(f"... \t{stats['deleted']}\tDeleted documents")
+    print(f"... \t{stats['segments']}\tSegments")
+    print(f"... \t{stats['size'] / 1024 ** 2:0.2f}\tSize (MB)")
+    return counts
+
+
+def training_ids(add_ham=False, limit=500, deleted=False):
+    """
+    Returns the ids of the labelled spam posts and of a random sample of valid posts.
+    Deleted posts are taken as spam when requested.
+    """
+    spam = Post.objects.filter(Q(spam=Post.SPAM) | Q(status=Post.DELETED)) if deleted else \
+        Post.objects.filter(spam=Post.SPAM)
+    spam = spam.exclude(spam=Post.SUSPECT)
     spam = spam.order_by("pk")[:limit]
     spam = list(spam.values_list("id", flat=True))
-    # Set indexed flag here so it does not get added to main index.
+
     if add_ham:
         ham = Post.objects.valid_posts()
         ham = list(ham.values_list("id", flat=True))
@@ -105,6 +227,13 @@ def build_spam_index(overwrite=False, add_ham=False, limit=500):
     else:
         ham = []
 
+    return spam, ham
+
+
+def build_spam_index(overwrite=False, add_ham=False, limit=500):
+    # Get all un-indexed spam posts.
+    spam, ham = training_ids(add_ham=add_ham, limit=limit)
+
     posts = Post.objects.filter(id__in=chain(spam, ham))
 
     # Initialize the spam index
@@ -117,39 +246,62 @@ def build_spam_index(overwrite=False, add_ham=False, limit=500):
     return ix
 
 
-def search_spam(post, ix,):
+def candidate_reader(post, schema):
     """
-    Search spam index for posts similar to this one.
-    Returns
+    Returns a reader over an in memory index that holds only the post.
     """
-    writer = AsyncWriter(ix)
+    # The writer keeps temporary files under the index name, concurrent scorers must not share it.
+    ix = RamStorage().create_index(schema, indexname=f"candidate_{util.get_uuid(8)}")
+    writer = ix.writer()
     add_post_to_index(post=post, writer=writer, is_spam=post.is_spam)
     writer.commit()
+    return ix.reader()
 
-    # Search for this post in the spam index
-    fields = ['uid']
 
-    results = search.preform_whoosh_search(ix=ix, query=post.uid, fields=fields)
+def similar_spam(post, searcher, top=5):
+    """
+    Returns the indexed posts most similar to this one.
+    The post is scored as if it had been added to the index, the index itself is not changed.
+    """
+    candidate = candidate_reader(post=post, schema=searcher.schema)
 
-    # Preform more_like_this on this posts content
-    similar_content = results[0].more_like_this('content', top=5)
+    # The post follows the documents of the index, collection statistics include it.
+    readers = [reader for reader, offset in searcher.reader().leaf_readers() if reader.doc_count_all()]
+    readers.append(candidate)
+    docnum = searcher.doc_count_all()
+    combined = Searcher(MultiReader(readers), closereader=False)
 
-    # Remove this post from the spam index after results are collected.
-    writer = AsyncWriter(ix)
-    writer.delete_by_term('uid', text=post.uid)
-    writer.commit()
+    try:
+        similar_content = combined.more_like(docnum, 'content', top=top, normalize=True)
+        similar_content = list(map(search.normalize_result, similar_content))
+    finally:
+        combined.close()
+        candidate.close()
 
-    # Get the results into a list and close the searcher object.
-    similar_content = list(map(search.normalize_result, similar_content))
+    return similar_content
 
-    results.searcher.close()
 
-    return similar_content
+def search_spam(post, ix=None, searcher=None):
+    """
+    Search spam index for posts similar to this one.
+    Uses a read only searcher, scoring never takes the index lock.
+    """
+    if searcher:
+        return similar_spam(post=post, searcher=searcher)
 
+    if ix:
+        with ix.searcher() as searcher:
+            return similar_spam(post=post, searcher=searcher)
 
-def compute_score(post, ix=None):
+    with search.open_searcher(dirname=settings.SPAM_INDEX_DIR, indexname=settings.SPAM_INDEX_NAME) as searcher:
+        return similar_spam(post=post, searcher=searcher)
 
-    ix = ix or init_spam_index()
+
+def compute_score(post, ix=None, searcher=None):
+
+    # The long lived searcher of the spam index is used unless an index is given.
+    if not (ix or searcher or search.index_exists(dirname=settings.SPAM_INDEX_DIR, indexname=settings.SPAM_INDEX_NAME)):
+        ix = init_spam_index()
     N = 1
     weight = .7
     bias = -0.25
@@ -159,7 +311,7 @@ def compute_score(post, ix=None):
         return 0
 
     # Search for spam similar to this post.
-    similar_content = search_spam(post=post, ix=ix)
+    similar_content = search_spam(post=post, ix=ix, searcher=searcher)
 
     # Gather the scores for each spam that is similar
     scores = [s.score for s in similar_content if s.is_spam]
@@ -182,165 +334,299 @@ def compute_score(post, ix=None):
     return mean
 
 
-def accuracy(tp, tn, fp, fn):
+def post_text(post):
+    return f"{post.title}\n{post.content}"
 
-    return (tp + tn) / (tp + tn + fp + fn)
 
+def is_labelled_spam(post):
+    return post.is_spam or post.is_deleted
 
-def specificity(tn, fp):
-    return tn / (tn + fp)
 
+def train_model(limit=500, fname=None):
+    """
+    Trains the spam classifier on the spam and deleted posts against a sample of valid posts,
+    labelled as cross_validate evaluates them.
+    Processes that loaded an older model pick up the new file on their next score.
+    """
+    spam, ham = training_ids(add_ham=True, limit=limit, deleted=True)
+    posts = Post.objects.filter(id__in=chain(spam, ham)).only("title", "content", "spam", "status")
+    posts = list(posts)
 
-def sensitivity(tp, fn):
+    texts = [post_text(post) for post in posts]
+    labels = [is_labelled_spam(post) for post in posts]
+    model = classifier.train(texts=texts, labels=labels)
+    model.save(fname or settings.SPAM_MODEL_FILE)
 
-    return tp / (tp + fn)
+    logger.info(f"Trained spam model: spam={model.spam} ham={model.ham}")
+    return model
 
 
-def sizer(lst, size):
-    return size if size <= len(lst) else len(lst)
+def model_scores(posts):
+    """
+    Scores a batch of posts with the spam classifier, None when no model was trained.
+    Probabilities are scaled so that the model threshold falls on SPAM_THRESHOLD.
+    """
+    model = classifier.get_model()
+    if model is None:
+        return None
 
+    probs = model.predict([post_text(post) for post in posts])
+    scale = settings.SPAM_THRESHOLD / settings.SPAM_MODEL_THRESHOLD
+    return [float(prob) * scale for prob in probs]
 
-def false_positive_rate(fp, tn):
-    return fp / (fp + tn)
 
+def classify_scores(posts, engine=None, searcher=None):
+    """
+    Returns the spam scores of posts from the engine in SPAM_ENGINE.
+    "index" scores by similarity to the spam index, "model" with the spam classifier
+    and "both" the weighted mean of the two. The index is used while no model is trained.
+    """
+    engine = engine or settings.SPAM_ENGINE
+    weight = settings.SPAM_MODEL_WEIGHT
+    learned = model_scores(posts) if engine in ("model", "both") else None
+
+    scores = []
+    for step, post in enumerate(posts):
+        # Users above a certain score get green light.
+        if not post.author.profile.low_rep:
+            scores.append(0)
+        elif learned is None:
+            scores.append(compute_score(post=post, searcher=searcher))
+        elif engine == "model":
+            scores.append(learned[step])
+        else:
+            indexed = compute_score(post=post, searcher=searcher)
+            scores.append(weight * learned[step] + (1 - weight) * indexed)
 
-def one_out_train(spam, ham, writer, size=100):
+    return scores
 
-    spam = random.sample(spam, k=sizer(spam, size=size))
-    ham = random.sample(ham, k=sizer(ham, size=size))
 
-    # Remove one random item from the list
-    one_out = random.choice([ham[0], spam[0]])
-    ham, spam = ham[1:], spam[1:]
+def classify_score(post, engine=None):
+    return classify_scores([post], engine=engine)[0]
 
-    # Get final queryset and only required fields
-    posts = Post.objects.filter(id__in=chain(spam, ham)).exclude(id=one_out)
-    posts = posts.only("content", "uid", "spam", "status", "title")
 
-    # Write spam and ham posts to train index
-    for post in posts:
-        add_post_to_index(post=post, writer=writer, is_spam=post.is_spam)
+def rescore_candidates(days=30):
+    """
+    Posts in quarantine and the recent posts of low reputation users.
+    Posts labelled by moderators are left alone.
+    """
+    since = util.now() - timedelta(days=days)
+    recent = Q(spam=Post.DEFAULT, creation_date__gte=since, author__profile__score__lte=settings.LOW_REP_THRESHOLD)
+    return Post.objects.filter(Q(spam=Post.SUSPECT) | recent)
 
-    # Return the test post excluded from training.
-    one_out = Post.objects.filter(id=one_out).first()
-    return one_out
 
+def rescore_chunk(ids):
+    """
+    Scores a chunk of posts, runs inside the worker processes of rescore.
+    Returns the id, spam state and new score of each post.
+    """
+    posts = list(Post.objects.filter(id__in=ids).select_related("author__profile"))
 
-def report(nham, nspam, tn, tp, fn, fp):
-    percent = lambda x: f"{x * 100:0.3f} %"
-    acc = percent(accuracy(tp=tp, tn=tn, fp=fp, fn=fn))
-    specif = percent(specificity(tn=tn, fp=fp))
-    sens = percent(sensitivity(tp=tp, fn=fn))
-    fps = percent(false_positive_rate(fp=fp, tn=tn))
+    # Each process reads the spam index through its own searcher.
+    ix = init_spam_index()
+    with ix.searcher() as searcher:
+        scores = classify_scores(posts, searcher=searcher)
 
-    print(f"... \t{nspam}\tSPAM actual")
-    print(f"... \t{tp}\tSPAM predicted\n\t\t---")
-    print(f"... \t{nham}\tHAM actual")
-    print(f"... \t{tn}\tHAM predicted")
-    print("-"*10)
-    print(f"... {acc}\tAccuracy\ttp + tn / (tp + tn + fp + fn) ")
-    print(f"... {specif}\tSpecificity\ttn / (tn + fp)")
-    print(f"... {sens}\tSensitivity\ttp / (tp + fn)")
-    print(f"... {fps}\tFalse positive rate\tfp / (fp + tn)")
-    return
+    return [(post.id, post.uid, post.spam, score) for post, score in zip(posts, scores)]
 
 
-def detail(post, post_score, is_spam=True, predict=True, verb=1):
-    fp = (not is_spam) and predict
-    fn = is_spam and (not predict)
+def rescore(days=30, chunk=500, workers=0, dry=False):
+    """
+    Scores the candidate posts again and moves them in or out of quarantine.
+    A dry run reports the posts that would change state without saving anything.
+    Returns the number of posts scored, quarantined and released.
+    """
+    threshold = settings.SPAM_THRESHOLD
+    posts = rescore_candidates(days=days)
 
-    if verb and not (fn or fp):
-        return
-    print()
-    if fn:
-        print(f"-----\tFALSE NEGATIVE ( missed spam )\tuid={post.uid} score={post_score}. deleted={post.is_deleted}")
+    # Create a missing index once, before the workers open it.
+    init_spam_index()
 
-    elif fp:
-        print(f"-----\tFALSE POSITIVE ( missed ham )\tuid={post.uid} score={post_score}. ")
+    start = time.time()
+    total = quarantined = released = 0
+    changed = []
 
-    if verb > 1 and (fp or fn):
-        print(post.content)
-        print(">"*5)
+    def move(pk, old, new):
+        # The state changes only if nobody labelled the post since it was read.
+        if dry or Post.objects.filter(id=pk, spam=old).update(spam=new):
+            changed.append(pk)
+            return 1
+        return 0
 
-    if verb >= 1 and (fp or fn):
-        print("POSER SCORE", post_score)
+    for rows in util.pool_map(rescore_chunk, util.chunk_ids(posts, size=chunk), workers=workers):
+        for pk, uid, state, score in rows:
+            flagged = score >= threshold
+            if flagged and state == Post.DEFAULT and move(pk, state, Post.SUSPECT):
+                quarantined += 1
+                logger.info(f"Quarantine post={uid} score={score:.3f}")
+            elif not flagged and state == Post.SUSPECT and move(pk, state, Post.DEFAULT):
+                released += 1
+                logger.info(f"Release post={uid} score={score:.3f}")
+
+        # Scores are saved for every post, the spam state only for the posts moved.
+        if not dry:
+            Post.objects.bulk_update([Post(id=pk, spam_score=score) for pk, uid, state, score in rows],
+                                     ["spam_score"])
+
+        total += len(rows)
+        logger.info(f"... {total} posts scored")
+
+    secs = time.time() - start
+    rate = total / secs if secs else 0
+    prefix = "Dry run: " if dry else ""
+    msg = f"{prefix}Rescored {total} posts in {secs:.1f} seconds, {rate:.0f} posts/sec ({workers} workers); " \
+          f"quarantined={quarantined} released={released} threshold={threshold}"
+
+    if dry:
+        logger.info(msg)
+    else:
+        auth.log_action(log_text=msg)
 
-    print()
-    print("-" * 5)
-    return
+    # Bulk updates send no signals, quarantined posts leave the cached listings and threads.
+    if not dry and changed:
+        caching.bump_version(caching.POST_LIST)
+        caching.bump_version(caching.FEED)
+        caching.expire_threads(*Post.objects.filter(id__in=changed).values_list("root_id", flat=True))
 
+    return total, quarantined, released
 
-def test_classify(threshold=None, niter=100, limitmb=1024, size=100, verbosity=0):
 
-    if threshold is None:
-        threshold = settings.SPAM_THRESHOLD
+def divide(num, den):
+    return num / den if den else 0
 
-    # Add posts to test spam index, then
-    spam = Post.objects.filter(Q(spam=Post.SPAM) | Q(status=Post.DELETED))
 
-    # Get the valid posts and shuffle.
-    ham = Post.objects.valid_posts(author__profile__score__lte=0, type__in=[Post.ANSWER, Post.COMMENT])
+def accuracy(tp, tn, fp, fn):
 
-    # Get list of id's for both
-    spam = list(spam.values_list("id", flat=True))
-    ham = list(ham.values_list("id", flat=True))
+    return divide(tp + tn, tp + tn + fp + fn)
 
-    # tp = Identify spam correctly.
-    # tn = Identify valid post correctly.
-    # fn = Missed to identify a spam.
-    # fp = Mis-identified valid post as spam.
-    tp, tn, fn, fp = 0, 0, 0, 0
-    seen_ham, seen_spam = 0, 0
-    elapsed, progress = util.timer_func()
 
-    for i in range(niter):
-        # Remove previous index
-        if os.path.exists(TRAIN_DIR):
-            shutil.rmtree(TRAIN_DIR)
+def specificity(tn, fp):
+    return divide(tn, tn + fp)
 
-        ix = search.init_index(dirname=TRAIN_DIR,
-                               indexname=f"train_{util.get_uuid(8)}_{settings.SPAM_INDEX_NAME}",
-                               schema=spam_schema())
-        writer = BufferedWriter(ix, limit=int((niter/2) + 1), writerargs=dict(limitmb=limitmb, multisegment=True))
 
-        index_writer(writer=writer, title="Placeholder",
-                     content_length=0, is_spam=True,
-                     content='CONTENT', uid=STARTER_UID)
+def sensitivity(tp, fn):
 
-        # Take one spam post out of training set.
-        one_out = one_out_train(spam=spam, writer=writer, size=size, ham=ham)
-        writer.commit()
-        writer.close()
-        post_score = compute_score(post=one_out, ix=ix)
+    return divide(tp, tp + fn)
 
-        predicted_spam = post_score >= threshold
-        is_spam = one_out.is_spam or one_out.is_deleted
-        is_ham = not is_spam
 
-        seen_spam += 1 if is_spam else 0
-        seen_ham += 1 if is_ham else 0
+def precision(tp, fp):
+    return divide(tp, tp + fp)
 
-        detail(is_spam=is_spam, predict=predicted_spam, post=one_out,
-               verb=verbosity, post_score=post_score)
 
-        if predicted_spam:
-            tp += 1 if is_spam else 0
-            fp += 1 if is_ham else 0
+def sizer(lst, size):
+    return size if size <= len(lst) else len(lst)
 
-        else:
-            fn += 1 if is_spam else 0
-            tn += 1 if is_ham else 0
 
-        progress(i, step=5, msg=f"iterations. tp={tp} fp={fp} tn={tn} fn={fn}")
+def false_positive_rate(fp, tn):
+    return divide(fp, fp + tn)
 
-    train_spam = sizer(spam, size)
-    train_ham = sizer(ham, size)
-    print(f"... {train_ham + train_spam}\tSize of index ( per iteration )")
-    print(f"... \t{train_spam}\tSPAM")
-    print(f"... \t{train_ham}\tHAM")
-    print(f"\n... {niter}\tNumber of iterations")
-    report(nham=seen_ham, nspam=seen_spam, tn=tn, tp=tp, fp=fp, fn=fn)
 
+def score_fold(task):
+    """
+    Trains on every fold but one and scores the posts of the held out fold.
+    Runs inside the worker processes of cross_validate. Returns the label and score of each post.
+    """
+    train, test, engine = task
+    posts = Post.objects.filter(id__in=chain(train, test)).select_related("author__profile")
+    posts = {post.id: post for post in posts}
+    train = [posts[pk] for pk in train if pk in posts]
+    test = [posts[pk] for pk in test if pk in posts]
+
+    if engine in ("index", "both"):
+        # The fold index lives in memory under a name of its own.
+        ix = RamStorage().create_index(spam_schema(), indexname=f"fold_{util.get_uuid(8)}")
+        with ix.writer() as writer:
+            index_writer(writer=writer, title="Placeholder", content_length=0, is_spam=True,
+                         content='CONTENT', uid=STARTER_UID)
+            for post in train:
+                add_post_to_index(post=post, writer=writer)
+        with ix.searcher() as searcher:
+            indexed = [compute_score(post=post, searcher=searcher) for post in test]
+
+    if engine in ("model", "both"):
+        model = classifier.train(texts=[post_text(post) for post in train],
+                                 labels=[is_labelled_spam(post) for post in train])
+        scale = settings.SPAM_THRESHOLD / settings.SPAM_MODEL_THRESHOLD
+        probs = model.predict([post_text(post) for post in test])
+        learned = [float(prob) * scale if post.author.profile.low_rep else 0 for post, prob in zip(test, probs)]
+
+    if engine == "index":
+        scores = indexed
+    elif engine == "model":
+        scores = learned
+    else:
+        weight = settings.SPAM_MODEL_WEIGHT
+        scores = [weight * first + (1 - weight) * second for first, second in zip(learned, indexed)]
+
+    return [(is_labelled_spam(post), score) for post, score in zip(test, scores)]
+
+
+def sweep(results, thresholds):
+    """
+    Counts the outcomes at every threshold in one pass over the scores, highest first.
+    """
+    ordered = sorted(results, key=lambda item: item[1], reverse=True)
+    nspam = sum(1 for label, score in results if label)
+    nham = len(results) - nspam
+
+    rows = []
+    tp = fp = step = 0
+    for threshold in sorted(thresholds, reverse=True):
+        while step < len(ordered) and ordered[step][1] >= threshold:
+            tp += 1 if ordered[step][0] else 0
+            fp += 0 if ordered[step][0] else 1
+            step += 1
+        tn, fn = nham - fp, nspam - tp
+        rows.append(dict(threshold=threshold, tp=tp, fp=fp, tn=tn, fn=fn,
+                         precision=precision(tp=tp, fp=fp), recall=sensitivity(tp=tp, fn=fn),
+                         fpr=false_positive_rate(fp=fp, tn=tn), accuracy=accuracy(tp=tp, tn=tn, fp=fp, fn=fn)))
+
+    return rows[::-1]
+
+
+def cross_validate(folds=5, size=1500, engine=None, thresholds=None, workers=0, seed=None):
+    """
+    Estimates the quality of the spam scores with k-fold cross validation.
+    Folds are trained in memory and scored in parallel, every threshold
+    is evaluated from the same scores. Returns one row of outcomes per threshold.
+    """
+    engine = engine or settings.SPAM_ENGINE
+    rng = random.Random(seed)
+
+    # Spam and deleted posts against the valid answers and comments of low reputation users.
+    spam = Post.objects.filter(Q(spam=Post.SPAM) | Q(status=Post.DELETED))
+    ham = Post.objects.valid_posts(author__profile__score__lte=0, type__in=[Post.ANSWER, Post.COMMENT])
+    spam = list(spam.values_list("id", flat=True))
+    ham = list(ham.values_list("id", flat=True))
+
+    ids = rng.sample(spam, k=sizer(spam, size=size)) + rng.sample(ham, k=sizer(ham, size=size))
+    rng.shuffle(ids)
+
+    groups = [ids[k::folds] for k in range(folds)]
+    tasks = [(list(chain(*groups[:k], *groups[k + 1:])), groups[k], engine) for k in range(folds)]
+
+    start = time.time()
+    results = list(chain.from_iterable(util.pool_map(score_fold, tasks, workers=workers)))
+    logger.info(f"Scored {len(results)} posts in {folds} folds in {time.time() - start:.1f} seconds")
+
+    # The current threshold and the deciles of the scores.
+    if not thresholds:
+        scores = sorted(score for label, score in results)
+        thresholds = [settings.SPAM_THRESHOLD]
+        thresholds += [scores[(len(scores) - 1) * step // 10] for step in range(1, 10)] if scores else []
+
+    thresholds = sorted(set(round(value, 3) for value in thresholds))
+    return sweep(results, thresholds=thresholds)
+
+
+def report(rows):
+    percent = lambda x: f"{x * 100:0.1f} %"
+    print(f"{'threshold':>10}{'tp':>7}{'fp':>7}{'tn':>7}{'fn':>7}{'precision':>11}{'recall':>10}"
+          f"{'fp rate':>10}{'accuracy':>10}")
+    for row in rows:
+        print(f"{row['threshold']:>10}{row['tp']:>7}{row['fp']:>7}{row['tn']:>7}{row['fn']:>7}"
+              f"{percent(row['precision']):>11}{percent(row['recall']):>10}{percent(row['fpr']):>10}"
+              f"{percent(row['accuracy']):>10}")
     return
 
 
@@ -358,8 +644,8 @@ def score(post, threshold=None):
     # if not post.author.profile.low_rep:
     #    return
 
-    # Search for spam similar to this post.
-    post_score = compute_score(post=post)
+    # Score the post with the configured engine.
+    post_score = classify_score(post=post)
 
     # Update the spam score.
     Post.objects.filter(id=post.id).update(spam_score=post_score)
@@ -367,4 +653,7 @@ def score(post, threshold=None):
     # If the score exceeds threshold it gets quarantined.
     if post_score >= threshold:
         Post.objects.filter(id=post.id).update(spam=Post.SUSPECT)
+        caching.bump_version(caching.POST_LIST)
+        caching.bump_version(caching.FEED)
+        caching.expire_threads(post.root_id)
         auth.log_action(log_text=f"Quarantined post={post.uid}; spam score={post_score}")
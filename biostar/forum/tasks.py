@@ -1,10 +1,10 @@
 
 from biostar.accounts.tasks import create_messages
 from biostar.emailer.tasks import send_email
-import time
 from biostar.utils.decorators import spool, timer
 
 
+from django.conf import settings
 from django.db.models import Q
 #
 # Do not use logging in tasks! Deadlocking may occur!
@@ -20,13 +20,10 @@ def message(msg, level=0):
 @spool(pass_arguments=True)
 def spam_scoring(post):
     """
-    Score the spam with a slight delay.
+    Score the spam, spooled with a slight delay.
     """
     from biostar.forum import spam
 
-    # Give spammers the illusion of success with a slight delay
-    time.sleep(1)
-
     try:
         # Give this post a spam score and quarantine it if necessary.
         spam.score(post=post)
@@ -99,6 +96,46 @@ def created_post(pid):
     pass
 
 
+@timer(secs=settings.POST_VIEW_FLUSH_SECS)
+def flush_post_views(*args):
+    """
+    Write the buffered post views to the database.
+    """
+    from biostar.forum import counters
+
+    try:
+        counters.flush()
+    except Exception as exc:
+        message(f"Error flushing post views: {exc}")
+
+
+@timer(secs=settings.FEED_CACHE_SECS)
+def refresh_feed(*args):
+    """
+    Render the activity feed shown in the sidebar.
+    """
+    from biostar.forum import activity
+
+    try:
+        activity.refresh()
+    except Exception as exc:
+        message(f"Error rendering the activity feed: {exc}")
+
+
+@timer(secs=3600)
+def rollup_post_views(*args):
+    """
+    Roll up the post views past the retention window, a bounded number of batches per hour.
+    """
+    from biostar.forum import retention
+
+    try:
+        pruned, secs = retention.rollup(limit=20)
+        message(f"Pruned {pruned} post views in {secs:.1f} seconds")
+    except Exception as exc:
+        message(f"Error rolling up post views: {exc}")
+
+
 #
 # This timer leads to problems as described in
 #
@@ -136,7 +173,7 @@ def created_post(pid):
 #
 #     return
 
-@spool(pass_arguments=True)
+@spool(pass_arguments=True, key="awards-{user_id}")
 def create_user_awards(user_id):
 
     from biostar.accounts.models import User
@@ -4,6 +4,7 @@ import logging
 import random
 import re
 import os
+import time
 
 import datetime
 from itertools import count, islice
@@ -23,8 +24,8 @@ from django.core.cache import cache
 
 from biostar.forum import markdown
 from biostar.accounts.models import Profile, Message
-from biostar.forum import const, auth
-from biostar.forum.models import Post, Vote, Award, Subscription
+from biostar.forum import const, auth, activity
+from biostar.forum.models import Post, Award
 
 User = get_user_model()
 
@@ -199,7 +200,7 @@ def post_actions(context, post, label="ADD COMMENT", author=None, lastedit_user=
     request = context["request"]
 
     return dict(post=post, user=request.user, author=author, lastedit_user=lastedit_user,
-                label=label, request=request, avatar=avatar)
+                label=label, request=request, avatar=avatar, overlay=context.get('overlay'))
 
 
 @register.inclusion_tag('widgets/post_tags.html')
@@ -222,6 +223,22 @@ def pages(context, objs, show_step=True):
     return dict(objs=objs, url=url, show_step=show_step, request=request)
 
 
+@register.simple_tag
+def page_url(objs, urlencode=None, previous=False):
+    """
+    Returns the query string of the next or previous page, a cursor link when the page has one.
+    """
+    cursor = getattr(objs, "previous_cursor" if previous else "next_cursor", None)
+    number = objs.previous_page_number() if previous else objs.next_page_number()
+
+    # Drop the parameters of the current page.
+    querystring = urlencode.split('&') if urlencode else []
+    querystring = [p for p in querystring if p.split('=')[0] not in ('page', 'cursor')]
+    querystring.insert(0, f"cursor={cursor}" if cursor else f"page={number}")
+
+    return "?" + "&".join(querystring)
+
+
 @register.simple_tag
 def randparam():
     "Append to URL to bypass server caching of CSS or JS files"
@@ -271,26 +288,63 @@ def digest_label(context, post):
 
 @register.simple_tag(takes_context=True)
 def follow_label(context, post):
+    if context.get('overlay'):
+        return overlay_marker(post.root_id or post.id, "follow_label")
+
     user = context["request"].user
+    return auth.get_follow_label(user=user, post=post)
 
-    not_following = "not following"
 
-    label_map = {
-        Subscription.LOCAL_MESSAGE: "following with messages",
-        Subscription.EMAIL_MESSAGE: "following via email",
-        Subscription.NO_MESSAGES: not_following,
-    }
+def overlay_marker(pk, name):
+    return mark_safe(f"<!--overlay:{name}:{pk}/-->")
 
-    if user.is_anonymous:
-        return not_following
 
-    # Get the current subscription
-    sub = Subscription.objects.filter(post=post.root, user=user).first()
-    sub = sub or Subscription(post=post, user=user, type=Subscription.NO_MESSAGES)
+@register.simple_tag(takes_context=True)
+def overlay_value(context, post, name):
+    """
+    Renders a user dependent attribute of the post, a marker when rendering a cached thread.
+    """
+    if context.get('overlay'):
+        return overlay_marker(post.id, name)
+    return getattr(post, name, "")
 
-    label = label_map.get(sub.type, not_following)
 
-    return label
+class OverlayNode(template.Node):
+
+    def __init__(self, post, name, nodelist):
+        self.post = post
+        self.name = name
+        self.nodelist = nodelist
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        name = self.name.resolve(context)
+        content = self.nodelist.render(context)
+
+        # The cached thread keeps the content between markers, shown or dropped for each user.
+        if context.get('overlay'):
+            return f"<!--overlay:{name}:{post.id}-->{content}<!--/overlay:{name}:{post.id}-->"
+
+        value = getattr(post, name.lstrip("!"), False)
+        show = not value if name.startswith("!") else value
+        return content if show else ""
+
+
+@register.tag
+def overlay(parser, token):
+    """
+    Shows the content when the user dependent flag of the post is set, or unset when prefixed with !
+
+        {% overlay post "is_editable" %} ... {% endoverlay %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"{bits[0]} takes a post and a flag name")
+
+    nodelist = parser.parse(('endoverlay',))
+    parser.delete_first_token()
+
+    return OverlayNode(post=parser.compile_filter(bits[1]), name=parser.compile_filter(bits[2]), nodelist=nodelist)
 
 
 @register.simple_tag
@@ -406,7 +460,7 @@ def form_errors(form, wmd_prefix='', override_content=False):
 def post_body(context, post, user, tree):
     "Renders the post body"
     request = context['request']
-    return dict(post=post, user=user, tree=tree, request=request)
+    return dict(post=post, user=user, tree=tree, request=request, overlay=context.get('overlay'))
 
 
 @register.filter
@@ -483,27 +537,14 @@ def get_post_list(target, request, show=None):
     return posts
 
 
-@register.inclusion_tag('widgets/feed_default.html')
+@register.inclusion_tag('widgets/feed_activity.html')
 def default_feed(user):
+    """
+    Shows the cached activity feed along with its age in seconds.
+    """
+    feed = activity.get_feed()
 
-    recent_votes = Vote.objects.filter(post__status=Post.OPEN,
-                                       post__root__status=Post.OPEN).prefetch_related("post")
-    recent_votes = recent_votes.order_by("-pk")[:settings.VOTE_FEED_COUNT]
-
-    # Get valid users that have a location set in profile.
-    recent_locations = Profile.objects.valid_users().exclude(location="").prefetch_related("user")
-    recent_locations = recent_locations.order_by('-last_login')[:settings.LOCATION_FEED_COUNT]
-
-    # Get valid results
-    recent_awards = Award.objects.valid_awards().select_related("badge", "user", "user__profile")
-    recent_awards = recent_awards.order_by("-pk")[:settings.AWARDS_FEED_COUNT]
-
-    # Get valid posts
-    recent_replies = Post.objects.valid_posts(is_toplevel=False).select_related("author__profile", "author")
-    recent_replies = recent_replies.order_by("-pk")[:settings.REPLIES_FEED_COUNT]
-
-    context = dict(recent_votes=recent_votes, recent_awards=recent_awards, users=[],
-                   recent_locations=recent_locations, recent_replies=recent_replies,
+    context = dict(feed=feed['html'], feed_age=int(time.time() - feed['built']), feed_max_age=activity.max_age(),
                    user=user)
 
     return context
@@ -736,37 +777,53 @@ def boxclass(post=None, uid=None):
 def render_comments(context, tree, post, template_name='widgets/comment_body.html'):
     request = context["request"]
     if post.id in tree:
-        text = traverse_comments(request=request, post=post, tree=tree, template_name=template_name)
+        text = traverse_comments(request=request, post=post, tree=tree, template_name=template_name,
+                                 overlay=context.get('overlay'))
     else:
         text = ''
 
     return mark_safe(text)
 
 
-def traverse_comments(request, post, tree, template_name):
-    "Traverses the tree and generates the page"
+def traverse_comments(request, post, tree, template_name, overlay=False):
+    """
+    Traverses the tree and generates the page.
+    The tree is walked with a stack so deep threads do not reach the recursion limit.
+    """
 
-    body = template.loader.get_template(template_name)
+    body = template.loader.get_template(template_name).template
     seen = set()
 
-    def traverse(node, collect=[]):
-
-        cont = {"post": node, 'user': request.user, 'request': request}
-        html = body.render(cont)
-        collect.append(f'<div class="indent" ><div>{html}</div>')
-
-        for child in tree.get(node.id, []):
-            if child in seen:
-                raise Exception(f"circular tree {child.pk} {child.title}")
-            seen.add(child)
-            traverse(child, collect=collect)
+    # The same context renders every comment, each comment is pushed on top of the shared values.
+    context = template.Context({'user': request.user, 'request': request, 'overlay': overlay},
+                               autoescape=body.engine.autoescape)
 
-        collect.append(f"</div>")
+    # Comments to render, or to close once their replies are rendered.
+    stack = [(node, False) for node in reversed(tree[post.id])]
 
     # this collects the comments for the post
     collect = ['<div class="comment-list">']
-    for node in tree[post.id]:
-        traverse(node, collect=collect)
+
+    # A single render pass, as in a for loop the included templates are loaded and compiled once.
+    with context.render_context.push_state(body), context.bind_template(body):
+        while stack:
+            node, close = stack.pop()
+            if close:
+                collect.append(f"</div>")
+                continue
+
+            with context.push(post=node):
+                html = body.nodelist.render(context)
+            collect.append(f'<div class="indent" ><div>{html}</div>')
+
+            stack.append((node, True))
+            children = tree.get(node.id, [])
+            for child in children:
+                if child in seen:
+                    raise Exception(f"circular tree {child.pk} {child.title}")
+                seen.add(child)
+            stack.extend((child, False) for child in reversed(children))
+
     collect.append("</div>")
     html = '\n'.join(collect)
 
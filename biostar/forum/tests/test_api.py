@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import shutil
@@ -7,6 +8,7 @@ from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.conf import settings
 from biostar.forum import models, api
+from biostar.utils import decorators
 from biostar.utils.helpers import fake_request
 from biostar.accounts.models import User
 
@@ -59,4 +61,17 @@ class PostAPITest(TestCase):
         self.assertEqual(response.status_code, 200)
         #self.process_response(response=response)
 
+    def test_traffic(self):
+        """
+        Test the traffic reports the post views and the counters of the task pool.
+        """
+        models.PostView.objects.create(ip="10.0.0.1", post=self.post)
+        models.PostView.objects.create(ip="10.0.0.1", post=self.post)
+        decorators.get_pool()
 
+        request = fake_request(url=reverse('api_traffic'), data={}, user=self.owner)
+        data = json.loads(api.traffic(request=request).content)
+
+        self.assertEqual(data['post_views_last_60_min'], 1)
+        self.assertEqual(data['task_pool']['workers'], settings.TASK_WORKERS)
+        self.assertIn('depth', data['task_pool'])
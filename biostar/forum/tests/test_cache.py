@@ -0,0 +1,150 @@
+import logging
+from django.core.cache import cache
+from django.urls import reverse
+from django.test import TestCase
+from django.conf import settings
+from biostar.forum import models, views, auth, caching
+from biostar.utils.helpers import fake_request
+from biostar.accounts.models import User
+
+logger = logging.getLogger('engine')
+
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"test", email="tested@tested.com", password="tested")
+        self.staff_user = User.objects.create(username=f"test2", is_superuser=True, is_staff=True,
+                                              email="tested@staff.com", password="tested")
+
+        # Create an existing tested post
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+        self.owner.save()
+
+    def test_listing_cache(self):
+        """
+        Test anonymous listings are cached until a post changes a field they show.
+        """
+        cache.clear()
+        url = reverse('post_list')
+        response = self.client.get(url)
+        self.assertContains(response, "Test")
+        self.assertContains(response, "Page </span> 1 of 1", count=2)
+
+        # Updates send no signal, the cached listing is served.
+        models.Post.objects.filter(pk=self.post.pk).update(title="Renamed")
+        self.assertNotContains(self.client.get(url), "Renamed")
+
+        # Saves that leave the listed fields alone keep the cached listing.
+        self.post.refresh_from_db()
+        self.post.content = "Edited content"
+        self.post.save()
+        self.assertNotContains(self.client.get(url), "Renamed")
+
+        self.post.title = "Retitled"
+        self.post.save()
+        self.assertContains(self.client.get(url), "Retitled")
+
+    def test_activity_feed(self):
+        """
+        Test pages show the cached feed until it is refreshed or moderation marks it stale.
+        """
+        from biostar.forum import activity
+
+        cache.clear()
+        response = self.client.get(reverse('post_list'))
+        self.assertContains(response, f'data-max-age="{activity.max_age()}"')
+
+        reply = models.Post.objects.create(title="Test", author=self.owner, content="Recent reply",
+                                           type=models.Post.ANSWER, parent=self.post)
+        self.assertNotIn("Recent reply", activity.get_feed()['html'])
+
+        activity.refresh()
+        self.assertIn("Recent reply", activity.get_feed()['html'])
+
+        models.Post.objects.filter(pk=reply.pk).update(content="Moderated reply")
+        caching.bump_version(caching.FEED)
+        self.assertIn("Moderated reply", activity.get_feed()['html'])
+
+    def test_thread_cache(self):
+        """
+        Test the cached thread matches a full rendering for each user until the thread changes.
+        """
+        from django.contrib.auth.models import AnonymousUser
+        from django.template import loader
+        from django.test import RequestFactory
+
+        cache.clear()
+        answer = models.Post.objects.create(title="Test", author=self.staff_user, content="Test answer",
+                                            type=models.Post.ANSWER, parent=self.post)
+        models.Post.objects.create(title="Test", author=self.owner, content="Test comment",
+                                   type=models.Post.COMMENT, parent=answer)
+        auth.apply_vote(post=answer, user=self.owner, vote_type=models.Vote.UP)
+
+        root = models.Post.objects.get(pk=self.post.pk)
+        for user in (AnonymousUser(), self.owner, self.staff_user):
+            request = RequestFactory().get(root.get_absolute_url())
+            request.user = user
+
+            post, tree, answers, thread = auth.post_tree(user=user, root=root)
+            context = dict(post=post, tree=tree, answers=answers)
+            expected = loader.render_to_string("widgets/post_thread.html", context=context, request=request)
+
+            self.assertEqual(auth.render_thread(request=request, root=root), expected)
+            self.assertNotIn("<!--overlay", expected)
+            self.assertEqual("edit-button" in expected, user.is_authenticated)
+
+        # Updates send no signals, the cached thread is served until the next vote.
+        models.Post.objects.filter(pk=answer.pk).update(content="Changed", html="Changed")
+        self.assertNotIn("Changed", auth.render_thread(request=request, root=root))
+
+        auth.apply_vote(post=answer, user=self.owner, vote_type=models.Vote.UP)
+        self.assertIn("Changed", auth.render_thread(request=request, root=root))
+
+    def test_fragment_stale(self):
+        """
+        Test a stale fragment is served while another worker rebuilds it.
+        """
+        cache.clear()
+        builds = []
+
+        def build():
+            builds.append(1)
+            return f"fragment {len(builds)}"
+
+        key = caching.fragment_key("test", "page")
+        self.assertEqual(caching.get_or_build(key, build=build, group="test"), "fragment 1")
+        self.assertEqual(caching.get_or_build(key, build=build, group="test"), "fragment 1")
+
+        caching.bump_version("test")
+        cache.add(f"{key}-LOCK", 1)
+        self.assertEqual(caching.get_or_build(key, build=build, group="test"), "fragment 1")
+
+        cache.delete(f"{key}-LOCK")
+        self.assertEqual(caching.get_or_build(key, build=build, group="test"), "fragment 2")
+        self.assertEqual(len(builds), 2)
+
+    def test_listing_key(self):
+        """
+        Test anonymous listings are cached by the page they show, not the raw parameters.
+        """
+        from django.contrib.auth.models import AnonymousUser
+
+        request = fake_request(url=reverse('post_list'), data={}, user=self.owner)
+        request.user = AnonymousUser()
+
+        def key(page=1, cursor=None):
+            return views.listing_key(request, topic="", tag="", order="", limit="", page=page, cursor=cursor)
+
+        # Invalid cursors and page numbers show the first page.
+        self.assertEqual(key(cursor="invalid"), key())
+        self.assertEqual(key(page="x"), key())
+        self.assertEqual(key(page=5000), key(page=settings.NUMBERED_PAGES))
+
+        # A cursor is keyed on what it decodes to.
+        paginator = views.CursorPaginator(object_list=models.Post.objects.all(), per_page=3, ordering=["-rank"])
+        cursor = paginator.encode(12, backward=False, row=self.post)
+        self.assertEqual(key(page=3, cursor=cursor), key(page=1, cursor=cursor + "=="))
+        self.assertNotEqual(key(cursor=cursor), key())
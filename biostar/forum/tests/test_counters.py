@@ -0,0 +1,99 @@
+import logging
+import time
+from datetime import datetime, timezone
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.conf import settings
+from biostar.forum import models, auth, counters
+from biostar.utils.helpers import fake_request
+from biostar.accounts.models import User
+
+logger = logging.getLogger('engine')
+
+
+class ViewCounterTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"test", email="tested@tested.com", password="tested")
+        self.staff_user = User.objects.create(username=f"test2", is_superuser=True, is_staff=True,
+                                              email="tested@staff.com", password="tested")
+
+        # Create an existing tested post
+        self.post = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                               type=models.Post.QUESTION)
+        self.owner.save()
+
+    @override_settings(POST_VIEW_BUFFER_SIZE=3)
+    def test_view_counter(self):
+        """
+        Test views are counted once per address and written in bulk once their interval is over.
+        """
+        cache.clear()
+        now = time.time()
+        other = models.Post.objects.create(title="Test", author=self.owner, content="Test",
+                                           type=models.Post.QUESTION)
+
+        self.assertTrue(counters.record(ip="10.0.0.1", post_id=self.post.pk, now=now))
+        self.assertFalse(counters.record(ip="10.0.0.1", post_id=self.post.pk, now=now))
+        self.assertTrue(counters.record(ip="10.0.0.2", post_id=self.post.pk, now=now))
+        self.assertTrue(counters.record(ip="10.0.0.2", post_id=other.pk, now=now))
+
+        # The buffer of the interval is full.
+        self.assertFalse(counters.record(ip="10.0.0.3", post_id=other.pk, now=now))
+
+        # Nothing is written while the interval lasts.
+        self.assertEqual(models.PostView.objects.count(), 0)
+
+        # A failed insert leaves the counts alone and the views buffered.
+        later = now + settings.POST_VIEW_FLUSH_SECS + counters.GRACE
+        with mock.patch.object(models.PostView.objects, "bulk_create", side_effect=ValueError("fail")):
+            self.assertRaises(ValueError, counters.flush, now=later)
+        self.assertEqual(models.Post.objects.get(pk=self.post.pk).view_count, 0)
+
+        self.assertEqual(counters.flush(now=later), 3)
+        self.assertEqual(counters.flush(now=later), 0)
+
+        views = dict(models.Post.objects.filter(pk__in=[self.post.pk, other.pk]).values_list("pk", "view_count"))
+        self.assertEqual(views, {self.post.pk: 2, other.pk: 1})
+
+        # The rows keep the time of the view, not the time of the flush.
+        dates = set(models.PostView.objects.values_list("date", flat=True))
+        self.assertEqual(dates, {datetime.fromtimestamp(now, tz=timezone.utc)})
+        self.assertEqual(models.PostView.objects.count(), 3)
+
+        stats = counters.stats()
+        self.assertEqual((stats['views'], stats['posts'], stats['dropped']), (3, 2, 1))
+
+        # Requests flush the views only when the flush timer is not running.
+        request = fake_request(url="/", data={}, user=self.owner)
+        with mock.patch.object(counters, "flush") as flush, \
+                mock.patch.object(counters, "pending", return_value=range(1)):
+            auth.update_post_views(post=self.post, request=request)
+            with override_settings(TASK_BACKEND="db"):
+                auth.update_post_views(post=self.post, request=request)
+        self.assertEqual(flush.call_count, 1)
+
+    def test_view_rollup(self):
+        """
+        Test old post views are rolled up into daily views in batches and deleted.
+        """
+        from datetime import timedelta
+        from biostar.forum import retention, util
+
+        old = util.now() - timedelta(days=3)
+        for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            models.PostView.objects.create(ip=ip, post=self.post, date=old)
+        models.PostView.objects.create(ip="10.0.0.4", post=self.post)
+
+        pruned, secs = retention.rollup(days=1, batch=2)
+        self.assertEqual(pruned, 3)
+        self.assertEqual(models.PostView.objects.count(), 1)
+
+        # Views rolled up later add to the same day.
+        models.PostView.objects.create(ip="10.0.0.5", post=self.post, date=old)
+        retention.rollup(days=1)
+
+        daily = models.PostViewDaily.objects.get(post=self.post)
+        self.assertEqual(daily.views, 4)
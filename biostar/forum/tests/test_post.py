@@ -5,7 +5,7 @@ from django.core import management
 from django.urls import reverse
 from django.test import TestCase, override_settings
 from django.conf import settings
-from biostar.forum import models, views, search, tasks
+from biostar.forum import models, views, search, tasks, benchmark
 from biostar.utils.helpers import fake_request
 from biostar.accounts.models import User
 
@@ -33,6 +33,99 @@ class PostTest(TestCase):
         self.owner.save()
         pass
 
+    def test_comment_render(self):
+        """
+        Test comment trees render as with one template per comment, deep trees included.
+        """
+        from django.contrib.auth.models import AnonymousUser
+        from django.template import loader
+        from django.test import RequestFactory
+        from biostar.forum.templatetags.forum_tags import traverse_comments
+
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        name = "widgets/comment_body.html"
+
+        def reference(node):
+            html = loader.get_template(name).render({"post": node, 'user': request.user, 'request': request,
+                                                     'overlay': False})
+            children = ''.join(reference(child) for child in tree.get(node.id, []))
+            return f'<div class="indent" ><div>{html}</div>' + (f'\n{children}' if children else '') + '\n</div>'
+
+        root, tree = benchmark.comment_tree(shape="wide", size=3, author=self.owner)
+        tree[2] = [tree[root.id].pop()]
+        expected = '<div class="comment-list">\n' + '\n'.join(reference(node) for node in tree[root.id]) + '\n</div>'
+        self.assertEqual(traverse_comments(request=request, post=root, tree=tree, template_name=name), expected)
+
+        # Deeper than the recursion limit.
+        root, tree = benchmark.comment_tree(shape="deep", size=1200, author=self.owner)
+        html = traverse_comments(request=request, post=root, tree=tree, template_name=name)
+        self.assertEqual(html.count('class="indent"'), 1200)
+
+    def test_cursor_pagination(self):
+        """
+        Test cursor pages seek through the listing in both directions.
+        """
+        for step in range(11):
+            models.Post.objects.create(title=f"Test {step}", author=self.owner, content="Test",
+                                       type=models.Post.QUESTION, rank=step % 3)
+
+        query = models.Post.objects.filter(is_toplevel=True)
+        expected = list(query.order_by("-rank", "-pk").values_list("uid", flat=True))
+        paginator = views.CursorPaginator(object_list=query, per_page=3, ordering=["-rank"], pages=2)
+
+        # Deep page numbers stop at the numbered pages.
+        self.assertEqual(paginator.get_page(50).number, 2)
+
+        page, pages = paginator.get_page(1), []
+        while True:
+            pages.append(page)
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_page_number(), cursor=page.next_cursor)
+
+        self.assertEqual([post.uid for page in pages for post in page], expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4])
+        self.assertEqual([bool(page.next_cursor) for page in pages], [False, True, True, False])
+
+        page = paginator.get_page(3, cursor=pages[-1].previous_cursor)
+        self.assertEqual([post.uid for post in page], expected[6:9])
+        self.assertIsNone(page.previous_cursor)
+
+        # Tampered cursors return the first page.
+        self.assertEqual(paginator.get_page(1, cursor="invalid").number, 1)
+
+        with override_settings(POSTS_PER_PAGE=3, NUMBERED_PAGES=1):
+            response = self.client.get(reverse('post_list'), dict(cursor=pages[1].next_cursor))
+        self.assertContains(response, "cursor=")
+
+        # Users that never logged in are ordered last and reached by cursor.
+        from biostar.accounts.models import Profile
+
+        for step in range(6):
+            User.objects.create(username=f"visitor-{step}", email=f"visitor-{step}@example.org")
+        emails = [f"visitor-{step}@example.org" for step in (1, 2, 4)]
+        self.assertEqual(Profile.objects.filter(user__email__in=emails).update(last_login=None), 3)
+
+        query = User.objects.all()
+        logins = list(query.values_list("pk", "profile__last_login"))
+        expected = [pk for pk, login in sorted(logins, key=lambda item: (item[1] is not None, item[1] or 0, item[0]),
+                                                reverse=True)]
+        paginator = views.CursorPaginator(object_list=query, per_page=2, ordering=["-profile__last_login"], pages=1)
+
+        page, pages = paginator.get_page(1), []
+        while True:
+            pages.append(page)
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_page_number(), cursor=page.next_cursor)
+        self.assertEqual([user.pk for page in pages for user in page], expected)
+
+        # Back through the users without a login.
+        last = len(pages[-1])
+        page = paginator.get_page(1, cursor=pages[-1].previous_cursor)
+        self.assertEqual([user.pk for user in page], expected[-last - 2:-last])
+
     @override_settings(SEND_MAIL=True)
     def test_post_create(self):
         """Test post creation with POST request"""
@@ -139,6 +232,9 @@ class PostSearchTest(TestCase):
         if os.path.exists(TEST_INDEX_DIR):
             shutil.rmtree(TEST_INDEX_DIR)
 
+        # Drop searchers left open on the removed index.
+        search.MANAGERS.clear()
+
         # Create some posts to index.
         self.limit = 10
         for p in range(self.limit):
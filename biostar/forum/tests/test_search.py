@@ -0,0 +1,307 @@
+import logging
+import os
+import shutil
+import threading
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.conf import settings
+from biostar.forum import models, search, indexer, similar, benchmark, maintenance
+from biostar.accounts.models import User
+
+logger = logging.getLogger('engine')
+
+TEST_DATABASE_NAME = f"test_{settings.DATABASE_NAME}"
+
+TEST_ROOT = os.path.abspath(os.path.join(settings.BASE_DIR, 'export', 'test'))
+TEST_INDEX_DIR = TEST_ROOT
+TEST_INDEX_NAME = "index"
+
+
+@override_settings(INDEX_DIR=TEST_INDEX_DIR, INDEX_NAME=TEST_INDEX_NAME, DATABASE_NAME=TEST_DATABASE_NAME)
+class SearchTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"test", email="tested@tested.com", password="tested")
+
+        # Delete test search index on each start up.
+        if os.path.exists(TEST_INDEX_DIR):
+            shutil.rmtree(TEST_INDEX_DIR)
+
+        # Drop searchers left open on the removed index.
+        search.MANAGERS.clear()
+
+        # Create some posts to index.
+        self.limit = 10
+        for p in range(self.limit):
+            self.post = models.Post.objects.create(title=f"Test post-{p} ", author=self.owner,
+                                                   content=f"Test post-{p} ",
+                                                   type=models.Post.QUESTION)
+        self.owner.save()
+
+        # Crawl through posts and create test index.
+        search.crawl(reindex=True, overwrite=True, limit=1000)
+
+    def test_page_key(self):
+        """
+        Test search cache keys ignore extra whitespace but keep the case of the query operators.
+        """
+        def key(query):
+            return search.page_key(query=query, page=1, sortedby=[], reverse=True, generation=1)
+
+        self.assertEqual(key("align  AND reads "), key("align AND reads"))
+        self.assertNotEqual(key("align AND reads"), key("align and reads"))
+
+    def test_postgres_helpers(self):
+        """
+        Test the query helpers of the postgres backend and the dispatch to it, without PostgreSQL.
+        """
+        from biostar.forum import pgsearch
+
+        self.assertEqual(pgsearch.raw_query("Align the READS", fields=["title", "content"]), "align:AC | reads:AC")
+        self.assertIsNone(pgsearch.raw_query("the", fields=["title"]))
+        self.assertIsNone(pgsearch.raw_query("reads", fields=["uid"]))
+        self.assertEqual(pgsearch.key_terms("reads reads align 2020 of bam bam bam"), ["bam", "reads", "align"])
+
+        with override_settings(SEARCH_BACKEND="postgres"):
+            with mock.patch.object(pgsearch, "preform_search", return_value=["hit"]) as call:
+                self.assertEqual(search.preform_search(query="reads", top=3), ["hit"])
+            call.assert_called_once_with(query="reads", fields=None, top=3, sortedby=[], more_like_this=False)
+
+            with mock.patch.object(pgsearch, "search_posts", return_value="page") as call:
+                self.assertEqual(search.search_page("reads", page=2), "page")
+            call.assert_called_once_with("reads", page=2, per_page=None, sortedby=[], reverse=True)
+
+        # The whoosh backend does not reach the database search.
+        with mock.patch.object(pgsearch, "preform_search") as call:
+            search.preform_search(query="reads")
+        call.assert_not_called()
+
+    def test_index_service(self):
+        """
+        Test the indexing service picks up edited posts.
+        """
+        models.Post.objects.filter(uid=self.post.uid).update(title="Indexing service", indexed=False)
+
+        service = indexer.IndexService(interval=1)
+        service.collect()
+        service.commit()
+
+        results = search.preform_search(query="service", fields=['title'])
+        self.assertTrue(len(results), "Edited post not found in the index.")
+        self.assertFalse(models.Post.objects.filter(uid=self.post.uid, indexed=False).exists())
+
+    def test_bulk_index(self):
+        """
+        Test the chunked reindex of all posts.
+        """
+        total, rate = search.bulk_index(overwrite=True, chunk=3)
+        self.assertEqual(total, self.limit, "Bulk reindex missed posts.")
+
+        results = search.preform_search(query="Test", fields=['title'])
+        self.assertTrue(len(results), "Bulk reindex produced an empty index.")
+
+        # Documents built by worker processes.
+        total, rate = search.bulk_index(overwrite=True, chunk=3, workers=2)
+        self.assertEqual(total, self.limit, "Bulk reindex with workers missed posts.")
+        self.assertEqual(len(search.preform_search(query="Test", fields=['title'])), len(results))
+
+    def test_pool_map(self):
+        """
+        Test the stream is read on the calling thread and mapped by the workers in order.
+        """
+        from biostar.forum import util
+
+        readers = []
+
+        def stream():
+            for step in range(5):
+                readers.append(threading.current_thread())
+                yield [step, step]
+
+        self.assertEqual(list(util.pool_map(sum, stream(), workers=2)), [0, 2, 4, 6, 8])
+        self.assertEqual(set(readers), {threading.current_thread()})
+
+    def test_searcher_refresh(self):
+        """
+        Test the long lived searcher is reused until the index changes.
+        """
+        manager = search.get_manager()
+
+        first = manager.acquire()
+        first.close()
+        self.assertIs(manager.acquire(), first, "Searcher not reused.")
+
+        # Commit a change while the searcher is still held.
+        models.Post.objects.filter(uid=self.post.uid).update(title="Refreshed", indexed=False)
+        service = indexer.IndexService()
+        service.collect()
+        service.commit()
+
+        second = manager.acquire()
+        self.assertIsNot(second, first, "Searcher not refreshed after commit.")
+        self.assertFalse(first.is_closed, "Searcher closed while in use.")
+
+        first.close()
+        second.close()
+        self.assertTrue(first.is_closed, "Replaced searcher was not released.")
+        self.assertFalse(second.is_closed)
+
+    def test_search_cache(self):
+        """
+        Test result pages are cached until the index changes.
+        """
+        search.bulk_index(overwrite=True)
+
+        start = search.cache_stats()
+        first = search.search_page(query="Test", page=1, sortedby=["lastedit_date"])
+        second = search.search_page(query="  Test ", page=1, sortedby=["lastedit_date"])
+        stats = search.cache_stats()
+
+        self.assertEqual(stats['hits'] - start['hits'], 1, "Repeated query was not cached.")
+        self.assertEqual([r.uid for r in first], [r.uid for r in second])
+        self.assertEqual(second.total, self.limit)
+
+        # A commit changes the generation and invalidates the page.
+        search.bulk_index()
+        search.search_page(query="Test", page=1, sortedby=["lastedit_date"])
+        self.assertEqual(search.cache_stats()['misses'] - stats['misses'], 1, "Stale page served after commit.")
+
+    def test_similar_posts(self):
+        """
+        Test similar posts are precomputed and only refreshed when the content changes.
+        """
+        search.bulk_index(overwrite=True)
+
+        count = similar.update_similar(top=5)
+        self.assertEqual(count, self.limit, "Similar posts not computed for every thread.")
+
+        results = similar.similar_posts(self.post)
+        uids = [p.uid for p in results]
+        self.assertTrue(uids, "No similar posts found.")
+        self.assertNotIn(self.post.uid, uids, "Post listed as similar to itself.")
+
+        # Unchanged threads are skipped.
+        self.assertEqual(similar.update_similar(top=5), 0)
+
+        models.Post.objects.filter(uid=self.post.uid).update(content="Changed content")
+        self.assertEqual(similar.update_similar(top=5), 1, "Changed thread was not recomputed.")
+
+    def test_compact_schema(self):
+        """
+        Test results of a compact index are loaded from the database.
+        """
+        shutil.rmtree(TEST_INDEX_DIR)
+        search.MANAGERS.clear()
+
+        ix = search.init_index(schema=search.get_schema(compact=True))
+        search.bulk_index(ix=ix, overwrite=True)
+        self.assertTrue(search.is_compact(ix.schema))
+
+        results = search.search_page(query="Test", page=1, sortedby=["lastedit_date"])
+        self.assertEqual(results.total, self.limit)
+        self.assertTrue(all(r.title.startswith("Test post") for r in results), "Results not hydrated.")
+
+        results = search.preform_search(query=self.post.uid, fields=['uid'], more_like_this=True)
+        self.assertTrue(results, "More like this found nothing without stored content.")
+        self.assertNotIn(self.post.uid, [r.uid for r in results])
+
+    @override_settings(INDEX_SHARDS="year")
+    def test_sharded_index(self):
+        """
+        Test writes are routed to year shards and searches merge across them.
+        """
+        shutil.rmtree(TEST_INDEX_DIR)
+        search.MANAGERS.clear()
+
+        # Spread the posts over three years.
+        posts = models.Post.objects.order_by("pk")
+        for step, post in enumerate(posts):
+            date = post.creation_date.replace(year=2018 + step % 3)
+            models.Post.objects.filter(pk=post.pk).update(creation_date=date)
+
+        ix = search.init_index()
+        self.assertIsInstance(ix, search.ShardedIndex)
+        search.bulk_index(ix=ix, overwrite=True)
+        self.assertEqual(ix.keys(), ["2020", "2019", "2018"])
+        self.assertEqual(ix.doc_count(), self.limit)
+
+        results = search.search_page(query="Test", page=1, sortedby=["creation_date"])
+        self.assertEqual(results.total, self.limit)
+        dates = [r.creation_date for r in results]
+        self.assertEqual(dates, sorted(dates, reverse=True), "Shard results not merged in order.")
+
+        # The newest shards fill a small page, the older ones are skipped.
+        results = search.search_page(query="Test", page=1, sortedby=["creation_date"], per_page=2)
+        self.assertFalse(results.exact, "Search did not stop at the newest shard.")
+        self.assertEqual(len(results), 2)
+
+        # Edits are written to the owning shard.
+        models.Post.objects.filter(uid=self.post.uid).update(title="Sharded", indexed=False)
+        service = indexer.IndexService()
+        service.collect()
+        service.commit()
+        self.assertEqual(ix.doc_count(), self.limit)
+
+        results = search.preform_search(query="Sharded", fields=['title'])
+        self.assertEqual([r.uid for r in results], [self.post.uid])
+
+        # Only the shard that received the edit needs merging again.
+        year = str(models.Post.objects.get(pk=self.post.pk).creation_date.year)
+        self.assertEqual(ix.optimize_frozen(), [year])
+        self.assertEqual(ix.optimize_frozen(), [])
+
+    def test_benchmark(self):
+        """
+        Test the benchmark runs on a small corpus in a separate database and removes it.
+        """
+        from django.core.exceptions import ImproperlyConfigured
+
+        # The database of a site is refused.
+        with self.assertRaises(ImproperlyConfigured):
+            benchmark.run(threads=5)
+        self.assertFalse(benchmark.bench_posts().exists())
+
+        models.Post.objects.all().delete()
+        user = User.objects.create(username="bench-site", email="bench@site.org")
+
+        result = benchmark.run(threads=5, answers=1, comments=1, users=2, queries=2, rounds=1, batch=2, keep=True)
+
+        self.assertEqual(result['reindex']['docs'], result['corpus']['posts'])
+        self.assertEqual(result['queries']['common']['page']['count'], 2)
+
+        # The indexing service of a site never picks up the corpus.
+        self.assertEqual(indexer.pending_posts(limit=10), [])
+
+        benchmark.remove_corpus()
+        self.assertFalse(benchmark.bench_posts().exists(), "Benchmark corpus was not removed.")
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    @override_settings(INDEX_MERGE_FACTOR=2, INDEX_MAX_SEGMENTS=2)
+    def test_index_maintenance(self):
+        """
+        Test segments left by small commits are merged and optimized.
+        """
+        ix = search.init_index()
+        search.bulk_index(ix=ix, overwrite=True)
+
+        # Each batch of edits leaves a small segment.
+        service = indexer.IndexService(ix=ix)
+        for post in models.Post.objects.all()[:4]:
+            models.Post.objects.filter(pk=post.pk).update(indexed=False)
+            service.collect()
+            service.commit()
+
+        stats = maintenance.health(ix)
+        self.assertGreater(stats['segments'], 2)
+        self.assertEqual(maintenance.plan(stats), maintenance.MERGE)
+        self.assertEqual(maintenance.plan(stats, quiet=True), maintenance.OPTIMIZE)
+
+        maintenance.apply(ix, maintenance.MERGE)
+        self.assertLess(maintenance.health(ix)['segments'], stats['segments'], "Tiered merge left all segments.")
+
+        maintenance.apply(ix, maintenance.OPTIMIZE)
+        stats = maintenance.health(ix)
+        self.assertEqual((stats['segments'], stats['deleted'], stats['docs']), (1, 0, self.limit))
+        self.assertIsNotNone(stats['last_optimized'])
+        self.assertIsNone(maintenance.plan(stats, quiet=True))
@@ -0,0 +1,206 @@
+import logging
+import os
+import shutil
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.conf import settings
+from biostar.forum import models, search, spam, classifier
+from biostar.accounts.models import User
+
+logger = logging.getLogger('engine')
+
+TEST_DATABASE_NAME = f"test_{settings.DATABASE_NAME}"
+
+TEST_ROOT = os.path.abspath(os.path.join(settings.BASE_DIR, 'export', 'test'))
+TEST_INDEX_DIR = TEST_ROOT
+TEST_INDEX_NAME = "index"
+
+
+@override_settings(INDEX_DIR=TEST_INDEX_DIR, INDEX_NAME=TEST_INDEX_NAME, DATABASE_NAME=TEST_DATABASE_NAME)
+class SpamTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.owner = User.objects.create(username=f"test", email="tested@tested.com", password="tested")
+
+        # Delete test search index on each start up.
+        if os.path.exists(TEST_INDEX_DIR):
+            shutil.rmtree(TEST_INDEX_DIR)
+
+        # Drop searchers left open on the removed index.
+        search.MANAGERS.clear()
+
+        # Create some posts to index.
+        self.limit = 10
+        for p in range(self.limit):
+            self.post = models.Post.objects.create(title=f"Test post-{p} ", author=self.owner,
+                                                   content=f"Test post-{p} ",
+                                                   type=models.Post.QUESTION)
+        self.owner.save()
+
+        # Crawl through posts and create test index.
+        search.crawl(reindex=True, overwrite=True, limit=1000)
+
+    def test_spam_scoring(self):
+        """
+        Test spam scoring leaves the spam index untouched and matches scoring through the index.
+        """
+        dirname = os.path.join(TEST_ROOT, "spam")
+        ix = spam.bootstrap_index(dirname=dirname, indexname=TEST_INDEX_NAME)
+        words = ["cheap", "pills", "online", "casino", "bonus", "free", "offer"]
+        with ix.writer() as writer:
+            for step in range(len(words)):
+                text = " ".join(words[step:] + words[:step])
+                post = models.Post(title=text, content=text, uid=f"spam-{step}", spam=models.Post.SPAM)
+                spam.add_post_to_index(post=post, writer=writer)
+
+        post = models.Post.objects.create(title="Free pills", content="cheap pills and casino bonus offer",
+                                          author=self.owner, type=models.Post.QUESTION)
+        generation = ix.latest_generation()
+        scores = [(item.uid, item.score) for item in spam.search_spam(post=post, ix=ix)]
+        self.assertEqual(ix.latest_generation(), generation, "Scoring changed the spam index.")
+
+        # Score the same post by adding it to the index.
+        with ix.writer() as writer:
+            spam.add_post_to_index(post=post, writer=writer)
+        with ix.searcher() as searcher:
+            docnum = searcher.document_number(uid=post.uid)
+            hits = searcher.more_like(docnum, 'content', top=5, normalize=True)
+            expected = [(item['uid'], item.score) for item in hits]
+
+        self.assertTrue(scores)
+        self.assertEqual([uid for uid, score in scores], [uid for uid, score in expected])
+        for (uid, score), (other, value) in zip(scores, expected):
+            self.assertAlmostEqual(score, value)
+
+    def test_spam_model(self):
+        """
+        Test the spam classifier separates spam, scores in batches and reloads when retrained.
+        """
+        fname = os.path.join(TEST_ROOT, "spam_model.npz")
+        for step in range(self.limit):
+            models.Post.objects.create(title=f"Cheap pills {step}", content="buy cheap pills online casino bonus",
+                                       author=self.owner, type=models.Post.QUESTION, spam=models.Post.SPAM)
+
+        # Deleted posts are learned as spam, as cross validation labels them.
+        models.Post.objects.filter(title="Cheap pills 0").update(spam=models.Post.NOT_SPAM,
+                                                                 status=models.Post.DELETED)
+
+        with override_settings(SPAM_MODEL_FILE=fname, SPAM_ENGINE="model"):
+            model = spam.train_model(limit=self.limit)
+            self.assertEqual((model.spam, model.ham), (self.limit, self.limit))
+
+            ham = models.Post(title="Test post", content="Test post alignment")
+            bad = models.Post(title="Cheap pills", content="casino bonus online")
+            ham_score, bad_score = spam.model_scores([ham, bad])
+            self.assertLess(ham_score, settings.SPAM_THRESHOLD)
+            self.assertGreaterEqual(bad_score, settings.SPAM_THRESHOLD)
+
+            # The loaded model is kept until the file is replaced.
+            loaded = classifier.get_model()
+            self.assertIs(classifier.get_model(), loaded)
+            spam.train_model(limit=self.limit)
+            self.assertIsNot(classifier.get_model(), loaded)
+
+    def test_spam_compaction(self):
+        """
+        Test compaction keeps the newest samples of each class within the cap.
+        """
+        dirname = os.path.join(TEST_ROOT, "spam")
+        ix = spam.bootstrap_index(dirname=dirname, indexname=TEST_INDEX_NAME)
+        with ix.writer() as writer:
+            for step in range(6):
+                spam.index_writer(writer=writer, title="Cheap pills", content="buy cheap pills", content_length=15,
+                                  uid=f"spam-{step}", is_spam=True, added=step)
+                spam.index_writer(writer=writer, title="Align reads", content="align the reads", content_length=15,
+                                  uid=f"ham-{step}", is_spam=False, added=step)
+
+        self.assertEqual(spam.compact_spam_index(ix, cap=4, policy="newest"), 4)
+        self.assertEqual(spam.compact_spam_index(ix, cap=4, policy="newest"), 0)
+
+        with ix.searcher() as searcher:
+            uids = sorted(fields['uid'] for fields in searcher.all_stored_fields())
+        expected = sorted([spam.STARTER_UID] + [f"{label}-{step}" for label in ("spam", "ham") for step in range(2, 6)])
+        self.assertEqual(uids, expected)
+
+        # Reservoir sampling keeps the cap whatever the priorities.
+        self.assertEqual(spam.compact_spam_index(ix, cap=1, policy="reservoir"), 6)
+        self.assertEqual(ix.doc_count(), 3)
+
+    def test_spam_upgrade(self):
+        """
+        Test an index with the old schema is rebuilt in place and its searchers are replaced.
+        """
+        from whoosh.index import create_in
+
+        dirname = os.path.join(TEST_ROOT, "spam_old")
+        os.makedirs(dirname, exist_ok=True)
+        schema = spam.spam_schema()
+        schema.remove("added")
+        schema.remove("priority")
+        ix = create_in(dirname, schema=schema, indexname=TEST_INDEX_NAME)
+        with ix.writer() as writer:
+            spam.index_writer(writer=writer, title="Cheap pills", content="buy cheap pills", content_length=15,
+                              uid="spam-0", is_spam=True)
+
+        generation = ix.latest_generation()
+        with search.open_searcher(dirname=dirname, indexname=TEST_INDEX_NAME) as searcher:
+            self.assertNotIn("added", searcher.schema)
+
+        spam.upgrade_spam_index(ix)
+        self.assertGreater(ix.latest_generation(), generation)
+        self.assertIn("added", ix.schema)
+
+        with search.open_searcher(dirname=dirname, indexname=TEST_INDEX_NAME) as searcher:
+            self.assertIn("added", searcher.schema)
+            self.assertEqual([fields['added'] for fields in searcher.all_stored_fields()], [0])
+
+    @override_settings(SPAM_INDEX_DIR=os.path.join(TEST_ROOT, "spam"))
+    def test_spam_rescore(self):
+        """
+        Test rescoring moves posts in and out of quarantine, and a dry run saves nothing.
+        """
+        models.Post.objects.filter(pk=self.post.pk).update(spam=models.Post.SUSPECT)
+        total = spam.rescore_candidates().count()
+
+        # Nothing in the spam index resembles the posts.
+        self.assertEqual(spam.rescore(dry=True), (total, 0, 1))
+        self.assertEqual(models.Post.objects.get(pk=self.post.pk).spam, models.Post.SUSPECT)
+
+        self.assertEqual(spam.rescore(chunk=3), (total, 0, 1))
+        self.assertEqual(models.Post.objects.get(pk=self.post.pk).spam, models.Post.DEFAULT)
+
+        with override_settings(SPAM_THRESHOLD=-1):
+            self.assertEqual(spam.rescore(), (total, total, 0))
+        self.assertEqual(models.Post.objects.filter(spam=models.Post.SUSPECT).count(), total)
+
+        # A moderator labels the post while its chunk is being scored.
+        def label(ids):
+            rows = rescore_chunk(ids)
+            models.Post.objects.filter(pk=self.post.pk).update(spam=models.Post.NOT_SPAM)
+            return rows
+
+        rescore_chunk = spam.rescore_chunk
+        with mock.patch.object(spam, "rescore_chunk", side_effect=label):
+            self.assertEqual(spam.rescore(), (total, 0, total - 1))
+        self.assertEqual(models.Post.objects.get(pk=self.post.pk).spam, models.Post.NOT_SPAM)
+
+    def test_spam_cross_validation(self):
+        """
+        Test the k-fold evaluation reports every threshold from one set of scores.
+        """
+        for step in range(self.limit):
+            models.Post.objects.create(title=f"Cheap pills {step}", content="buy cheap pills online casino bonus",
+                                       author=self.owner, type=models.Post.QUESTION, spam=models.Post.SPAM)
+            models.Post.objects.create(content=f"Test answer {step} align the reads", author=self.owner,
+                                       type=models.Post.ANSWER, parent=self.post)
+
+        for engine in ("index", "model"):
+            rows = spam.cross_validate(folds=5, size=self.limit, engine=engine, thresholds=[-100, 100], seed=1)
+            first, last = rows
+            self.assertEqual((first['tp'], first['fp'], last['tp'], last['fp']), (self.limit, self.limit, 0, 0))
+
+        rows = spam.cross_validate(folds=5, size=self.limit, engine="model", seed=1)
+        current = [row for row in rows if row['threshold'] == settings.SPAM_THRESHOLD][0]
+        self.assertEqual(current['fp'], 0)
+        self.assertGreater(current['recall'], 0.5)
@@ -1,7 +1,12 @@
+import atexit
 import re
 import bleach
 import logging
+import multiprocessing
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from itertools import islice, count
 from datetime import datetime
@@ -55,6 +60,15 @@ def datetime_to_unix(date):
     return timegm(date.timetuple())
 
 
+def lookup(obj, path):
+    """
+    Returns the value of a field lookup on an object, like: profile__score.
+    """
+    for name in path.split("__"):
+        obj = getattr(obj, name, None)
+    return obj
+
+
 def pluralize(value, word):
     if value > 1:
         return "%d %ss" % (value, word)
@@ -85,4 +99,60 @@ def timer_func():
             print()
             print("**" * 5)
 
-    return elapsed, progress
\ No newline at end of file
+    return elapsed, progress
+
+
+def chunk_ids(query, size=1000):
+    """
+    Streams the primary keys of a queryset in ascending chunks.
+    Seeks on the primary key so that late chunks are as cheap as early ones.
+    """
+    last = 0
+    while True:
+        ids = list(query.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)[:size])
+        if not ids:
+            break
+        last = ids[-1]
+        yield ids
+
+
+def pool_map(func, stream, workers=0):
+    """
+    Applies a function to each element of the stream in a process pool, preserving the order.
+    Runs in the current process when no workers are requested.
+    """
+    if not workers:
+        yield from map(func, stream)
+        return
+
+    from django.db import connections
+
+    # The pool reads the stream on a thread of its own, queries of the stream run here first.
+    stream = list(stream)
+
+    # Forked processes must open their own database connections.
+    connections.close_all()
+
+    with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+        yield from pool.imap(func, stream)
+
+
+# Long lived thread pools of this process, by number of workers.
+POOLS = dict()
+
+POOLS_LOCK = threading.Lock()
+
+
+def get_pool(workers):
+    """
+    Returns a thread pool that is kept for the lifetime of the process.
+    Threads are safe to start within a request, a forked process starts its own pool.
+    """
+    key = (os.getpid(), workers)
+    with POOLS_LOCK:
+        if key not in POOLS:
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pool")
+            atexit.register(pool.shutdown, wait=False)
+            POOLS[key] = pool
+
+    return POOLS[key]
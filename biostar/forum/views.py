@@ -1,3 +1,5 @@
+import base64
+import json
 import logging
 from datetime import timedelta
 from functools import wraps, lru_cache
@@ -9,15 +11,17 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.db.models import Count, Q
-from django.core.paginator import Paginator
+from django.db.models import Count, F, Q
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, Page
 from django.shortcuts import render, redirect, reverse
+from django.template.loader import render_to_string
 from django.core.cache import cache
 from ratelimit.decorators import ratelimit
 from taggit.models import Tag
 
 from biostar.accounts.models import Profile
-from biostar.forum import forms, auth, tasks, util, search
+from biostar.forum import forms, auth, tasks, util, search, caching
 from biostar.forum.const import *
 from biostar.forum.models import Post, Vote, Badge, Subscription
 
@@ -47,6 +51,10 @@ LIMIT_MAP = dict(
     year=365
 )
 
+# Parameters of the post listings shared by anonymous users.
+LISTING_PARAMS = {'page', 'cursor', 'order', 'tag', 'type', 'limit'}
+
+
 def post_exists(func):
     """
     Ensure uid passed to view function exists.
@@ -87,6 +95,148 @@ class CachedPaginator(Paginator):
         return value
 
 
+class CursorPage(Page):
+    """
+    Page of a CursorPaginator, linking to its neighbours by cursor past the numbered pages.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next, next_cursor=None, previous_cursor=None):
+        super(CursorPage, self).__init__(object_list, number, paginator)
+        self.more = has_next
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.more
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def page_number(number, pages):
+    """
+    Returns the page number requested, within the numbered pages.
+    """
+    number = str(number)
+    return min(int(number), pages) if number.isdigit() and int(number) > 0 else 1
+
+
+def decode_cursor(cursor, size):
+    """
+    Returns the page number, direction and the size ordering values of a cursor, None when invalid.
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        number, backward, values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if int(number) < 1 or len(values) != size:
+            return None
+    except (ValueError, TypeError):
+        return None
+
+    return int(number), bool(backward), values
+
+
+class CursorPaginator(CachedPaginator):
+    """
+    Paginator that seeks past the rows of the previous page instead of skipping them with OFFSET.
+
+    The first few pages keep their page numbers. Deeper pages are reached through opaque cursors
+    that hold the ordering values and primary key of the row to seek past. Empty values are
+    ordered last in either direction of the fields.
+    """
+
+    def __init__(self, object_list, ordering, pages=None, *args, **kwargs):
+
+        # The primary key breaks ties in the direction of the first field.
+        ordering = list(ordering)
+        ordering.append("-pk" if ordering[0].startswith("-") else "pk")
+        self.ordering = ordering
+        self.pages = pages or settings.NUMBERED_PAGES
+
+        order = [F(field.lstrip("-")).desc(nulls_last=True) if field.startswith("-") else
+                 F(field).asc(nulls_last=True) for field in ordering]
+        object_list = object_list.order_by(*order)
+        super(CursorPaginator, self).__init__(object_list=object_list, *args, **kwargs)
+
+    def encode(self, number, backward, row):
+        values = [util.lookup(row, field.lstrip("-")) for field in self.ordering]
+
+        # Dates keep their microseconds, rows are seeked past by equality.
+        data = json.dumps([number, backward, values], default=util.datetime_to_iso)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode(self, cursor):
+        return decode_cursor(cursor, size=len(self.ordering))
+
+    def seek(self, values, backward):
+        """
+        Returns the condition that selects the rows after the values, or before them when backward.
+        """
+        # Matches no rows, past the primary key there are no ties to break.
+        cond = Q(pk__in=[])
+        for field, value in reversed(list(zip(self.ordering, values))):
+            name = field.lstrip("-")
+            if value is None:
+                # Empty values come last, only the rows with a value are before them.
+                past = Q(**{f"{name}__isnull": False}) if backward else None
+                same = Q(**{f"{name}__isnull": True})
+            else:
+                past = Q(**{f"{name}__{'lt' if field.startswith('-') != backward else 'gt'}": value})
+                past = past if backward else past | Q(**{f"{name}__isnull": True})
+                same = Q(**{name: value})
+
+            cond = same & cond if past is None else past | (same & cond)
+
+        return cond
+
+    def get_page(self, number, cursor=None):
+        """
+        Returns the page of the cursor when given, otherwise a numbered page.
+        Page numbers past the numbered pages return the last numbered page.
+        """
+        seek = self.decode(cursor) if cursor else None
+
+        if seek:
+            number, backward, values = seek
+            try:
+                query = self.object_list.filter(self.seek(values, backward=backward))
+                query = query.reverse() if backward else query
+                rows = list(query[:self.per_page + 1])
+            except (ValidationError, ValueError, TypeError):
+                # A cursor with values of the wrong type.
+                return self.get_page(1)
+        else:
+            number = page_number(number, self.pages)
+            start = (number - 1) * self.per_page
+            rows = list(self.object_list[start:start + self.per_page + 1])
+            backward = False
+
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backward:
+            rows.reverse()
+
+        has_next = True if backward else more
+        next_cursor = previous_cursor = None
+        if has_next and number >= self.pages and rows:
+            next_cursor = self.encode(number + 1, backward=False, row=rows[-1])
+        if number - 1 > self.pages and rows:
+            previous_cursor = self.encode(number - 1, backward=True, row=rows[0])
+
+        return CursorPage(rows, number, self, has_next=has_next, next_cursor=next_cursor,
+                          previous_cursor=previous_cursor)
+
+
+def post_ordering(order):
+    return ORDER_MAPPER.get(order) or "-rank"
+
+
 def get_posts(user, topic="", tag="", order="", limit=None):
     """
     Generates a post list on a topic.
@@ -127,11 +277,7 @@ def get_posts(user, topic="", tag="", order="", limit=None):
         query = query.filter(tags__name=tag.lower())
 
     # Apply post ordering.
-    if ORDER_MAPPER.get(order):
-        ordering = ORDER_MAPPER.get(order)
-        query = query.order_by(ordering)
-    else:
-        query = query.order_by("-rank")
+    query = query.order_by(post_ordering(order))
 
     days = LIMIT_MAP.get(limit, 0)
     # Apply time limit if required.
@@ -158,10 +304,10 @@ def post_search(request):
         messages.error(request, "Enter more characters before preforming search.")
         return redirect(reverse('post_list'))
 
+    # Drop the duplicate, keeping the primary sort first.
     sortedby += ["lastedit_date"]
-    sortedby = set(sortedby)
-    results = search.preform_whoosh_search(query=query, page=page, sortedby=sortedby,
-                                           reverse=True)
+    sortedby = list(dict.fromkeys(sortedby))
+    results = search.search_page(query=query, page=page, sortedby=sortedby, reverse=True)
 
     total = results.total
     template_name = "search/search_results.html"
@@ -170,7 +316,6 @@ def post_search(request):
     context = dict(results=results, query=query, total=total, template_name=template_name,
                    question_flag=question_flag, stop_words=','.join(search.STOP),
                    sort=sorting)
-
     return render(request, template_name=template_name, context=context)
 
 
@@ -194,36 +339,70 @@ def pages(request, fname):
     return render(request, 'pages.html', context=context)
 
 
+def listing_key(request, topic, tag, order, limit, page, cursor):
+    """
+    Returns the cache key of the rendered listing, None when the request may not share it.
+    """
+    # Unknown parameters end up in the page links.
+    if request.user.is_authenticated or set(request.GET) - LISTING_PARAMS:
+        return None
+
+    # Pages are keyed on the page they show, the listing seeks on its order and the primary key.
+    seek = decode_cursor(cursor, size=2) if cursor else None
+    page = json.dumps(seek) if seek else page_number(page, settings.NUMBERED_PAGES)
+
+    return caching.fragment_key(caching.POST_LIST, request.path, topic, tag.lower(), order, limit, page)
+
+
 @ensure_csrf_cookie
 def post_list(request, topic=None, cache_key='', extra_context=dict()):
     """
     Post listing. Filters, orders and paginates posts based on GET parameters.
+    The listing shown to anonymous users is rendered once and cached.
     """
     # The user performing the request.
     user = request.user
 
     # Parse the GET parameters for filtering information
     page = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor')
     order = request.GET.get("order", "")
     tag = request.GET.get("tag", "")
     topic = topic or request.GET.get("type", "")
     limit = request.GET.get("limit", "")
 
-    # Get posts available to users.
-    posts = get_posts(user=user, topic=topic, tag=tag, order=order, limit=limit)
-
-    # Create the paginator.
-    paginator = CachedPaginator(cache_key=cache_key, object_list=posts, per_page=settings.POSTS_PER_PAGE)
-
-    # Apply the post paging.
-    posts = paginator.get_page(page)
-
     # Set the active tab.
     tab = tag or topic or LATEST
 
     # Fill in context.
-    context = dict(posts=posts, tab=tab, tag=tag, order=order, type=topic, limit=limit, avatar=True)
+    context = dict(tab=tab, tag=tag, order=order, type=topic, limit=limit, avatar=True)
     context.update(extra_context)
+
+    def get_page():
+        # Get posts available to users.
+        posts = get_posts(user=user, topic=topic, tag=tag, order=order, limit=limit)
+
+        # Create the paginator.
+        paginator = CursorPaginator(cache_key=cache_key, object_list=posts, per_page=settings.POSTS_PER_PAGE,
+                                    ordering=[post_ordering(order)])
+
+        # Apply the post paging.
+        return paginator.get_page(page, cursor=cursor)
+
+    def render_listing():
+        # The pager is shown above the listing as well.
+        data = dict(context, posts=get_page())
+        listing = render_to_string("widgets/post_listing.html", context=data, request=request)
+        pager = render_to_string("widgets/post_pager.html", context=data, request=request)
+        return listing, pager
+
+    key = listing_key(request, topic=topic, tag=tag, order=order, limit=limit, page=page, cursor=cursor)
+    if key:
+        context['listing'], context['pager'] = caching.get_or_build(key, build=render_listing,
+                                                                   group=caching.POST_LIST)
+    else:
+        context['posts'] = get_page()
+
     # Render the page.
     return render(request, template_name="post_list.html", context=context)
 
@@ -260,14 +439,15 @@ def myvotes(request):
     Show posts by user that received votes
     """
     page = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor')
 
     votes = Vote.objects.filter(post__author=request.user).prefetch_related('post', 'post__root',
-                                                                            'author__profile').order_by("-date")
+                                                                            'author__profile')
     # Create the paginator
-    paginator = CachedPaginator(object_list=votes, per_page=settings.POSTS_PER_PAGE)
+    paginator = CursorPaginator(object_list=votes, per_page=settings.POSTS_PER_PAGE, ordering=["-date"])
 
     # Apply the votes paging.
-    votes = paginator.get_page(page)
+    votes = paginator.get_page(page, cursor=cursor)
 
     context = dict(votes=votes, page=page, tab='myvotes')
     return render(request, template_name="votes_list.html", context=context)
@@ -278,6 +458,7 @@ def tags_list(request):
     Show posts by user
     """
     page = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor')
     query = request.GET.get('query', '')
 
     count = Count('post', filter=Q(post__is_toplevel=True))
@@ -286,14 +467,13 @@ def tags_list(request):
     cache_key = None if query else TAGS_CACHE_KEY
 
     tags = Tag.objects.annotate(nitems=count).filter(db_query)
-    tags = tags.order_by('-nitems')
 
     # Create the paginator
-    paginator = CachedPaginator(cache_key=cache_key, object_list=tags,
-                                per_page=settings.POSTS_PER_PAGE)
+    paginator = CursorPaginator(cache_key=cache_key, object_list=tags,
+                                per_page=settings.POSTS_PER_PAGE, ordering=['-nitems'])
 
     # Apply the votes paging.
-    tags = paginator.get_page(page)
+    tags = paginator.get_page(page, cursor=cursor)
 
     context = dict(tags=tags, tab='tags', query=query)
 
@@ -336,6 +516,7 @@ def community_list(request):
     users = User.objects.select_related("profile")
 
     page = request.GET.get("page", 1)
+    cursor = request.GET.get("cursor")
     ordering = request.GET.get("order", "visit")
     limit_to = request.GET.get("limit", "time")
     query = request.GET.get('query', '')
@@ -358,12 +539,11 @@ def community_list(request):
 
     order = ORDER_MAPPER.get(ordering, "visit")
     users = users.filter(profile__state__in=[Profile.NEW, Profile.TRUSTED])
-    users = users.order_by(order)
 
     # Create the paginator
-    paginator = CachedPaginator(cache_key=cache_key, object_list=users,
-                                per_page=settings.POSTS_PER_PAGE)
-    users = paginator.get_page(page)
+    paginator = CursorPaginator(cache_key=cache_key, object_list=users,
+                                per_page=settings.POSTS_PER_PAGE, ordering=[order])
+    users = paginator.get_page(page, cursor=cursor)
     context = dict(tab="community", users=users, query=query, order=ordering, limit=limit_to)
 
     return render(request, "community_list.html", context=context)
@@ -419,11 +599,10 @@ def post_view(request, uid):
             return redirect(answer.get_absolute_url())
         messages.error(request, form.errors)
 
-    # Build the comment tree .
-    root, comment_tree, answers, thread = auth.post_tree(user=request.user, root=post.root)
-    # user string
+    # Render the thread, cached between changes.
+    thread = auth.render_thread(request=request, root=post.root)
 
-    context = dict(post=root, tree=comment_tree, form=form, answers=answers)
+    context = dict(post=post.root, thread=thread, form=form)
 
     return render(request, "post_view.html", context=context)
 
@@ -2,12 +2,10 @@
 This is active only when deployed via UWSGI
 '''
 
-import logging, time, shutil, subprocess
+import logging, shutil, subprocess
 from django.core import management
 from biostar.utils.decorators import spool, timer
 
-import time
-
 logger = logging.getLogger("engine")
 
 
@@ -34,7 +32,7 @@ def scheduler(args):
     if jobs:
         # Put the jobs in SPOOLED state so that it do not get respooled.
         for job in jobs:
-            execute_job.spool(job_id=job.id)
+            execute_job.spool(job_id=job.id, delay=3)
 
         jobs.update(state=Job.SPOOLED)
 
@@ -66,16 +64,22 @@ def scheduler(args):
 def execute_job(job_id):
     """
     Execute job in spooler.
+    Spool with a delay of 3 seconds to spend that long in queued state.
     """
     logger.info(f"Executing spooled job id={job_id}")
     from biostar.recipes.models import Job
 
-    # Spend 3 seconds in queued state.
-    time.sleep(3)
     Job.objects.filter(id=job_id).update(state=Job.SPOOLED)
-    # Spend 3 seconds in spooled state
-    time.sleep(3)
 
+    # Spend 3 seconds in spooled state, the spooler holds the task until then.
+    run_job.spool(job_id=job_id, delay=3)
+
+
+@spool(pass_arguments=True)
+def run_job(job_id):
+    """
+    Run a spooled job.
+    """
     management.call_command('job', id=job_id)
 
 #
@@ -475,7 +475,7 @@ def recipe_run(request, uid):
             # Create the job from the recipe and incoming json data.
             job = auth.create_job(analysis=recipe, user=request.user, fill_with=form.cleaned_data)
             # Spool via UWSGI or start it synchronously.
-            tasks.execute_job.spool(job_id=job.id)
+            tasks.execute_job.spool(job_id=job.id, delay=3)
             url = reverse("recipe_view", kwargs=dict(uid=recipe.uid)) + "#results"
             return redirect(url)
         else:
@@ -508,7 +508,7 @@ def job_rerun(request, uid):
     job = auth.create_job(analysis=recipe, user=request.user, json_data=json_data)
 
     # Spool via UWSGI or run it synchronously.
-    tasks.execute_job.spool(job_id=job.id)
+    tasks.execute_job.spool(job_id=job.id, delay=3)
     if auth.is_readable(user=request.user, obj=recipe):
         url = reverse('recipe_view', kwargs=dict(uid=job.analysis.uid)) + "#results"
     else:
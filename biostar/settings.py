@@ -18,6 +18,31 @@ MULTI_THREAD = True
 # A setting to disable tasks altoghether.
 DISABLE_TASKS = False
 
+# Worker threads that run tasks in multi threaded mode.
+TASK_WORKERS = 4
+
+# Tasks waiting for a worker before the queue policy applies.
+TASK_QUEUE_SIZE = 1000
+
+# When the queue is full: "block" the caller, "drop" the task or run it "inline" in the caller.
+TASK_QUEUE_POLICY = "block"
+
+# Seconds given to queued tasks to finish when the process exits.
+TASK_DRAIN_SECS = 10
+
+# Set to "db" to keep spooled tasks in the database, run by: python manage.py worker
+TASK_BACKEND = ""
+
+# Seconds a task of the database backend may run, unless set on the task.
+TASK_TIMEOUT = 300
+
+# Retries of a failing task, the wait doubles from TASK_RETRY_SECS on each attempt.
+TASK_RETRIES = 3
+TASK_RETRY_SECS = 10
+
+# Hours finished tasks are kept in the database.
+TASK_KEEP_HOURS = 24
+
 # Pagedown
 PAGEDOWN_IMAGE_UPLOAD_ENABLED = False
 
@@ -90,6 +115,7 @@ DEFAULT_APPS = [
     'compressor',
     'taggit',
     'snowpenguin.django.recaptcha2',
+    'biostar.utils.apps.UtilsConfig',
 ]
 
 # Enabled apps.
@@ -1,11 +1,50 @@
-import logging, functools
+import logging, functools, heapq, itertools, time, os, queue, atexit
+from datetime import datetime
 from django.conf import settings
 logger = logging.getLogger('biostar')
 import threading
+from biostar.utils import taskqueue
+
+
+def run_at(delay=0, at=None):
+    """
+    Returns the unix time a task is due, None when it may run right away.
+    The time may be given as a datetime, a unix time or a delay in seconds.
+    """
+    if isinstance(at, datetime):
+        at = at.timestamp()
+    if delay:
+        at = max(at or 0, time.time() + delay)
+    return at if at and at > time.time() else None
+
 
 try:
     # When run with uwsgi the tasks will be spooled via uwsgi.
-    from uwsgidecorators import spool, timer
+    from uwsgidecorators import spool as uwsgi_spool, timer as local_timer
+
+    # The timers are registered with uwsgi.
+    UWSGI = True
+
+    def local_spool(pass_arguments=True):
+        def outer(func):
+            task = uwsgi_spool(pass_arguments=pass_arguments)(func)
+            submit = task.spool
+
+            # The spooler holds delayed tasks until their time in the 'at' field.
+            @functools.wraps(submit)
+            def delayed(*args, delay=0, at=None, **kwargs):
+                due = run_at(delay=delay, at=at)
+                if due:
+                    kwargs['at'] = str(int(due))
+                return submit(*args, **kwargs)
+
+            task.spool = delayed
+            return task
+        return outer
+
+    def task_stats():
+        # The spooler keeps its own statistics.
+        return dict()
 
 except Exception as exc:
     #
@@ -14,18 +53,167 @@ except Exception as exc:
     #
     logger.warning("uwsgi module not found, tasks will run in threads")
 
+    UWSGI = False
+
+    class TaskPool(object):
+        """
+        Fixed number of worker threads fed by a bounded queue.
+        A full queue blocks the caller, drops the task or runs it in the caller,
+        following settings.TASK_QUEUE_POLICY.
+        """
+
+        def __init__(self, workers, size, policy):
+            self.queue = queue.Queue(maxsize=size)
+            self.policy = policy
+            self.pid = os.getpid()
+            self.lock = threading.Lock()
+            self.closed = False
+
+            # Counters of the pool, seconds are totals.
+            self.counts = dict(submitted=0, completed=0, failed=0, dropped=0, inline=0, wait=0.0, wait_max=0.0,
+                               run=0.0)
+
+            self.threads = [threading.Thread(target=self.work, daemon=True) for step in range(workers)]
+            for thread in self.threads:
+                thread.start()
+
+        def count(self, key, value=1):
+            with self.lock:
+                self.counts[key] += value
+
+        def run(self, func, args, kwargs):
+            start = time.time()
+            try:
+                func(*args, **kwargs)
+            except Exception as exc:
+                self.count('failed')
+                logger.error(f"task {func.__name__} failed: {exc}")
+            finally:
+                self.count('run', time.time() - start)
+
+        def work(self):
+            while True:
+                queued, func, args, kwargs = self.queue.get()
+                wait = time.time() - queued
+                with self.lock:
+                    self.counts['wait'] += wait
+                    self.counts['wait_max'] = max(self.counts['wait_max'], wait)
+                self.run(func, args, kwargs)
+                self.count('completed')
+                self.queue.task_done()
+
+        def submit(self, func, args, kwargs):
+            if self.closed:
+                self.count('dropped')
+                return
+            self.count('submitted')
+            item = (time.time(), func, args, kwargs)
+            try:
+                self.queue.put(item, block=self.policy == "block")
+            except queue.Full:
+                if self.policy == "inline":
+                    self.count('inline')
+                    self.run(func, args, kwargs)
+                else:
+                    self.count('dropped')
+                    logger.warning(f"task queue full, dropped {func.__name__}")
+
+        def drain(self, secs):
+            """
+            Stops taking tasks and waits up to secs for the queued ones to finish.
+            The idle workers are daemon threads that end with the process.
+            """
+            self.closed = True
+            deadline = time.time() + secs
+            with self.queue.all_tasks_done:
+                while self.queue.unfinished_tasks and time.time() < deadline:
+                    self.queue.all_tasks_done.wait(deadline - time.time())
+
+        def stats(self):
+            with self.lock:
+                stats = dict(self.counts)
+            done = stats['completed'] or 1
+            stats.update(depth=self.queue.qsize(), workers=len(self.threads), wait_mean=stats['wait'] / done,
+                         run_mean=stats['run'] / done)
+            return stats
+
+    POOL = None
+
+    POOL_LOCK = threading.Lock()
+
+    def get_pool():
+        """
+        Returns the task pool of this process, a forked process starts its own.
+        """
+        global POOL
+        with POOL_LOCK:
+            if POOL is None or POOL.pid != os.getpid():
+                POOL = TaskPool(workers=settings.TASK_WORKERS, size=settings.TASK_QUEUE_SIZE,
+                                policy=settings.TASK_QUEUE_POLICY)
+        return POOL
+
+    def task_stats():
+        """
+        Counters of the task pool: queue depth, wait and run times in seconds.
+        """
+        return POOL.stats() if POOL else dict()
+
+    def drain():
+        if POOL is not None and POOL.pid == os.getpid():
+            POOL.drain(secs=settings.TASK_DRAIN_SECS)
+            logger.info(f"task pool drained: {POOL.stats()}")
+
+    # Finish the queued tasks before the process exits.
+    atexit.register(drain)
+
+    def submit_task(func, args, kwargs):
+        # Run process in the worker pool.
+        get_pool().submit(func, args, kwargs)
+
+    class Scheduler(object):
+        """
+        Holds delayed tasks in a heap ordered by the time they are due.
+        A single timer thread waits for the earliest one; no thread is used by a task until it is due.
+        """
+
+        def __init__(self):
+            self.heap = []
+            self.counter = itertools.count()
+            self.cond = threading.Condition()
+            self.thread = None
+
+        def add(self, due, func, args, kwargs):
+            with self.cond:
+                heapq.heappush(self.heap, (due, next(self.counter), func, args, kwargs))
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.loop, daemon=True)
+                    self.thread.start()
+                self.cond.notify()
+
+        def loop(self):
+            while True:
+                with self.cond:
+                    while not self.heap or self.heap[0][0] > time.time():
+                        timeout = self.heap[0][0] - time.time() if self.heap else None
+                        self.cond.wait(timeout)
+                    due, count, func, args, kwargs = heapq.heappop(self.heap)
+                submit_task(func, args, kwargs)
+
+    SCHEDULER = Scheduler()
+
     # Create a threaded version of the spooler
-    def spool(pass_arguments=True):
+    def local_spool(pass_arguments=True):
         def outer(func):
             @functools.wraps(func)
-            def inner(*args, **kwargs):
+            def inner(*args, delay=0, at=None, **kwargs):
                 if settings.DISABLE_TASKS:
                     return
                 if settings.MULTI_THREAD:
-                    # Run process in separate thread.
-                    logger.info(f"new thread for function f{func} {args} {kwargs}")
-                    t = threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True)
-                    t.start()
+                    due = run_at(delay=delay, at=at)
+                    if due:
+                        SCHEDULER.add(due, func, args, kwargs)
+                    else:
+                        submit_task(func, args, kwargs)
                 else:
                     func(*args, **kwargs)
             inner.spool = inner
@@ -34,7 +222,7 @@ except Exception as exc:
         return outer
 
     # Create a threaded version of the timer
-    def timer(secs, **kwargs):
+    def local_timer(secs, **kwargs):
         def outer(func):
             @functools.wraps(func)
             def inner(*args, **kwargs):
@@ -59,3 +247,53 @@ except Exception as exc:
             return inner
         # Gains an attribute called timer that will run the function periodically.
         return outer
+
+
+def spool(pass_arguments=True, key=None, retries=None, timeout=None):
+    """
+    Gives a task a spool attribute that runs it in the background: queued in the database
+    when settings.TASK_BACKEND is "db", otherwise in the uwsgi spooler or in threads.
+    Database tasks with the same key collapse into one while queued, the key is formatted
+    with the arguments of the call, for example key="awards-{user_id}".
+    """
+    def outer(func):
+        task = local_spool(pass_arguments=pass_arguments)(func)
+        submit = task.spool
+        taskqueue.register(func)
+
+        @functools.wraps(func)
+        def queued(*args, delay=0, at=None, **kwargs):
+            if settings.TASK_BACKEND != "db":
+                return submit(*args, delay=delay, at=at, **kwargs)
+            if settings.DISABLE_TASKS:
+                return
+            name = key.format(*args, **kwargs) if key else None
+            return taskqueue.enqueue(func, args=args, kwargs=kwargs, run_at=run_at(delay=delay, at=at), key=name,
+                                     retries=retries, timeout=timeout)
+
+        task.spool = queued
+        return task
+    return outer
+
+
+def timers_running():
+    """
+    Returns True when the timers run in the background, in uwsgi or in the database queue workers.
+    """
+    return not settings.DISABLE_TASKS and (UWSGI or settings.TASK_BACKEND == "db")
+
+
+def timer(secs, **kwargs):
+    """
+    Runs a function every secs seconds, queued by the workers when settings.TASK_BACKEND is "db".
+    """
+    def outer(func):
+        if settings.TASK_BACKEND != "db":
+            return local_timer(secs, **kwargs)(func)
+
+        taskqueue.register(func, secs=secs)
+
+        # The workers of the database queue start the timer.
+        func.timer = lambda *args, **kwargs: None
+        return func
+    return outer
@@ -0,0 +1,68 @@
+import logging
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.module_loading import autodiscover_modules
+
+from biostar.utils import taskqueue
+from biostar.utils.models import Task
+
+logger = logging.getLogger('biostar')
+
+
+class Command(BaseCommand):
+    help = 'Run the tasks queued in the database (settings.TASK_BACKEND = "db").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Number of worker processes.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds between checks of an empty queue.")
+        parser.add_argument('--batch', type=int, default=1, help="Tasks claimed at a time by each worker.")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Exit when no task is due.")
+        parser.add_argument('--stats', action='store_true', default=False,
+                            help="Print the number of tasks in each state and exit.")
+
+    def handle(self, *args, **options):
+
+        if options['stats']:
+            rows, lag = taskqueue.stats()
+            states = dict(Task.STATE_CHOICES)
+            for row in rows:
+                print(f"{row['count']:>8}  {states[row['state']]:<8}  {row['name']}")
+            print(f"Oldest due task waited {lag:.1f} seconds")
+            return
+
+        # Import the task modules so that the periodic tasks are known.
+        autodiscover_modules('tasks')
+
+        # Finish the current task on termination.
+        stop = lambda *args: taskqueue.STOP.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        params = dict(poll=options['poll'], batch=options['batch'], once=options['once'])
+        processes = options['processes']
+
+        if processes <= 1:
+            taskqueue.work(**params)
+            return
+
+        # Forked processes must open their own database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=taskqueue.work, kwargs=params) for step in range(processes)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                while worker.is_alive() and not taskqueue.STOP.is_set():
+                    worker.join(timeout=1)
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('data', models.BinaryField()),
+                ('key', models.CharField(blank=True, max_length=255, null=True)),
+                ('state', models.IntegerField(choices=[(0, 'Queued'), (1, 'Running'), (2, 'Done'), (3, 'Failed')], default=0)),
+                ('run_at', models.DateTimeField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('timeout', models.IntegerField(default=0)),
+                ('worker', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['state', 'run_at'], name='utils_task_state_238f70_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(state=0), fields=('key',), name='unique_queued_key'),
+        ),
+    ]
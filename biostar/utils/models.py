@@ -0,0 +1,44 @@
+from django.db import models
+
+
+class Task(models.Model):
+    """
+    A spooled task kept in the database until a worker runs it.
+    """
+    QUEUED, RUNNING, DONE, FAILED = range(4)
+    STATE_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    # Module and name of the task function.
+    name = models.CharField(max_length=255, db_index=True)
+
+    # Pickled positional and keyword arguments.
+    data = models.BinaryField()
+
+    # Tasks with the same key collapse into one while queued.
+    key = models.CharField(max_length=255, null=True, blank=True)
+
+    state = models.IntegerField(choices=STATE_CHOICES, default=QUEUED)
+
+    # The task is not claimed before this time.
+    run_at = models.DateTimeField()
+
+    attempts = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+
+    # Seconds the task may run.
+    timeout = models.IntegerField(default=0)
+
+    worker = models.CharField(max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "run_at"])]
+        # Only one queued task per key, state 0 is QUEUED.
+        constraints = [models.UniqueConstraint(fields=["key"], condition=models.Q(state=0), name="unique_queued_key")]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_state_display()})"
@@ -0,0 +1,291 @@
+"""
+Database backed task queue, used by the spool and timer decorators when settings.TASK_BACKEND is "db".
+
+Each spooled call is stored as a Task row and survives restarts. Workers started with
+
+    python manage.py worker --processes 4
+
+claim due tasks with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it
+and with a conditional update otherwise (SQLite). Failing tasks are retried with
+exponential backoff, tasks running past their timeout are stopped.
+"""
+import importlib
+import logging
+import os
+import pickle
+import signal
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as tz
+
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError, OperationalError
+from django.db.models import F, Count, Min
+from django.utils import timezone
+
+logger = logging.getLogger('biostar')
+
+# Task functions by name, filled in by the decorators.
+TASKS = dict()
+
+# Seconds between two runs of the periodic tasks, by name.
+TIMERS = dict()
+
+# Last time each periodic task was queued by this process.
+QUEUED = dict()
+
+# Set to stop the workers of this process after their current task.
+STOP = threading.Event()
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def task_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def register(func, secs=0):
+    """
+    Records a task function, periodic when secs is set.
+    """
+    name = task_name(func)
+    TASKS[name] = func
+    if secs:
+        TIMERS[name] = secs
+    return name
+
+
+def resolve(name):
+    """
+    Returns the function of a task, importing its module if needed.
+    """
+    if name not in TASKS:
+        importlib.import_module(name.rsplit(".", 1)[0])
+    return TASKS[name]
+
+
+def enqueue(func, args=(), kwargs={}, run_at=None, key=None, retries=None, timeout=None):
+    """
+    Stores a call to a task, due at the unix time run_at or right away.
+    Returns the task, None when a queued task with the same key absorbs the call.
+    """
+    from biostar.utils.models import Task
+
+    name = register(func)
+    now = timezone.now()
+    due = datetime.fromtimestamp(run_at, tz=tz.utc) if run_at else now
+    retries = settings.TASK_RETRIES if retries is None else retries
+
+    try:
+        with transaction.atomic():
+            task = Task.objects.create(name=name, data=pickle.dumps((args, kwargs)), key=key, run_at=due,
+                                       retries=retries, timeout=timeout or 0)
+    except IntegrityError:
+        return None
+
+    return task
+
+
+def claim(worker, limit=1):
+    """
+    Marks up to limit due tasks as running by this worker and returns them.
+    """
+    from biostar.utils.models import Task
+
+    now = timezone.now()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    fields = dict(state=Task.RUNNING, worker=worker, started=now, attempts=F("attempts") + 1)
+
+    query = Task.objects.filter(state=Task.QUEUED, run_at__lte=now).order_by("run_at", "id")
+
+    if skip_locked:
+        # Rows locked by other workers are passed over, not waited for.
+        with transaction.atomic():
+            ids = list(query.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+            Task.objects.filter(id__in=ids).update(**fields)
+    else:
+        # Without row locks the conditional update decides which worker gets a task.
+        ids = list(query.values_list("id", flat=True)[:limit])
+        ids = [pk for pk in ids if Task.objects.filter(id=pk, state=Task.QUEUED).update(**fields)]
+
+    return list(Task.objects.filter(id__in=ids).order_by("run_at", "id"))
+
+
+@contextmanager
+def deadline(secs):
+    """
+    Raises TaskTimeout in the code that runs longer than secs.
+    Alarms are only delivered to the main thread, tasks run elsewhere have no deadline.
+    """
+    if not secs or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise TaskTimeout(f"task ran longer than {secs} seconds")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, secs)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def fail(task, exc):
+    """
+    Queues a failed task again after a backoff, or marks it failed once out of retries.
+    """
+    from biostar.utils.models import Task
+
+    now = timezone.now()
+    error = f"{type(exc).__name__}: {exc}"
+    tasks = Task.objects.filter(id=task.id)
+
+    if task.attempts > task.retries:
+        tasks.update(state=Task.FAILED, finished=now, error=error)
+        logger.error(f"task {task.name} id={task.id} failed after {task.attempts} attempts: {error}")
+        return
+
+    wait = settings.TASK_RETRY_SECS * 2 ** (task.attempts - 1)
+    try:
+        with transaction.atomic():
+            tasks.update(state=Task.QUEUED, run_at=now + timedelta(seconds=wait), error=error)
+    except IntegrityError:
+        # A newer call with the same key is queued and takes over.
+        tasks.update(state=Task.FAILED, finished=now, error=f"{error} (superseded)")
+        return
+
+    logger.warning(f"task {task.name} id={task.id} attempt {task.attempts} failed, retry in {wait}s: {error}")
+
+
+def execute(task):
+    """
+    Runs a claimed task. Returns True when it succeeds.
+    """
+    from biostar.utils.models import Task
+
+    try:
+        func = resolve(task.name)
+        args, kwargs = pickle.loads(task.data)
+        with deadline(task.timeout or settings.TASK_TIMEOUT):
+            func(*args, **kwargs)
+    except Exception as exc:
+        fail(task, exc)
+        return False
+
+    Task.objects.filter(id=task.id).update(state=Task.DONE, finished=timezone.now(), error='')
+    return True
+
+
+def schedule_timers():
+    """
+    Queues the periodic tasks that are due.
+    A task queued recently by any worker is not queued again.
+    """
+    from biostar.utils.models import Task
+
+    for name, secs in TIMERS.items():
+        if time.time() - QUEUED.get(name, 0) < secs:
+            continue
+        QUEUED[name] = time.time()
+
+        since = timezone.now() - timedelta(seconds=secs)
+        if Task.objects.filter(name=name, created__gt=since).exists():
+            continue
+
+        # Timers receive one argument, as with uwsgi.
+        enqueue(TASKS[name], args=(None,), key=f"timer:{name}")
+
+
+def recover():
+    """
+    Queues again the tasks left running by workers that died.
+    """
+    from biostar.utils.models import Task
+
+    now = timezone.now()
+    count = 0
+    for task in Task.objects.filter(state=Task.RUNNING):
+        limit = (task.timeout or settings.TASK_TIMEOUT) * 2
+        if not task.started or (now - task.started).total_seconds() <= limit:
+            continue
+        tasks = Task.objects.filter(id=task.id, state=Task.RUNNING)
+        try:
+            with transaction.atomic():
+                count += tasks.update(state=Task.QUEUED, run_at=now)
+        except IntegrityError:
+            # A newer call with the same key is queued and takes over.
+            tasks.update(state=Task.FAILED, finished=now, error="worker lost (superseded)")
+
+    return count
+
+
+def purge():
+    """
+    Removes the tasks finished longer ago than TASK_KEEP_HOURS.
+    """
+    from biostar.utils.models import Task
+
+    since = timezone.now() - timedelta(hours=settings.TASK_KEEP_HOURS)
+    count, details = Task.objects.filter(state__in=[Task.DONE, Task.FAILED], finished__lt=since).delete()
+    return count
+
+
+def work(name=None, poll=1.0, batch=1, once=False):
+    """
+    Runs tasks until stopped, or until the queue is empty when once is set.
+    Returns the number of tasks run.
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    total = 0
+    maintained = 0
+
+    logger.info(f"worker {name} started")
+    while not STOP.is_set():
+        schedule_timers()
+
+        # Housekeeping about once a minute.
+        if time.time() - maintained > 60:
+            recover()
+            purge()
+            maintained = time.time()
+
+        try:
+            tasks = claim(worker=name, limit=batch)
+        except OperationalError as exc:
+            # A busy SQLite database, try again on the next poll.
+            logger.warning(f"worker {name} could not claim tasks: {exc}")
+            STOP.wait(poll)
+            continue
+
+        for task in tasks:
+            execute(task)
+            total += 1
+
+        if not tasks:
+            if once:
+                break
+            STOP.wait(poll)
+
+    logger.info(f"worker {name} stopped after {total} tasks")
+    return total
+
+
+def stats():
+    """
+    Returns the number of tasks in each state by name and the age of the oldest due task in seconds.
+    """
+    from biostar.utils.models import Task
+
+    now = timezone.now()
+    rows = Task.objects.values("name", "state").annotate(count=Count("id")).order_by("name", "state")
+    oldest = Task.objects.filter(state=Task.QUEUED, run_at__lte=now).aggregate(oldest=Min("run_at"))['oldest']
+    lag = (now - oldest).total_seconds() if oldest else 0
+
+    return list(rows), lag
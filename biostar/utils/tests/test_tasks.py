@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from django.test import TestCase, override_settings
+from biostar.utils import decorators, taskqueue
+from biostar.utils.models import Task
+from biostar.utils.decorators import spool
+
+logger = logging.getLogger('engine')
+
+
+class TaskTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+    @override_settings(MULTI_THREAD=True)
+    def test_delayed_spool(self):
+        """
+        Test delayed tasks run in the order they are due.
+        """
+        done = []
+        finished = threading.Event()
+
+        @spool(pass_arguments=True)
+        def task(value):
+            done.append(value)
+            if len(done) == 2:
+                finished.set()
+
+        start = time.time()
+        task.spool(value="late", delay=0.3)
+        task.spool(value="early", delay=0.1)
+
+        self.assertTrue(finished.wait(5), "Delayed tasks did not run.")
+        self.assertEqual(done, ["early", "late"])
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+    def test_task_pool(self):
+        """
+        Test a full task queue drops or runs tasks inline, and draining finishes the queued ones.
+        """
+        for policy, expected in (("drop", ["queued"]), ("inline", ["inline", "queued"])):
+            done = []
+            release = threading.Event()
+            pool = decorators.TaskPool(workers=1, size=1, policy=policy)
+
+            pool.submit(release.wait, (), {})
+            while pool.queue.qsize():
+                time.sleep(0.01)
+            pool.submit(done.append, ("queued",), {})
+            pool.submit(done.append, ("inline",), {})
+
+            release.set()
+            pool.drain(secs=5)
+            stats = pool.stats()
+            self.assertEqual(done, expected)
+            self.assertEqual((stats['completed'], stats['depth']), (2, 0))
+            self.assertEqual(stats['dropped'] + stats['inline'], 1)
+
+    @override_settings(TASK_BACKEND="db", TASK_RETRY_SECS=0)
+    def test_task_queue(self):
+        """
+        Test database tasks collapse by key, wait until due and are retried until out of attempts.
+        """
+        calls = []
+
+        @spool(pass_arguments=True, key="test-{value}", retries=1)
+        def task(value):
+            calls.append(value)
+            if value == "fail":
+                raise ValueError(value)
+
+        task.spool(value="first")
+        task.spool(value="first")
+        task.spool(value="later", delay=60)
+        task.spool(value="fail")
+        self.assertEqual(Task.objects.count(), 3)
+
+        self.assertEqual(taskqueue.work(once=True), 3)
+        self.assertEqual(calls, ["first", "fail", "fail"])
+
+        states = dict(Task.objects.values_list("key", "state"))
+        self.assertEqual(states, {"test-first": Task.DONE, "test-later": Task.QUEUED, "test-fail": Task.FAILED})
+
+        # Periodic tasks are queued once per period.
+        ticks = decorators.timer(60)(lambda args: calls.append("tick"))
+        try:
+            taskqueue.schedule_timers()
+            taskqueue.QUEUED.clear()
+            taskqueue.schedule_timers()
+            self.assertEqual(taskqueue.work(once=True), 1)
+            self.assertEqual(calls[-1], "tick")
+        finally:
+            taskqueue.TIMERS.pop(taskqueue.task_name(ticks))
@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Load the conda commands.
+source ~/miniconda3/etc/profile.d/conda.sh
+
+export POSTGRES_HOST=/var/run/postgresql
+
+# Activate the conda environemnt.
+conda activate engine
+
+# Set the configuration module.
+export DJANGO_SETTINGS_MODULE=conf.run.site_settings
+
+# Recompute the similar posts of new and edited threads.
+python manage.py similar